@@ -0,0 +1,131 @@
+import os
+
+import pygame
+
+
+class AssetManager(object):
+
+    """
+    Central image store.
+
+    Each file is loaded once on first use, converted to the display pixel format (so blits
+    don't convert pixels every frame) and handed out as a shared reference. Callers must not
+    modify the returned surfaces.
+
+    Colour keys are applied according to the image format: opaque images get a RLE accelerated
+    colour key, images with per-pixel alpha get the keyed pixels made transparent (SDL ignores
+    colour keys when blitting per-pixel alpha surfaces).
+
+    With a SurfaceCache (lib.surfacecache), processed images (decoded, recoloured, keyed) are
+    stored on disk and later runs skip decoding and processing.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.sources = {}  # Raw files as loaded from disk
+        self.images = {}  # Prepared (converted) surfaces
+        self.memos = {}  # Other derived assets (see memo)
+
+    def load(self, filename):
+        """ Returns the raw (unconverted) image of a file, loading it the first time """
+        filename = os.path.abspath(filename)
+        if filename not in self.sources:
+            try:
+                self.sources[filename] = pygame.image.load(filename)
+            except pygame.error, message:
+                print 'Unable to load image:', filename
+                raise SystemExit(message)
+
+        return self.sources[filename]
+
+    def image(self, filename, colorkey=None):
+        """ Returns the prepared image of a file """
+        colorkey = self._colorkey_key(colorkey)
+        key = (os.path.abspath(filename), None, colorkey)
+        if key not in self.images:
+            self.images[key] = self._prepared(filename, ("image", colorkey), colorkey,
+                                              lambda: self.process(self.load(filename), colorkey))
+
+        return self.images[key]
+
+    def variant(self, filename, hue, colorkey=None):
+        """
+        Returns the prepared hue variant of an image (see lib.colorvariants).
+        Hues are rounded to whole degrees so close hues share the same surface.
+        """
+        from lib.colorvariants import hue_shift
+
+        hue = int(round(hue)) % 360
+        colorkey = self._colorkey_key(colorkey)
+        key = (os.path.abspath(filename), hue, colorkey)
+        if key not in self.images:
+            self.images[key] = self._prepared(filename, ("variant", hue, colorkey), colorkey,
+                                              lambda: self.process(hue_shift(self.load(filename), hue), colorkey))
+
+        return self.images[key]
+
+    def memo(self, key, factory):
+        """ Returns factory() computed once per key (e.g. frames sliced from a shared sheet) """
+        if key not in self.memos:
+            self.memos[key] = factory()
+
+        return self.memos[key]
+
+    def process(self, surface, colorkey=None):
+        """
+        Display independent processing of an image (the part that is cached on disk).
+        Per-pixel alpha images get their colour keyed pixels made transparent.
+        """
+        if colorkey is not None and surface.get_flags() & pygame.SRCALPHA:
+            surface = surface.copy()
+            self._colorkey_to_alpha(surface, colorkey)
+
+        return surface
+
+    def convert(self, surface, colorkey=None):
+        """ Converts surface to the display format, opaque images get their colour key """
+        if surface.get_flags() & pygame.SRCALPHA:
+            surface = surface.convert_alpha()
+        else:
+            surface = surface.convert()
+            if colorkey is not None:
+                surface.set_colorkey(colorkey, pygame.RLEACCEL)
+
+        return surface
+
+    def clear(self):
+        """ Forgets every loaded image """
+        self.sources.clear()
+        self.images.clear()
+        self.memos.clear()
+
+    def _prepared(self, filename, params, colorkey, create):
+        """ Returns the converted result of create(), going through the disk cache if there is one """
+        def convert(surface):
+            return self.convert(surface, colorkey)
+
+        if self.cache is None:
+            return convert(create())
+
+        key = self.cache.key(self.cache.file_hash(filename), *params)
+        return self.cache.get_or_create(key, create, convert)
+
+    def _colorkey_key(self, colorkey):
+        """ Colour keys can be given as names, Colors or tuples. Returns a hashable RGB tuple. """
+        if colorkey is None:
+            return None
+        if isinstance(colorkey, str):
+            colorkey = pygame.color.Color(colorkey)
+        return tuple(colorkey)[:3]
+
+    def _colorkey_to_alpha(self, surface, colorkey):
+        """ Makes transparent the pixels of a per-pixel alpha surface that match colorkey """
+        import numpy
+
+        pixels = pygame.surfarray.pixels3d(surface)
+        mask = numpy.all(pixels == numpy.array(colorkey, dtype=pixels.dtype), axis=-1)
+        del pixels
+        if mask.any():
+            alpha = pygame.surfarray.pixels_alpha(surface)
+            alpha[mask] = 0
+            del alpha
@@ -0,0 +1,154 @@
+"""
+Checkpoint files: the whole simulation state in a versioned binary format.
+
+A checkpoint is a set of named NumPy arrays (states are stored by column: one array per field
+with a row per node or agent) plus a small JSON metadata block:
+
+    header: magic "PHCK", version (uint16), array count (uint32), metadata size (uint32)
+    metadata (UTF-8 JSON)
+    arrays: name size (uint16), name, dtype size (uint8), dtype, dimensions (uint8),
+            shape (uint64 each), data (C order)
+
+All numbers are little endian. Files are written into a temporary file and renamed, so a crash
+while checkpointing never leaves a partial checkpoint.
+
+Fields (metadata keys or arrays) may be added without changing VERSION, readers fall back when a
+checkpoint doesn't have them: world_size defaults to screen_size, avoidable_places to the older
+avoidable_place, node.state_samples to every deferred sample, and the heatmap, exposure and
+variant states start empty with a warning. Removing a field or changing its meaning or layout must
+change VERSION. Files of older versions are upgraded when they are read (see UPGRADES), readers
+reject other versions.
+"""
+import itertools
+import json
+import os
+import struct
+import tempfile
+
+import numpy
+
+MAGIC = "PHCK"
+VERSION = 2
+HEADER = struct.Struct("<4sHII")
+NAME_SIZE = struct.Struct("<H")
+DTYPE_SIZE = struct.Struct("<B")
+DIMENSIONS = struct.Struct("<B")
+
+
+def write_checkpoint(path, metadata, arrays):
+    """ Writes metadata (JSON serializable) and arrays ({name: array}) into path """
+    encoded_metadata = json.dumps(metadata, separators=(",", ":")).encode("utf-8")
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as checkpoint_file:
+            checkpoint_file.write(HEADER.pack(MAGIC, VERSION, len(arrays), len(encoded_metadata)))
+            checkpoint_file.write(encoded_metadata)
+            for name in sorted(arrays):
+                array = numpy.ascontiguousarray(arrays[name])
+                dtype = array.dtype.newbyteorder("<") if array.dtype.byteorder == ">" else array.dtype
+                dtype_str = dtype.str
+                checkpoint_file.write(NAME_SIZE.pack(len(name)) + name)
+                checkpoint_file.write(DTYPE_SIZE.pack(len(dtype_str)) + dtype_str)
+                checkpoint_file.write(DIMENSIONS.pack(array.ndim))
+                checkpoint_file.write(struct.pack("<{0}Q".format(array.ndim), *array.shape))
+                checkpoint_file.write(array.astype(dtype, copy=False).tostring())
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def read_checkpoint(path):
+    """ Returns (metadata, {name: array}) of a checkpoint file. Raises ValueError if it is invalid. """
+    with open(path, "rb") as checkpoint_file:
+        data = checkpoint_file.read()
+
+    try:
+        magic, version, count, metadata_size = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Not a checkpoint file: {0}".format(path))
+        if version != VERSION and version not in UPGRADES:
+            raise ValueError("Unsupported checkpoint version {0} (expected {1}): {2}".format(version, VERSION, path))
+
+        offset = HEADER.size
+        metadata = json.loads(data[offset:offset + metadata_size].decode("utf-8"))
+        offset += metadata_size
+
+        arrays = {}
+        for _ in xrange(count):
+            name_size, = NAME_SIZE.unpack_from(data, offset)
+            offset += NAME_SIZE.size
+            name = data[offset:offset + name_size]
+            offset += name_size
+            dtype_size, = DTYPE_SIZE.unpack_from(data, offset)
+            offset += DTYPE_SIZE.size
+            dtype = numpy.dtype(data[offset:offset + dtype_size])
+            offset += dtype_size
+            dimensions, = DIMENSIONS.unpack_from(data, offset)
+            offset += DIMENSIONS.size
+            shape = struct.unpack_from("<{0}Q".format(dimensions), data, offset)
+            offset += 8 * dimensions
+            size = int(numpy.prod(shape)) * dtype.itemsize
+            if offset + size > len(data):
+                raise ValueError("Truncated checkpoint file: {0}".format(path))
+            # Copy, the arrays are modified once restored
+            arrays[name] = numpy.frombuffer(data, dtype, int(numpy.prod(shape)), offset).reshape(shape).copy()
+            offset += size
+    except struct.error:
+        raise ValueError("Truncated checkpoint file: {0}".format(path))
+
+    while version != VERSION:
+        UPGRADES[version](metadata, arrays)
+        version += 1
+    return metadata, arrays
+
+
+def upgrade_version_1(metadata, arrays):
+    """
+    Version 1 to 2: the mobility engine drew from a single NumPy RandomState (mobility.random.keys and
+    values), agents and group reference points now have their own random streams. Their keys are drawn
+    from that RandomState, so the run goes on (with other random values than version 1 would have drawn).
+    """
+    rng = numpy.random.RandomState()
+    position, has_gauss, cached_gaussian = arrays.pop("mobility.random.values").tolist()
+    rng.set_state(("MT19937", arrays.pop("mobility.random.keys"), int(position), int(has_gauss), cached_gaussian))
+
+    def streams(prefix, count):
+        arrays[prefix + "key"] = numpy.frombuffer(rng.bytes(8 * count), "<u8").astype(numpy.uint64)
+        arrays[prefix + "count"] = numpy.zeros(count, dtype=numpy.uint64)
+
+    streams("mobility.stream_", len(arrays["mobility.position"]))
+    if "mobility.group.reference" in arrays:
+        streams("mobility.group.reference_", len(arrays["mobility.group.reference"]))
+
+
+# Upgrade of the metadata and arrays of a version to the next one, by version
+UPGRADES = {1: upgrade_version_1}
+
+
+def encode_strings(values):
+    """ Encodes a list of strings as (table of distinct strings, index array) """
+    table = sorted(set(values))
+    positions = dict((value, position) for position, value in enumerate(table))
+    return table, numpy.array([positions[value] for value in values], dtype=numpy.int32)
+
+
+def decode_strings(table, indices):
+    return [table[index] for index in indices.tolist()]
+
+
+def python_random_state(rngs):
+    """ States of random.Random streams as (uint32 words (rows of 625), gauss_next (NaN for None)) """
+    states = [rng.getstate() for rng in rngs]
+    size = len(states[0][1]) if states else 0
+    words = numpy.fromiter(itertools.chain.from_iterable(state[1] for state in states), numpy.uint32,
+                           len(states) * size).reshape(len(states), size)
+    gauss = numpy.array([numpy.nan if state[2] is None else state[2] for state in states], dtype=numpy.float64)
+    return words, gauss
+
+
+def set_python_random_state(rng, version, words, gauss):
+    rng.setstate((version, tuple(words.tolist()), None if numpy.isnan(gauss) else float(gauss)))
+
@@ -0,0 +1,67 @@
+"""
+Procedural colour variants of sprite sheets.
+
+Variants are generated from a single base image by shifting the hue of its "coloured" pixels
+(saturated pixels whose hue is close to the base hue). Outlines, skin, white backgrounds and
+other details keep their colours. Everything is done with surfarray/numpy in bulk.
+Generated variants are cached and shared by lib.assets.AssetManager.
+"""
+import numpy
+import pygame
+
+BASE_HUE = 120.0  # Hue of the base sprites (green)
+HUE_TOLERANCE = 45.0  # Degrees around BASE_HUE that are recoloured
+MIN_SATURATION = 0.35  # Greyish pixels are never recoloured
+
+
+def rgb_to_hsv(rgb):
+    """ Converts an (..., 3) array of 0-255 RGB values into hue (degrees), saturation and value (0-1) """
+    rgb = rgb.astype(numpy.float32) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    maxc = rgb.max(axis=-1)
+    minc = rgb.min(axis=-1)
+    delta = maxc - minc
+    safe_delta = numpy.where(delta == 0, 1.0, delta)
+
+    hue = numpy.where(maxc == r, ((g - b) / safe_delta) % 6.0,
+                      numpy.where(maxc == g, (b - r) / safe_delta + 2.0, (r - g) / safe_delta + 4.0))
+    hue = numpy.where(delta == 0, 0.0, hue * 60.0)
+    saturation = numpy.where(maxc == 0, 0.0, delta / numpy.where(maxc == 0, 1.0, maxc))
+
+    return hue, saturation, maxc
+
+
+def hsv_to_rgb(hue, saturation, value):
+    """ Inverse of rgb_to_hsv. Returns an (..., 3) array of 0-255 uint8 values """
+    h = (hue % 360.0) / 60.0
+    c = value * saturation
+    x = c * (1 - numpy.abs(h % 2 - 1))
+    m = value - c
+    zeros = numpy.zeros_like(h)
+    sector = numpy.floor(h).astype(numpy.int32) % 6
+
+    r = numpy.choose(sector, [c, x, zeros, zeros, x, c])
+    g = numpy.choose(sector, [x, c, c, x, zeros, zeros])
+    b = numpy.choose(sector, [zeros, zeros, x, c, c, x])
+
+    rgb = numpy.stack([r + m, g + m, b + m], axis=-1)
+    return numpy.clip(numpy.rint(rgb * 255.0), 0, 255).astype(numpy.uint8)
+
+
+def hue_shift(surface, hue, base_hue=BASE_HUE, tolerance=HUE_TOLERANCE, min_saturation=MIN_SATURATION):
+    """ Returns a copy of surface where pixels of hue close to base_hue are moved to hue """
+    variant = surface.copy()
+    pixels = pygame.surfarray.pixels3d(variant)
+
+    pixel_hue, saturation, value = rgb_to_hsv(pixels)
+    hue_distance = numpy.abs((pixel_hue - base_hue + 180.0) % 360.0 - 180.0)
+    mask = (hue_distance <= tolerance) & (saturation >= min_saturation)
+
+    if mask.any():
+        shifted_hue = pixel_hue[mask] + (hue - base_hue)
+        pixels[mask] = hsv_to_rgb(shifted_hue, saturation[mask], value[mask])
+
+    # Unlock the surface
+    del pixels
+
+    return variant
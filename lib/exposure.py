@@ -0,0 +1,199 @@
+"""
+Exposure of sensitive places (avoidable places) by the nodes and their habitats.
+
+Every step each node is located among the places, and the time it spends inside them, its visits
+and its stays are counted. A visit is exposed while the habitat of the node covers (contains the
+center of) the place the node is in: the habitat then tells others the node may be there. The time
+each habitat covers at least one place is counted too (covering places the node is not in hides the
+visits).
+
+Places are rectangles in a uniform grid (a table of the places of each cell), so locating all the
+nodes is a few NumPy operations. The places covered by a habitat are only recomputed when its
+Region (see lib.overlap) changes, for all the changed habitats at once. Counts are kept by node in
+arrays, nothing loops over places and nodes in Python.
+"""
+import csv
+
+import numpy
+
+from lib.overlap import contains
+
+
+class ExposureTracker(object):
+
+    DEFAULT_CELL_SIZE = 128  # World pixels
+    BLOCK_SIZE = 1 << 22  # Habitat and place pairs tested at once when habitats change
+    # Counts by node stored in the simulation state: visits, seconds inside places, seconds of the current and
+    # longest stays, seconds covering places, seconds exposed and place the node is in (-1 for none)
+    STATE_ARRAYS = ("visits", "inside", "stay", "longest_stay", "covering", "exposed", "place")
+    REPORT_FIELDS = ("node", "visits", "inside_seconds", "longest_stay_seconds", "covering_seconds",
+                     "exposed_seconds", "exposed_fraction", "places_covered")
+
+    def __init__(self, places, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.keys = []  # Node keys by row
+        self.regions = []  # Last habitat Region (or None) by row
+        self._allocate(0)
+        self.set_places(places)
+
+    def set_places(self, places):
+        """ Sets the places as rectangles (left, top, right, bottom), keeping the counts """
+        self.places = numpy.array(places, dtype=numpy.float64).reshape(-1, 4)
+        self.centers = (self.places[:, :2] + self.places[:, 2:]) / 2.0
+        cell_size = self.cell_size
+        if len(self.places):
+            self.origin = numpy.floor(self.places[:, :2].min(axis=0) / cell_size) * cell_size
+            self.columns, self.rows = (numpy.floor((self.places[:, 2:].max(axis=0) - self.origin) / cell_size)
+                                       .astype(int) + 1).tolist()
+        else:
+            self.origin, self.columns, self.rows = numpy.zeros(2), 0, 0
+
+        # Places of each cell, padded with -1
+        cells = [[] for _ in xrange(self.columns * self.rows)]
+        cell_ranges = numpy.floor((self.places - numpy.tile(self.origin, 2)) / cell_size).astype(int).tolist()
+        for index, (first_column, first_row, last_column, last_row) in enumerate(cell_ranges):
+            for column in xrange(first_column, last_column + 1):
+                for row in xrange(first_row, last_row + 1):
+                    cells[column * self.rows + row].append(index)
+        depth = max([len(cell) for cell in cells] or [1]) or 1
+        self.cell_places = numpy.full((len(cells), depth), -1, dtype=numpy.intp)
+        for cell_index, cell in enumerate(cells):
+            self.cell_places[cell_index, :len(cell)] = cell
+
+        self.place[:] = -1
+        self.regions = [None] * len(self.keys)  # Coverage is recomputed
+
+    def _allocate(self, count):
+        self.visits = numpy.zeros(count, dtype=numpy.int64)
+        self.inside = numpy.zeros(count, dtype=numpy.float64)
+        self.stay = numpy.zeros(count, dtype=numpy.float64)
+        self.longest_stay = numpy.zeros(count, dtype=numpy.float64)
+        self.covering = numpy.zeros(count, dtype=numpy.float64)
+        self.exposed = numpy.zeros(count, dtype=numpy.float64)
+        self.place = numpy.full(count, -1, dtype=numpy.intp)
+        # Habitat shapes (see lib.overlap.contains) and number of places they cover
+        self.shapes = numpy.zeros((count, 7), dtype=numpy.float32)
+        self.has_shape = numpy.zeros(count, dtype=bool)
+        self.covered = numpy.zeros(count, dtype=numpy.int64)
+
+    def _set_keys(self, keys):
+        """ Sets the nodes (rows) keeping the counts of the nodes that remain """
+        previous = dict((key, row) for row, key in enumerate(self.keys))
+        kept = [(row, previous[key]) for row, key in enumerate(keys) if key in previous]
+        old = dict((name, getattr(self, name)) for name in self.STATE_ARRAYS)
+        self._allocate(len(keys))
+        if kept:
+            rows, old_rows = [numpy.array(indices, dtype=numpy.intp) for indices in zip(*kept)]
+            for name, values in old.iteritems():
+                getattr(self, name)[rows] = values[old_rows]
+        self.keys = keys
+        self.regions = [None] * len(keys)
+
+    def locate(self, positions):
+        """ Index of the place at each position ((N, 2) array), -1 outside every place """
+        located = numpy.full(len(positions), -1, dtype=numpy.intp)
+        if not len(self.places) or not len(positions):
+            return located
+        cells = numpy.floor((positions - self.origin) / self.cell_size).astype(numpy.intp)
+        valid = numpy.flatnonzero((cells[:, 0] >= 0) & (cells[:, 0] < self.columns) &
+                                  (cells[:, 1] >= 0) & (cells[:, 1] < self.rows))
+        candidates = self.cell_places[cells[valid, 0] * self.rows + cells[valid, 1]]
+        rects = self.places[candidates]
+        x, y = positions[valid, 0, None], positions[valid, 1, None]
+        hits = ((candidates >= 0) & (x >= rects[..., 0]) & (x < rects[..., 2]) &
+                (y >= rects[..., 1]) & (y < rects[..., 3]))
+        found = hits.any(axis=1)
+        located[valid[found]] = candidates[found, hits[found].argmax(axis=1)]
+        return located
+
+    def _update_coverage(self, changed, regions):
+        """ Recomputes the shapes of the changed rows and the number of places their habitats cover """
+        rows, bounds = [], []
+        for row in changed:
+            region = regions[row]
+            self.regions[row] = region
+            self.has_shape[row] = region is not None
+            self.covered[row] = 0
+            if region is not None:
+                self.shapes[row] = (region.center[0], region.center[1], region.axis[0], region.axis[1],
+                                    region.half_length, region.half_width, region.box)
+                rows.append(row)
+                bounds.append(region.bounds)
+        if not rows or not len(self.places):
+            return
+
+        # Candidates are the places with their center in the bounds of a habitat
+        rows, bounds = numpy.array(rows, dtype=numpy.intp), numpy.array(bounds, dtype=numpy.float64)
+        center_x, center_y = self.centers[:, 0], self.centers[:, 1]
+        block = max(1, self.BLOCK_SIZE // len(self.places))
+        for start in xrange(0, len(rows), block):
+            left, top, right, bottom = [side[:, None] for side in bounds[start:start + block].T]
+            pairs, places = numpy.nonzero((center_x >= left) & (center_x <= right) &
+                                          (center_y >= top) & (center_y <= bottom))
+            pairs = rows[start + pairs]
+            inside = contains(center_x[places, None], center_y[places, None], self.shapes[pairs])[:, 0]
+            self.covered += numpy.bincount(pairs[inside], minlength=len(self.keys))
+
+    def update(self, keys, positions, regions, dt):
+        """
+        Counts dt seconds of the nodes at positions ((N, 2) array) with habitat regions (Regions or None), both
+        by key in keys. Keys must be the same list object while the nodes don't change.
+        """
+        if keys is not self.keys:
+            self._set_keys(keys)
+        changed = [row for row, (region, previous) in enumerate(zip(regions, self.regions)) if region is not previous]
+        if changed:
+            self._update_coverage(changed, regions)
+
+        place = self.locate(positions)
+        inside = place >= 0
+        entered = inside & (place != self.place)
+        self.visits[entered] += 1
+        self.stay[entered] = 0.0
+        self.stay[inside] += dt
+        self.stay[~inside] = 0.0
+        numpy.maximum(self.longest_stay, self.stay, out=self.longest_stay)
+        self.inside[inside] += dt
+        self.place = place
+        self.covering[self.covered > 0] += dt
+
+        rows = numpy.flatnonzero(inside & self.has_shape)
+        if len(rows):
+            centers = self.centers[place[rows]]
+            exposed = contains(centers[:, 0, None], centers[:, 1, None], self.shapes[rows])[:, 0]
+            self.exposed[rows[exposed]] += dt
+
+    def get_state(self):
+        """ Returns (keys, {name: array copy}) of the counts """
+        return list(self.keys), dict((name, getattr(self, name).copy()) for name in self.STATE_ARRAYS)
+
+    def set_state(self, keys, arrays):
+        """ Restores a state returned by get_state """
+        self.keys = []
+        self._allocate(0)
+        self._set_keys(list(keys))
+        for name in self.STATE_ARRAYS:
+            getattr(self, name)[:] = arrays[name]
+
+    def clear(self):
+        self.keys = []
+        self.regions = []
+        self._allocate(0)
+
+    def report(self):
+        """ Returns the counts by node as a list of rows (see REPORT_FIELDS) """
+        rows = []
+        for row, key in enumerate(self.keys):
+            inside = self.inside[row]
+            rows.append((key, int(self.visits[row]), inside, self.longest_stay[row], self.covering[row],
+                         self.exposed[row], self.exposed[row] / inside if inside else 0.0, int(self.covered[row])))
+        return rows
+
+    def write_report(self, path):
+        """ Writes the report as CSV into path """
+        with open(path, "wb") as report_file:
+            writer = csv.writer(report_file)
+            writer.writerow(self.REPORT_FIELDS)
+            for row in self.report():
+                writer.writerow([value if isinstance(value, (int, long, basestring)) else "{0:.3f}".format(value)
+                                 for value in row])
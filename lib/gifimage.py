@@ -1,109 +1,200 @@
 """GIFImage by Matthew Roe"""
 
-import Image
+try:
+    from PIL import Image
+except ImportError:  # Old PIL
+    import Image
+import collections
+import os
 import pygame
 from pygame.locals import *
 
 import time
 
 
-class GIFImage(object):
+# Frame stores by file, shared by every GIFImage of the same file (see get_frame_store)
+_frame_stores = {}
 
-    def __init__(self, filename):
-        self.filename = filename
-        self.image = Image.open(filename)
-        self.frames = []
-        self.get_frames()
 
-        self.cur = 0
-        self.ptime = time.time()
+def get_frame_store(filename):
+    """ Returns the shared FrameStore of a file with a new reference, call release() when done """
+    filename = os.path.abspath(filename)
+    store = _frame_stores.get(filename)
+    if store is None:
+        store = _frame_stores[filename] = FrameStore(filename)
+    store.references += 1
+    return store
 
-        self.running = True
-        self.breakpoint = len(self.frames) - 1
-        self.startpoint = 0
-        self.reversed = False
 
-    def get_rect(self):
-        return pygame.rect.Rect((0, 0), self.image.size)
+class FrameStore(object):
+
+    """
+    Decoded frames of a GIF file, shared and reference counted.
+
+    Frame metadata (durations, tiles, palettes) is read when the file is opened, pixels are decoded
+    the first time a frame is needed and converted once to the display format. Decoded frames are
+    kept up to max_bytes, the least recently used ones are dropped beyond that and decoded again if
+    they are needed (cumulative animations decode from the nearest kept frame). Frames are read in
+    order from the file, going back to a dropped frame reads it again from the first one.
+    """
+
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
 
-    def get_frames(self):
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.references = 0
+        self.image = Image.open(filename)
+        self.size = self.image.size
+        self.frame_bytes = self.size[0] * self.size[1] * 4
+        self.frames = collections.OrderedDict()  # Frame index -> surface, least recently used first
+        self.read_frame_info()
+
+    def read_frame_info(self):
+        """ Reads (duration, box, palette, transparency) of every frame without decoding pixels """
         image = self.image
+        palettes = {}
 
-        pal = image.getpalette()
-        base_palette = []
-        for i in range(0, len(pal), 3):
-            rgb = pal[i:i + 3]
-            base_palette.append(rgb)
+        def get_palette(raw_palette):
+            # Palettes are converted in bulk and shared by the frames that use the same one
+            raw_palette = tuple(raw_palette)
+            if raw_palette not in palettes:
+                palettes[raw_palette] = zip(raw_palette[0::3], raw_palette[1::3], raw_palette[2::3])
+            return palettes[raw_palette]
 
         all_tiles = []
+        frames = []
+        base_palette = get_palette(image.getpalette())
         try:
             while 1:
                 if not image.tile:
                     image.seek(0)
                 if image.tile:
                     all_tiles.append(image.tile[0][3][0])
+
+                x0, y0, x1, y1 = (0, 0) + image.size
+                if image.tile:
+                    x0, y0, x1, y1 = image.tile[0][1]
+
+                frames.append({"duration": image.info.get("duration", 100) * .001,
+                               "box": (x0, y0, x1, y1),
+                               "palette": image.getpalette(),
+                               "transparency": image.info.get("transparency")})
                 image.seek(image.tell() + 1)
         except EOFError:
             image.seek(0)
 
         all_tiles = tuple(set(all_tiles))
+        # Cumulative animations draw each frame over the previous ones
+        self.cumulative = all_tiles in ((6,), (7,))
+        own_palettes = self.cumulative or all_tiles in ((7, 8), (8, 7))
+
+        self.durations = []
+        self.frame_info = []
+        for frame in frames:
+            palette = get_palette(frame["palette"]) if own_palettes and frame["palette"] else base_palette
+            self.durations.append(frame["duration"])
+            self.frame_info.append((frame["box"], palette, frame["transparency"]))
+
+    def __len__(self):
+        return len(self.frame_info)
+
+    def get(self, index):
+        """ Returns the surface of a frame, decoding it if needed """
+        frame = self.frames.get(index)
+        if frame is None:
+            frame = self.decode(index)
+        self.keep(index, frame)
+        return frame
+
+    def decode(self, index):
+        previous = None
+        if self.cumulative and index > 0:
+            # Start from the nearest kept frame (or from the first one)
+            start = index - 1
+            while start >= 0 and start not in self.frames:
+                start -= 1
+            previous = self.frames[start] if start >= 0 else None
+            for decoded in range(start + 1, index):
+                previous = self.decode_frame(decoded, previous)
+                self.keep(decoded, previous)
+
+        return self.decode_frame(index, previous)
+
+    def decode_frame(self, index, previous=None):
+        """ Decodes a frame (drawn over the previous one for cumulative animations) """
+        (x0, y0, x1, y1), palette, transparency = self.frame_info[index]
+        image = self.image
+        self.seek_image(index)
+        data = image.tobytes() if hasattr(image, "tobytes") else image.tostring()
+
+        pi = pygame.image.fromstring(data, image.size, image.mode)
+        pi.set_palette(palette)
+        if transparency is not None:
+            pi.set_colorkey(transparency)
+
+        frame = pygame.Surface(image.size, SRCALPHA)
+        if previous is not None:
+            frame.blit(previous, (0, 0))
+        frame.blit(pi, (x0, y0), (x0, y0, x1 - x0, y1 - y0))
+
+        # Convert once to the display format (if there is a display already)
+        if pygame.display.get_surface() is not None:
+            frame = frame.convert_alpha()
+
+        return frame
+
+    def seek_image(self, index):
+        """
+        Moves the PIL image to a frame. Old PIL only reads GIF frames in order (seeking anywhere but to the
+        next frame or to the first one fails), so going back rewinds to the first frame and reads forward.
+        """
+        image = self.image
+        if index < image.tell():
+            image.seek(0)
+        while image.tell() < index:
+            image.seek(image.tell() + 1)
 
-        try:
-            while 1:
-                try:
-                    duration = image.info["duration"]
-                except:
-                    duration = 100
+    def keep(self, index, frame):
+        """ Keeps a decoded frame as the most recently used one, dropping the least used ones beyond max_bytes """
+        self.frames.pop(index, None)
+        self.frames[index] = frame
+        while len(self.frames) > 1 and len(self.frames) * self.frame_bytes > self.max_bytes:
+            self.frames.popitem(last=False)
 
-                duration *= .001  # convert to milliseconds!
-                cons = False
+    def release(self):
+        """ Drops a reference, the frames are freed with the last one """
+        self.references -= 1
+        if self.references <= 0:
+            self.frames.clear()
+            if _frame_stores.get(self.filename) is self:
+                del _frame_stores[self.filename]
 
-                x0, y0, x1, y1 = (0, 0) + image.size
-                if image.tile:
-                    tile = image.tile
-                else:
-                    image.seek(0)
-                    tile = image.tile
-                if len(tile) > 0:
-                    x0, y0, x1, y1 = tile[0][1]
-
-                if all_tiles:
-                    if all_tiles in ((6,), (7,)):
-                        cons = True
-                        pal = image.getpalette()
-                        palette = []
-                        for i in range(0, len(pal), 3):
-                            rgb = pal[i:i + 3]
-                            palette.append(rgb)
-                    elif all_tiles in ((7, 8), (8, 7)):
-                        pal = image.getpalette()
-                        palette = []
-                        for i in range(0, len(pal), 3):
-                            rgb = pal[i:i + 3]
-                            palette.append(rgb)
-                    else:
-                        palette = base_palette
-                else:
-                    palette = base_palette
-
-                pi = pygame.image.fromstring(image.tostring(), image.size, image.mode)
-                pi.set_palette(palette)
-                if "transparency" in image.info:
-                    pi.set_colorkey(image.info["transparency"])
-                pi2 = pygame.Surface(image.size, SRCALPHA)
-                if cons:
-                    for i in self.frames:
-                        pi2.blit(i[0], (0, 0))
-                pi2.blit(pi, (x0, y0), (x0, y0, x1 - x0, y1 - y0))
-
-                self.frames.append([pi2, duration])
-                image.seek(image.tell() + 1)
-        except EOFError:
-            pass
+
+class GIFImage(object):
+
+    def __init__(self, filename, store=None):
+        self.filename = filename
+        if store is None:
+            store = get_frame_store(filename)
+        else:
+            store.references += 1
+        self.store = store
+
+        self.cur = 0
+        self.ptime = time.time()
+
+        self.running = True
+        self.breakpoint = len(self.store) - 1
+        self.startpoint = 0
+        self.reversed = False
+
+    def get_rect(self):
+        return pygame.rect.Rect((0, 0), self.store.size)
 
     def render(self, screen, pos):
         if self.running:
-            if time.time() - self.ptime > self.frames[self.cur][1]:
+            if time.time() - self.ptime > self.store.durations[self.cur]:
                 if self.reversed:
                     self.cur -= 1
                     if self.cur < self.startpoint:
@@ -115,24 +206,24 @@ class GIFImage(object):
 
                 self.ptime = time.time()
 
-        screen.blit(self.frames[self.cur][0], pos)
+        screen.blit(self.store.get(self.cur), pos)
 
     def seek(self, num):
         self.cur = num
         if self.cur < 0:
             self.cur = 0
-        if self.cur >= len(self.frames):
-            self.cur = len(self.frames) - 1
+        if self.cur >= self.length():
+            self.cur = self.length() - 1
 
     def set_bounds(self, start, end):
         if start < 0:
             start = 0
-        if start >= len(self.frames):
-            start = len(self.frames) - 1
+        if start >= self.length():
+            start = self.length() - 1
         if end < 0:
             end = 0
-        if end >= len(self.frames):
-            end = len(self.frames) - 1
+        if end >= self.length():
+            end = self.length() - 1
         if end < start:
             end = start
         self.startpoint = start
@@ -151,16 +242,16 @@ class GIFImage(object):
         self.seek(self.length() - 1)
 
     def get_height(self):
-        return self.image.size[1]
+        return self.store.size[1]
 
     def get_width(self):
-        return self.image.size[0]
+        return self.store.size[0]
 
     def get_size(self):
-        return self.image.size
+        return self.store.size
 
     def length(self):
-        return len(self.frames)
+        return len(self.store)
 
     def reverse(self):
         self.reversed = not self.reversed
@@ -170,8 +261,18 @@ class GIFImage(object):
         self.ptime = time.time()
         self.reversed = False
 
+    def close(self):
+        """ Releases the shared frames of the image """
+        if self.store is not None:
+            self.store.release()
+            self.store = None
+
+    def __del__(self):
+        self.close()
+
     def copy(self):
-        new = GIFImage(self.filename)
+        """ Returns a new image sharing the decoded frames of this one """
+        new = GIFImage(self.filename, self.store)
         new.running = self.running
         new.breakpoint = self.breakpoint
         new.startpoint = self.startpoint
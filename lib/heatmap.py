@@ -0,0 +1,134 @@
+"""
+Decayed visit density of the world on a grid, drawn as a translucent overlay.
+
+Every step adds the time each node spends in its cell, and older visits fade exponentially with
+a half-life, like the EWMA updates of the habitats: density(t + dt) = decay * density(t) + visits * dt.
+Instead of multiplying the whole grid by the decay every step, new visits get a weight that grows
+by 1 / decay (the grid is renormalized before the weight overflows), so a step costs work per node,
+not per cell.
+
+The grid is indexed [column, row] like pygame.surfarray arrays. It is drawn with NumPy only: the
+visible cells go through a colour (and alpha) lookup table into a small surface that is scaled to
+the view. The density changes slowly, so the scaled overlay is only rebuilt every REFRESH_STEPS
+steps or when the view changes.
+"""
+import math
+
+import numpy
+import pygame
+import pygame.surfarray
+
+
+def build_lookup_table(size=256):
+    """ RGBA colours from transparent blue (empty) through green and yellow to opaque red (densest) """
+    levels = numpy.linspace(0.0, 1.0, size)
+    stops = numpy.array([0.0, 0.25, 0.5, 0.75, 1.0])
+    table = numpy.empty((size, 4), dtype=numpy.uint8)
+    table[:, 0] = numpy.interp(levels, stops, [0, 0, 64, 255, 255])
+    table[:, 1] = numpy.interp(levels, stops, [0, 128, 255, 255, 0])
+    table[:, 2] = numpy.interp(levels, stops, [255, 255, 64, 0, 0])
+    table[:, 3] = numpy.interp(levels, stops, [0, 128, 160, 192, 224])
+    return table
+
+
+class Heatmap(object):
+
+    DEFAULT_CELL_SIZE = 16  # World pixels
+    DEFAULT_HALF_LIFE = 30.0  # Seconds (of simulation time)
+    MAX_WEIGHT = 1e100  # Renormalize the grid beyond this visit weight
+    LEVEL_SECONDS = 0.02  # Colour levels are logarithmic in density / LEVEL_SECONDS (+ 1)
+    REFRESH_STEPS = 10
+
+    def __init__(self, world_size, cell_size=DEFAULT_CELL_SIZE, half_life=DEFAULT_HALF_LIFE):
+        self.cell_size = cell_size
+        self.half_life = half_life
+        self.shape = (int(math.ceil(float(world_size[0]) / cell_size)),
+                      int(math.ceil(float(world_size[1]) / cell_size)))
+        self.density = numpy.zeros(self.shape, dtype=numpy.float64)  # Times weight
+        self.weight = 1.0  # Weight of the visits of the current step
+        self.lookup_table = build_lookup_table()
+        self.surface = None  # Surface of the visible cells (reused while its size doesn't change)
+        self.steps = 0  # Steps added
+        self.overlay = None  # (view key, steps, scaled surface, position) of the last draw
+
+    def add(self, positions, dt):
+        """ Decays the grid dt seconds and adds dt seconds of presence at each world position ((N, 2) array) """
+        self.steps += 1
+        self.weight /= 0.5 ** (dt / self.half_life)
+        if self.weight > self.MAX_WEIGHT:
+            self.density /= self.weight
+            self.weight = 1.0
+        if not len(positions):
+            return
+
+        cells = (positions // self.cell_size).astype(numpy.int64)
+        numpy.clip(cells[:, 0], 0, self.shape[0] - 1, out=cells[:, 0])
+        numpy.clip(cells[:, 1], 0, self.shape[1] - 1, out=cells[:, 1])
+        indices, counts = numpy.unique(cells[:, 0] * self.shape[1] + cells[:, 1], return_counts=True)
+        self.density.ravel()[indices] += counts * (dt * self.weight)
+
+    def get_density(self):
+        """ Returns the decayed density (seconds of recent presence by cell) """
+        return self.density / self.weight
+
+    def get_state(self):
+        """ Returns a copy of the grid and the visit weight (restoring both continues bit for bit) """
+        return self.density.copy(), self.weight
+
+    def set_state(self, density, weight):
+        if density.shape != self.shape:
+            raise ValueError("Heatmap of {0} cells, expected {1}".format(density.shape, self.shape))
+        self.density = density.astype(numpy.float64)
+        self.weight = weight
+        self.overlay = None
+
+    def clear(self):
+        self.density[:] = 0.0
+        self.weight = 1.0
+        self.overlay = None
+
+    def draw(self, surface, view, size):
+        """ Draws the cells shown on a display of size through a View (see lib.view) """
+        key = (view.scale, view.origin, size)
+        if self.overlay is None or self.overlay[0] != key or self.steps - self.overlay[1] >= self.REFRESH_STEPS:
+            image, position = self.render(view, size)
+            self.overlay = (key, self.steps, image, position)
+        if self.overlay[2]:
+            surface.blit(self.overlay[2], self.overlay[3])
+
+    def render(self, view, size):
+        """ Returns (image, render surface position) of the cells shown on a display of size, or (None, None) """
+        bounds = view.world_bounds(size)
+        first_column, first_row = max(0, int(bounds[0] // self.cell_size)), max(0, int(bounds[1] // self.cell_size))
+        last_column = min(self.shape[0], int(bounds[2] // self.cell_size) + 1)
+        last_row = min(self.shape[1], int(bounds[3] // self.cell_size) + 1)
+        if first_column >= last_column or first_row >= last_row:
+            return None, None
+
+        cells = self.density[first_column:last_column, first_row:last_row]
+        # Zoomed out, blocks of cells that fall on a single render pixel are reduced to their maximum
+        block = int(1.0 / (self.cell_size * view.scale))
+        if block > 1 and cells.shape[0] >= block and cells.shape[1] >= block:
+            columns, rows = cells.shape[0] // block, cells.shape[1] // block
+            last_column, last_row = first_column + columns * block, first_row + rows * block
+            cells = cells[:columns * block, :rows * block].reshape(columns, block, rows, block).max(axis=3).max(axis=1)
+
+        # Logarithmic levels relative to the densest cell, places where nodes wait don't hide the paths
+        unit = self.LEVEL_SECONDS * self.weight
+        peak = math.log1p(self.density.max() / unit)
+        if peak <= 0:
+            return None, None
+        levels = numpy.log1p(cells * (1.0 / unit))
+        levels *= (len(self.lookup_table) - 1) / peak
+        colors = self.lookup_table[levels.astype(numpy.intp)]
+
+        if self.surface is None or self.surface.get_size() != cells.shape:
+            self.surface = pygame.Surface(cells.shape, pygame.SRCALPHA, 32)
+        pygame.surfarray.pixels3d(self.surface)[...] = colors[:, :, :3]
+        pygame.surfarray.pixels_alpha(self.surface)[...] = colors[:, :, 3]
+
+        left, top = view.point((first_column * self.cell_size, first_row * self.cell_size))
+        right, bottom = view.point((last_column * self.cell_size, last_row * self.cell_size))
+        if right - left <= 0 or bottom - top <= 0:
+            return None, None
+        return pygame.transform.smoothscale(self.surface, (right - left, bottom - top)), (left, top)
@@ -0,0 +1,262 @@
+"""
+Position ingest server.
+
+Listens on UDP, TCP and Unix stream sockets for position updates of external devices (phones...)
+sent in binary frames:
+
+    header: magic "PHIP", version (uint16), record count (uint16)   (little endian)
+    record: device id (uint32), timestamp (float64), x (float32), y (float32)
+
+A UDP datagram carries one frame, stream sockets carry consecutive frames. Frames are parsed in
+bulk with NumPy by a background thread (select loop) and coalesced: only the newest update of
+each device is kept until the simulation drains them (once per step), so the simulation does
+work per device and step, not per update.
+
+Run as a module for a test client that sends random walks of many devices:
+
+    python -m lib.ingest tcp://127.0.0.1:7070 --devices 100 --rate 20000
+"""
+import argparse
+import errno
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+import numpy
+
+MAGIC = "PHIP"
+VERSION = 1
+HEADER = struct.Struct("<4sHH")
+RECORD = numpy.dtype([("device", "<u4"), ("time", "<f8"), ("x", "<f4"), ("y", "<f4")])
+MAX_RECORDS = (65507 - HEADER.size) // RECORD.itemsize  # Records that fit in a UDP datagram
+
+
+def parse_address(address):
+    """ Parses udp://host:port, tcp://host:port or unix:///path into (scheme, socket address) """
+    scheme, separator, location = address.partition("://")
+    if not separator or scheme not in ("udp", "tcp", "unix"):
+        raise ValueError("Invalid ingest address (udp://host:port, tcp://host:port or unix:///path): "
+                         "{0}".format(address))
+    if scheme == "unix":
+        return scheme, location
+    host, _, port = location.rpartition(":")
+    return scheme, (host or "127.0.0.1", int(port))
+
+
+def encode_frame(records):
+    """ Builds a frame from a RECORD array (at most 65535 records) """
+    return HEADER.pack(MAGIC, VERSION, len(records)) + records.tostring()
+
+
+def decode_frames(data):
+    """ Parses the complete frames at the start of data. Returns (RECORD arrays, bytes consumed). """
+    frames = []
+    offset = 0
+    while len(data) - offset >= HEADER.size:
+        magic, version, count = HEADER.unpack_from(data, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Invalid ingest frame")
+        end = offset + HEADER.size + count * RECORD.itemsize
+        if end > len(data):
+            break
+        frames.append(numpy.frombuffer(data, RECORD, count, offset + HEADER.size))
+        offset = end
+    return frames, offset
+
+
+class IngestServer(object):
+
+    """ Background listener that keeps the newest position of every device """
+
+    RECEIVE_SIZE = 256 * 1024
+
+    def __init__(self, addresses):
+        self.addresses = addresses
+        self.listeners = {}  # Socket -> scheme
+        self.streams = {}  # Connected stream socket -> pending bytes
+        self.latest = {}  # Device id -> (timestamp, x, y)
+        self.lock = threading.Lock()
+        self.received = 0  # Updates received
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        for address in self.addresses:
+            scheme, socket_address = parse_address(address)
+            if scheme == "udp":
+                listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            elif scheme == "tcp":
+                listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            else:
+                if os.path.exists(socket_address):
+                    os.unlink(socket_address)
+                listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            listener.bind(socket_address)
+            if scheme != "udp":
+                listener.listen(16)
+            listener.setblocking(False)
+            self.listeners[listener] = scheme
+            logging.info("Listening for positions on {0}".format(address))
+
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, name="ingest")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        for sock in self.streams.keys() + self.listeners.keys():
+            sock.close()
+        for address in self.addresses:
+            scheme, socket_address = parse_address(address)
+            if scheme == "unix" and os.path.exists(socket_address):
+                os.unlink(socket_address)
+
+    def serve(self):
+        """ Listener thread: select loop over listeners and connections """
+        while self.running:
+            readable, _, _ = select.select(self.listeners.keys() + self.streams.keys(), [], [], 0.2)
+            for sock in readable:
+                try:
+                    if sock in self.streams:
+                        self.read_stream(sock)
+                    elif self.listeners[sock] == "udp":
+                        self.read_datagrams(sock)
+                    else:
+                        connection, _ = sock.accept()
+                        connection.setblocking(False)
+                        self.streams[connection] = ""
+                except socket.error, error:
+                    if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        logging.warning("Ingest socket error: {0}".format(error))
+                        self.close_stream(sock)
+                except ValueError, message:
+                    logging.warning("Dropping ingest connection: {0}".format(message))
+                    self.close_stream(sock)
+
+    def read_datagrams(self, sock):
+        """ Reads every pending datagram (one frame each) """
+        frames = []
+        while True:
+            try:
+                datagram = sock.recv(65536)
+            except socket.error, error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            try:
+                frames.extend(decode_frames(datagram)[0])
+            except ValueError, message:
+                logging.warning("Dropping ingest datagram: {0}".format(message))
+        self.add(frames)
+
+    def read_stream(self, sock):
+        data = sock.recv(self.RECEIVE_SIZE)
+        if not data:
+            self.close_stream(sock)
+            return
+        data = self.streams[sock] + data
+        frames, consumed = decode_frames(data)
+        self.streams[sock] = data[consumed:]
+        self.add(frames)
+
+    def close_stream(self, sock):
+        if sock in self.streams:
+            del self.streams[sock]
+            sock.close()
+
+    def add(self, frames):
+        """ Coalesces updates: keeps the newest one of each device """
+        if not frames:
+            return
+        records = numpy.concatenate(frames) if len(frames) > 1 else frames[0]
+        received = len(records)
+        # Positions that are not numbers (NaN, infinite) are dropped
+        records = records[numpy.isfinite(records["x"]) & numpy.isfinite(records["y"])]
+        if not len(records):
+            with self.lock:
+                self.received += received
+            return
+        # Sort by device and time, the last record of each device is its newest one
+        order = numpy.lexsort((records["time"], records["device"]))
+        devices = records["device"][order]
+        last = numpy.flatnonzero(numpy.append(devices[1:] != devices[:-1], True))
+        newest = records[order[last]]
+
+        updates = zip(newest["device"].tolist(), newest["time"].tolist(),
+                      newest["x"].tolist(), newest["y"].tolist())
+        with self.lock:
+            self.received += received
+            latest = self.latest
+            for device, timestamp, x, y in updates:
+                previous = latest.get(device)
+                if previous is None or previous[0] <= timestamp:
+                    latest[device] = (timestamp, x, y)
+
+    def drain(self):
+        """ Returns {device id: (timestamp, x, y)} received since the last call """
+        with self.lock:
+            latest = self.latest
+            self.latest = {}
+        return latest
+
+
+def run_client(address, devices, rate, duration, size):
+    """ Test client: random walks of `devices` devices, sending `rate` updates per second """
+    scheme, socket_address = parse_address(address)
+    if scheme == "udp":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(socket_address)
+    else:
+        sock = socket.socket(socket.AF_UNIX if scheme == "unix" else socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect(socket_address)
+
+    positions = numpy.random.random_sample((devices, 2)) * size
+    batch = min(MAX_RECORDS, max(devices, rate // 100))
+    records = numpy.zeros(batch, RECORD)
+    start = time.time()
+    sent = 0
+    while time.time() - start < duration:
+        indices = numpy.random.randint(0, devices, batch)
+        positions[indices] += numpy.random.normal(0, 3, (batch, 2))
+        positions[indices] = numpy.clip(positions[indices], 0, numpy.asarray(size) - 1)
+        records["device"] = indices
+        records["time"] = time.time()
+        records["x"] = positions[indices, 0]
+        records["y"] = positions[indices, 1]
+        if scheme == "udp":
+            sock.send(encode_frame(records))
+        else:
+            sock.sendall(encode_frame(records))
+        sent += batch
+
+        # Keep the rate
+        delay = start + float(sent) / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    sock.close()
+    print "Sent {0} updates in {1:.1f} seconds".format(sent, time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser("PrivHab position ingest test client")
+    parser.add_argument('address', help='udp://host:port, tcp://host:port or unix:///path')
+    parser.add_argument('--devices', type=int, default=50, help='number of simulated devices.')
+    parser.add_argument('--rate', type=int, default=10000, help='updates per second.')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to send updates.')
+    parser.add_argument('--size', type=int, nargs=2, default=[1024, 768], help='area of the positions.')
+    options = parser.parse_args()
+    run_client(options.address, options.devices, options.rate, options.duration, options.size)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,48 @@
 # -*- coding: utf-8 -*-
 from pygame import *
 from pygame import gfxdraw
-font.init()
 
 from os.path import dirname, join
 
-FGCOLOR = Color(0x161212f0)
-FGHIGHTLIGHT = Color(0x161212f0)
-BGCOLOR = Color(0xf2f1ebf0)
-BGHIGHTLIGHT = Color(0x804a50a0)
-BORDER_HL = Color(0x804a50ff)
-FGLOWLIGHT = Color(0xbfb9b4a0)
-BORDER_LEFT = Color(0xc0c0c0f0)
-BORDER_RIGHT = Color(0x303030f0)
+
+class LazyFont(object):
+
+    """ Font that initializes pygame.font and loads its file the first time it is used. """
+
+    def __init__(self, filename, size):
+        self._filename = filename
+        self._size = size
+        self._font = None
+
+    def __getattr__(self, name):
+        if self._font is None:
+            font.init()
+            self._font = font.Font(self._filename, self._size)
+        return getattr(self._font, name)
+
+
+# Colors are created by init() (unless they have already been set)
+DEFAULT_COLORS = {
+    "FGCOLOR": 0x161212f0,
+    "FGHIGHTLIGHT": 0x161212f0,
+    "BGCOLOR": 0xf2f1ebf0,
+    "BGHIGHTLIGHT": 0x804a50a0,
+    "BORDER_HL": 0x804a50ff,
+    "FGLOWLIGHT": 0xbfb9b4a0,
+    "BORDER_LEFT": 0xc0c0c0f0,
+    "BORDER_RIGHT": 0x303030f0,
+}
+FGCOLOR = None
+FGHIGHTLIGHT = None
+BGCOLOR = None
+BGHIGHTLIGHT = None
+BORDER_HL = None
+FGLOWLIGHT = None
+BORDER_LEFT = None
+BORDER_RIGHT = None
 BUTTON = 1
 SWITCH = 0
-FONT = font.Font(join(dirname(__file__), "../data/Roboto-Regular.ttf"), 20)
+FONT = LazyFont(join(dirname(__file__), "../data/Roboto-Regular.ttf"), 20)
 try:
     Arrow = "»".decode('utf-8')
 except AttributeError:
@@ -28,6 +55,9 @@ def init():
     if not DISPLAY:
         raise AttributeError('set video before init MenuSystem')
     DISPLAYRECT = DISPLAY.get_rect()
+    for name, value in DEFAULT_COLORS.items():
+        if globals()[name] is None:
+            globals()[name] = Color(value)
 
 
 class Menu(Rect, object):
@@ -0,0 +1,571 @@
+"""
+Vectorized mobility engine.
+
+Keeps the state of every automatically moving character in NumPy arrays and advances all of
+them at once. How agents choose where to go is delegated to mobility models (see MODELS), each
+model steps all of its agents with array operations:
+
+ * home-work: random waypoints inside the home or workplace area, switching area now and then
+   (the original demo movement).
+ * random-waypoint: random waypoints over the whole screen, with random trip speeds and pauses.
+ * levy-walk: flights of heavy tailed (truncated Pareto) length in random directions, with heavy
+   tailed pauses.
+ * schedule: a daily schedule over several anchors (home, workplace and two leisure places),
+   wandering around the current anchor.
+ * group: reference point group mobility, members follow the random waypoints of their group
+   keeping a random offset.
+
+Every agent draws from its own random stream: a counter-based generator (SplitMix64 of the agent
+key plus a per-agent counter, see draw), keyed from the random stream of its node. Vectorized draws
+advance the counter of each agent by the values it takes, so the trajectory of an agent doesn't
+depend on the draws of the others (changing the model of a node, pausing or moving it by hand leaves
+every other path unchanged). Group reference points have their own streams, keyed from their first
+member.
+
+Agents always walk towards their target in one of 8 directions (components snapped to -1, 0 or 1),
+so the characters can use their 8 direction sprites. With a navigation grid (see lib.navigation)
+they follow the shared flow field of the area of their target around obstacles instead. Models are
+stateless strategies: the agent state lives in the engine arrays (the group model keeps the state of
+its groups).
+"""
+import math
+
+import numpy
+
+import lib.tracing as tracing
+from lib.names import MODEL_NAMES, DEFAULT_MODEL
+
+# Anchors (areas agents move in). Home and workplace are set by the characters.
+HOME = 0
+WORKPLACE = 1
+LEISURE_1 = 2
+LEISURE_2 = 3
+ANCHORS = 4
+NO_AREA = -1
+
+# X and Y Component magnitude when moving at 45 degree angles
+ANGLE_UNIT_SPEED = math.sqrt(2) / 2
+
+TRACE_NEXT_POSITION = tracing.event_type("character.next_position", "node", "x", "y")
+
+
+# SplitMix64 constants
+GOLDEN_GAMMA = numpy.uint64(0x9E3779B97F4A7C15)
+MIX_1 = numpy.uint64(0xBF58476D1CE4E5B9)
+MIX_2 = numpy.uint64(0x94D049BB133111EB)
+SHIFTS = [numpy.uint64(shift) for shift in (30, 27, 31, 11)]
+
+
+def draw(keys, counters, indices, columns=None):
+    """
+    Uniform samples in [0, 1) of the streams at indices (keys and counters are uint64 arrays), one per
+    stream or an array of columns per stream. The counters of the streams advance by the values taken.
+    """
+    values = 1 if columns is None else columns
+    with numpy.errstate(over="ignore"):
+        steps = counters[indices][:, None] + numpy.arange(1, values + 1, dtype=numpy.uint64)
+        z = keys[indices][:, None] + steps * GOLDEN_GAMMA
+        z = (z ^ (z >> SHIFTS[0])) * MIX_1
+        z = (z ^ (z >> SHIFTS[1])) * MIX_2
+        z ^= z >> SHIFTS[2]
+    counters[indices] += numpy.uint64(values)
+    samples = (z >> SHIFTS[3]) * 2.0 ** -53
+    return samples[:, 0] if columns is None else samples
+
+
+def one_in(engine, indices, n):
+    """ Boolean array (per agent) where each value is True with probability 1 / n """
+    return engine.random_sample(indices) * int(round(n)) < 1
+
+
+def truncated_pareto(samples, minimum, maximum, alpha):
+    """ Uniform samples mapped to a Pareto distribution of exponent alpha, scale minimum, truncated at maximum """
+    return numpy.minimum(minimum * samples ** (-1.0 / alpha), maximum)
+
+
+class MobilityModel(object):
+
+    """
+    Base mobility model. Subclasses implement start (first step of agents) and arrive (agents that
+    reached their target), and may implement update (every step, before moving).
+    """
+
+    NAME = None
+    TARGET_SIZE = 50  # Pixels. Side of the square around the target that counts as arrived.
+    NEEDS_AREAS = False  # Whether agents need their home and workplace areas set to move
+
+    def start(self, engine, indices, now, bounds):
+        raise NotImplementedError
+
+    def update(self, engine, indices, now, dt, bounds):
+        pass
+
+    def arrive(self, engine, indices, now, bounds):
+        raise NotImplementedError
+
+    def get_state(self):
+        """ Model state (arrays by name) for checkpoints, stateless models have none """
+        return {}
+
+    def set_state(self, state):
+        pass
+
+
+class HomeWorkWaypoint(MobilityModel):
+
+    """ Random waypoints inside the home or workplace area, with stops and area changes """
+
+    NAME = "home-work"
+    NEEDS_AREAS = True
+
+    STOP_FOR_A_WHILE_PROBABILITY = 1.0 / 50.0
+    STOP_FOR_A_WHILE_TIME_INTERVAL = [5, 15]  # Seconds (of simulation time)
+    MINI_STOP_PROBABILITY = 1.0 / 10.0
+    MINI_STOP_INTERVAL = [0, 3]  # Seconds
+    AREA_CHANGE_PROBABILITY = 1.0 / 15.0
+
+    def start(self, engine, indices, now, bounds):
+        engine.area[indices] = engine.randint(indices, 0, 2)
+        engine.target_in_areas(indices, bounds)
+        engine.position[indices] = numpy.trunc(engine.position[indices])
+
+    def arrive(self, engine, indices, now, bounds):
+        long_stop = one_in(engine, indices, 1.0 / self.STOP_FOR_A_WHILE_PROBABILITY)
+        mini_stop = ~long_stop & one_in(engine, indices, 1.0 / self.MINI_STOP_PROBABILITY)
+        new_target = ~(long_stop | mini_stop)
+
+        stopping = indices[long_stop]
+        engine.wait_until[stopping] = now + engine.randint(
+            stopping, self.STOP_FOR_A_WHILE_TIME_INTERVAL[0], self.STOP_FOR_A_WHILE_TIME_INTERVAL[1] + 1)
+        stopping = indices[mini_stop]
+        engine.wait_until[stopping] = now + engine.randint(
+            stopping, self.MINI_STOP_INTERVAL[0], self.MINI_STOP_INTERVAL[1] + 1)
+
+        leaving = indices[new_target]
+        if leaving.size:
+            change = leaving[one_in(engine, leaving, 1.0 / self.AREA_CHANGE_PROBABILITY)]
+            engine.area[change] = 1 - engine.area[change]
+            engine.target_in_areas(leaving, bounds)
+
+
+class RandomWaypoint(MobilityModel):
+
+    """ Classic random waypoint: uniform targets over the whole screen, random speeds and pauses """
+
+    NAME = "random-waypoint"
+    SPEED_FACTOR_INTERVAL = [0.5, 1.5]  # Trip speed relative to the character speed
+    PAUSE_INTERVAL = [0.0, 5.0]  # Seconds
+
+    def start(self, engine, indices, now, bounds):
+        self.new_trips(engine, indices, bounds)
+
+    def arrive(self, engine, indices, now, bounds):
+        engine.wait_until[indices] = now + engine.uniform(indices, self.PAUSE_INTERVAL[0], self.PAUSE_INTERVAL[1])
+        self.new_trips(engine, indices, bounds)
+
+    def new_trips(self, engine, indices, bounds):
+        engine.speed_factor[indices] = engine.uniform(
+            indices, self.SPEED_FACTOR_INTERVAL[0], self.SPEED_FACTOR_INTERVAL[1])
+        target = engine.random_sample(indices, 2) * bounds
+        engine.set_targets(indices, target, bounds)
+
+
+class LevyWalk(MobilityModel):
+
+    """
+    Levy walk: flight lengths and pause times follow truncated power laws, as observed in human
+    walks (many short moves, a few very long ones).
+    """
+
+    NAME = "levy-walk"
+    TARGET_SIZE = 10
+    FLIGHT_ALPHA = 1.5
+    FLIGHT_LENGTH = [20.0, 800.0]  # Pixels (minimum, maximum)
+    PAUSE_ALPHA = 1.2
+    PAUSE_TIME = [0.5, 30.0]  # Seconds (minimum, maximum)
+
+    def start(self, engine, indices, now, bounds):
+        self.new_flights(engine, indices, bounds)
+
+    def arrive(self, engine, indices, now, bounds):
+        engine.wait_until[indices] = now + truncated_pareto(
+            engine.random_sample(indices), self.PAUSE_TIME[0], self.PAUSE_TIME[1], self.PAUSE_ALPHA)
+        self.new_flights(engine, indices, bounds)
+
+    def new_flights(self, engine, indices, bounds):
+        length = truncated_pareto(engine.random_sample(indices), self.FLIGHT_LENGTH[0], self.FLIGHT_LENGTH[1],
+                                  self.FLIGHT_ALPHA)
+        angle = engine.uniform(indices, 0, 2 * math.pi)
+        target = engine.position[indices] + length[:, None] * numpy.column_stack([numpy.cos(angle), numpy.sin(angle)])
+        # Flights that would leave the screen end at its border
+        engine.set_targets(indices, target, bounds)
+
+
+class DailySchedule(MobilityModel):
+
+    """
+    Multi-anchor daily schedule. The (simulated) day is split in slots, each one spent around an
+    anchor (home, workplace or one of two leisure places). Each agent follows the schedule with its
+    own phase, and wanders around the current anchor with short pauses.
+    """
+
+    NAME = "schedule"
+    NEEDS_AREAS = True
+
+    DAY_LENGTH = 240.0  # Seconds of simulation time
+    # (Start of the slot as a fraction of the day, anchor)
+    SCHEDULE = ((0.0, HOME), (0.30, WORKPLACE), (0.50, LEISURE_1), (0.58, WORKPLACE),
+                (0.78, LEISURE_2), (0.88, HOME))
+    PHASE_JITTER = 0.05  # Fraction of the day
+    LEISURE_AREA = [150, 150]
+    PAUSE_INTERVAL = [0.0, 4.0]  # Seconds
+
+    def __init__(self):
+        self.slot_starts = numpy.array([start for start, _ in self.SCHEDULE])
+        self.slot_anchors = numpy.array([anchor for _, anchor in self.SCHEDULE])
+
+    def start(self, engine, indices, now, bounds):
+        engine.phase[indices] = engine.uniform(indices, -self.PHASE_JITTER, self.PHASE_JITTER) * self.DAY_LENGTH
+
+        # Leisure places are random areas of the screen
+        for anchor in (LEISURE_1, LEISURE_2):
+            center_x = engine.randint(indices, 0, bounds[0])
+            center_y = engine.randint(indices, 0, bounds[1])
+            engine.areas[indices, anchor] = numpy.column_stack([
+                center_x - self.LEISURE_AREA[0] // 2, center_y - self.LEISURE_AREA[1] // 2,
+                center_x + self.LEISURE_AREA[0] // 2, center_y + self.LEISURE_AREA[1] // 2])
+            engine.has_areas[indices, anchor] = True
+
+        engine.area[indices] = self.current_anchor(engine, indices, now)
+        engine.target_in_areas(indices, bounds)
+
+    def update(self, engine, indices, now, dt, bounds):
+        anchor = self.current_anchor(engine, indices, now)
+        switching = anchor != engine.area[indices]
+        if switching.any():
+            engine.area[indices[switching]] = anchor[switching]
+            engine.target_in_areas(indices[switching], bounds)
+
+    def arrive(self, engine, indices, now, bounds):
+        engine.wait_until[indices] = now + engine.uniform(indices, self.PAUSE_INTERVAL[0], self.PAUSE_INTERVAL[1])
+        engine.target_in_areas(indices, bounds)
+
+    def current_anchor(self, engine, indices, now):
+        time_of_day = ((now + engine.phase[indices]) % self.DAY_LENGTH) / self.DAY_LENGTH
+        return self.slot_anchors[numpy.searchsorted(self.slot_starts, time_of_day, side="right") - 1]
+
+
+class GroupMobility(MobilityModel):
+
+    """
+    Reference point group mobility. Agents join groups of GROUP_SIZE in the order they start. Each
+    group has a reference point that moves with random waypoints, members go to random points around it.
+    Reference points draw from their own streams, keyed from the stream of the first member.
+    """
+
+    NAME = "group"
+    GROUP_SIZE = 4
+    GROUP_RADIUS = 60  # Pixels. Maximum distance of a member target from the reference point.
+    REFERENCE_SPEED = 60  # Pixels per second (slower than characters so members keep up)
+    REFERENCE_PAUSE_INTERVAL = [0.0, 8.0]  # Seconds
+
+    def __init__(self):
+        self.members = 0
+        self.reference = numpy.zeros((0, 2))
+        self.reference_target = numpy.zeros((0, 2))
+        self.reference_wait = numpy.zeros(0)
+        self.reference_key = numpy.zeros(0, dtype=numpy.uint64)
+        self.reference_count = numpy.zeros(0, dtype=numpy.uint64)
+
+    def start(self, engine, indices, now, bounds):
+        groups = (self.members + numpy.arange(indices.size)) // self.GROUP_SIZE
+        self.members += indices.size
+        engine.group[indices] = groups
+
+        new_groups = groups[-1] + 1 - len(self.reference)
+        if new_groups > 0:
+            # New groups start where their first member is
+            first_members = indices[numpy.unique(groups, return_index=True)[1]][-new_groups:]
+            start = engine.position[first_members]
+            self.reference = numpy.concatenate([self.reference, start])
+            self.reference_target = numpy.concatenate([self.reference_target, start])
+            self.reference_wait = numpy.concatenate([self.reference_wait, numpy.zeros(new_groups)])
+            self.reference_key = numpy.concatenate([self.reference_key, ~engine.stream_key[first_members]])
+            self.reference_count = numpy.concatenate([self.reference_count,
+                                                      numpy.zeros(new_groups, dtype=numpy.uint64)])
+
+        self.new_member_targets(engine, indices, bounds)
+
+    def update(self, engine, indices, now, dt, bounds):
+        # Move the reference points of the groups of the given agents
+        groups = numpy.unique(engine.group[indices])
+        groups = groups[self.reference_wait[groups] <= now]
+        vector = self.reference_target[groups] - self.reference[groups]
+        distance = numpy.hypot(vector[:, 0], vector[:, 1])
+        step = self.REFERENCE_SPEED * dt
+        arrived = distance <= step
+
+        moving = ~arrived
+        self.reference[groups[moving]] += vector[moving] / distance[moving, None] * step
+
+        arrived = groups[arrived]
+        if arrived.size:
+            self.reference[arrived] = self.reference_target[arrived]
+            low, high = self.REFERENCE_PAUSE_INTERVAL
+            self.reference_wait[arrived] = now + low + (high - low) * draw(
+                self.reference_key, self.reference_count, arrived)
+            self.reference_target[arrived] = draw(self.reference_key, self.reference_count, arrived, 2) * bounds
+
+        # Members follow the moving reference point
+        following = indices[numpy.in1d(engine.group[indices], groups)]
+        engine.target[following] = engine.reachable(following, self.member_targets(engine, following), bounds)
+
+    def arrive(self, engine, indices, now, bounds):
+        self.new_member_targets(engine, indices, bounds)
+
+    def new_member_targets(self, engine, indices, bounds):
+        radius = self.GROUP_RADIUS * numpy.sqrt(engine.random_sample(indices))
+        angle = engine.uniform(indices, 0, 2 * math.pi)
+        engine.offset[indices] = radius[:, None] * numpy.column_stack([numpy.cos(angle), numpy.sin(angle)])
+        engine.set_targets(indices, self.member_targets(engine, indices), bounds)
+
+    def member_targets(self, engine, indices):
+        return (self.reference[engine.group[indices]] + engine.offset[indices]).astype(numpy.int64)
+
+    def get_state(self):
+        return {"members": numpy.array([self.members]), "reference": self.reference.copy(),
+                "reference_target": self.reference_target.copy(), "reference_wait": self.reference_wait.copy(),
+                "reference_key": self.reference_key.copy(), "reference_count": self.reference_count.copy()}
+
+    def set_state(self, state):
+        self.members = int(state["members"][0])
+        self.reference = state["reference"].copy()
+        self.reference_target = state["reference_target"].copy()
+        self.reference_wait = state["reference_wait"].copy()
+        self.reference_key = state["reference_key"].copy()
+        self.reference_count = state["reference_count"].copy()
+
+
+MODELS = (HomeWorkWaypoint, RandomWaypoint, LevyWalk, DailySchedule, GroupMobility)
+assert MODEL_NAMES == tuple(model.NAME for model in MODELS) and DEFAULT_MODEL == HomeWorkWaypoint.NAME
+
+
+class MobilityEngine(object):
+
+    INITIAL_CAPACITY = 16
+    # Agent arrays stored by checkpoints (the step outputs are recomputed by the next step)
+    STATE_ARRAYS = ("position", "target", "speed", "speed_factor", "size", "wait_until", "model", "started",
+                    "area", "areas", "has_areas", "phase", "group", "offset", "active", "trace_id",
+                    "stream_key", "stream_count")
+
+    def __init__(self):
+        self.models = [model() for model in MODELS]
+        self.model_ids = dict((model.NAME, model_id) for model_id, model in enumerate(self.models))
+        self.count = 0
+        self._allocate(self.INITIAL_CAPACITY)
+        self.navigation = None  # NavigationGrid agents route with (straight lines without one)
+
+    def _allocate(self, capacity):
+        """ (Re)allocates the agent arrays keeping the current agents """
+        def grow(array, shape, dtype, fill):
+            new_array = numpy.full((capacity,) + shape, fill, dtype=dtype)
+            if array is not None:
+                new_array[:self.count] = array[:self.count]
+            return new_array
+
+        current = getattr(self, "position", None) is not None
+        self.capacity = capacity
+        self.position = grow(self.position if current else None, (2,), numpy.float64, 0.0)
+        self.target = grow(self.target if current else None, (2,), numpy.int64, 0)
+        self.speed = grow(self.speed if current else None, (), numpy.float64, 0.0)
+        self.speed_factor = grow(self.speed_factor if current else None, (), numpy.float64, 1.0)
+        self.size = grow(self.size if current else None, (2,), numpy.int64, 0)
+        self.wait_until = grow(self.wait_until if current else None, (), numpy.float64, 0.0)
+        self.model = grow(self.model if current else None, (), numpy.int8, 0)
+        self.started = grow(self.started if current else None, (), bool, False)
+        self.area = grow(self.area if current else None, (), numpy.int8, NO_AREA)
+        # Anchor areas as [[left, top, right, bottom]] (inclusive for sampling)
+        self.areas = grow(self.areas if current else None, (ANCHORS, 4), numpy.int64, 0)
+        self.has_areas = grow(self.has_areas if current else None, (ANCHORS,), bool, False)
+        # Model specific: schedule phase (seconds), group and offset from the group reference point
+        self.phase = grow(self.phase if current else None, (), numpy.float64, 0.0)
+        self.group = grow(self.group if current else None, (), numpy.int64, 0)
+        self.offset = grow(self.offset if current else None, (2,), numpy.float64, 0.0)
+        self.active = grow(self.active if current else None, (), bool, False)
+        # Step outputs: direction of the last movement and agents that moved
+        self.direction = grow(self.direction if current else None, (2,), numpy.int64, 0)
+        self.moved = grow(self.moved if current else None, (), bool, False)
+        self.trace_id = grow(self.trace_id if current else None, (), numpy.int64, 0)
+        # Random stream of each agent: key and values drawn so far (see draw)
+        self.stream_key = grow(self.stream_key if current else None, (), numpy.uint64, 0)
+        self.stream_count = grow(self.stream_count if current else None, (), numpy.uint64, 0)
+
+    def get_state(self):
+        """ Returns a copy of the engine state (agents with their random streams and models) as arrays by name """
+        state = dict((name, getattr(self, name)[:self.count].copy()) for name in self.STATE_ARRAYS)
+        for model in self.models:
+            for name, array in model.get_state().iteritems():
+                state["{0}.{1}".format(model.NAME, name)] = array
+        return state
+
+    def set_state(self, state):
+        """ Restores a state returned by get_state, replacing every agent """
+        count = len(state["position"])
+        self.count = 0
+        self.position = None
+        self._allocate(max(self.INITIAL_CAPACITY, count))
+        self.count = count
+        for name in self.STATE_ARRAYS:
+            getattr(self, name)[:count] = state[name]
+        for model in self.models:
+            prefix = model.NAME + "."
+            model_state = dict((name[len(prefix):], array) for name, array in state.iteritems()
+                               if name.startswith(prefix))
+            if model_state:
+                model.set_state(model_state)
+
+    def add_agent(self, position, size, speed, active=True, trace_id=0, model=DEFAULT_MODEL, key=0):
+        """
+        Adds an agent at position (center) with a sprite of size. key (64 bits) seeds its random stream.
+        Returns its index.
+        """
+        if self.count == self.capacity:
+            self._allocate(self.capacity * 2)
+
+        index = self.count
+        self.count += 1
+        self.position[index] = position
+        self.size[index] = size
+        self.speed[index] = speed
+        self.active[index] = active
+        self.trace_id[index] = trace_id
+        self.stream_key[index] = key
+        self.stream_count[index] = 0
+        self.set_model(index, model)
+
+        return index
+
+    def set_area(self, index, area, rect):
+        """ Sets the home or workplace area (a pygame Rect) of an agent """
+        self.areas[index, area] = (rect.left, rect.top, rect.right, rect.bottom)
+        self.has_areas[index, area] = True
+
+    def set_model(self, index, name):
+        """ Sets the mobility model of an agent (one of MODEL_NAMES), it starts again on the next step """
+        self.model[index] = self.model_ids[name]
+        self.started[index] = False
+        self.wait_until[index] = 0
+        self.speed_factor[index] = 1.0
+
+    def get_model(self, index):
+        return self.models[self.model[index]].NAME
+
+    def set_position(self, index, position):
+        self.position[index] = position
+
+    def get_position(self, index):
+        return self.position[index]
+
+    def set_active(self, index, active):
+        self.active[index] = active
+
+    def random_sample(self, indices, columns=None):
+        """ Uniform samples in [0, 1) from the streams of agents (see draw) """
+        return draw(self.stream_key, self.stream_count, indices, columns)
+
+    def uniform(self, indices, low, high):
+        return low + (high - low) * self.random_sample(indices)
+
+    def randint(self, indices, low, high):
+        """ Random integers in [low, high) from the streams of agents, bounds may be per agent arrays """
+        return low + numpy.floor(self.random_sample(indices) * (high - low)).astype(numpy.int64)
+
+    def reachable(self, indices, targets, bounds):
+        """ Clamps targets to the positions agents can reach (their sprites are kept inside bounds) """
+        half_size = self.size[indices] // 2
+        return numpy.clip(targets, half_size, numpy.asarray(bounds) - self.size[indices] + half_size)
+
+    def set_targets(self, indices, targets, bounds):
+        self.target[indices] = self.reachable(indices, numpy.asarray(targets, dtype=numpy.int64), bounds)
+
+        if tracing.ENABLED:
+            for index in indices:
+                tracing.emit(TRACE_NEXT_POSITION, self.trace_id[index], self.target[index, 0], self.target[index, 1])
+
+    def target_in_areas(self, indices, bounds):
+        """ Random targets inside the current area of agents (and inside bounds (width, height)) """
+        areas = self.areas[indices, self.area[indices]]
+        left = numpy.maximum(areas[:, 0], 0)
+        top = numpy.maximum(areas[:, 1], 0)
+        right = numpy.maximum(numpy.minimum(areas[:, 2], bounds[0] - 1), left)
+        bottom = numpy.maximum(numpy.minimum(areas[:, 3], bounds[1] - 1), top)
+
+        self.set_targets(indices, numpy.column_stack([self.randint(indices, left, right + 1),
+                                                      self.randint(indices, top, bottom + 1)]), bounds)
+
+    def by_model(self, mask):
+        """ Yields (model, agent indices) for the agents in mask, grouped by mobility model """
+        models = self.model[:self.count]
+        for model_id, model in enumerate(self.models):
+            model_mask = mask & (models == model_id)
+            if model.NEEDS_AREAS:
+                model_mask &= self.has_areas[:self.count, HOME] & self.has_areas[:self.count, WORKPLACE]
+            indices = numpy.flatnonzero(model_mask)
+            if indices.size:
+                yield model, indices
+
+    def step(self, dt, now, bounds):
+        """ Advances all the active agents dt seconds. now is the simulation time. """
+        count = self.count
+        position = self.position[:count]
+        self.moved[:count] = False
+        active = self.active[:count]
+
+        # First step of agents (or first step after a model change)
+        for model, indices in self.by_model(active & ~self.started[:count]):
+            model.start(self, indices, now, bounds)
+            self.started[indices] = True
+        active = active & self.started[:count]
+
+        # Waiting agents do nothing until their wait finishes
+        waiting = active & (self.wait_until[:count] != 0)
+        self.wait_until[:count][waiting & (now > self.wait_until[:count])] = 0
+        free = active & ~waiting
+
+        for model, indices in self.by_model(free):
+            model.update(self, indices, now, dt, bounds)
+
+            # Arrived: the target rect contains the (integer) position
+            half = model.TARGET_SIZE // 2
+            offset = numpy.trunc(position[indices]) - self.target[indices]
+            arrived = numpy.all((offset >= -half) & (offset < model.TARGET_SIZE - half), axis=1)
+
+            # Move towards the target in one of 8 directions
+            moving = indices[~arrived]
+            if moving.size:
+                vector = self.target[moving] - position[moving]
+                vector /= numpy.hypot(vector[:, 0], vector[:, 1])[:, None]
+                direction = (vector > 0.5).astype(numpy.int64) - (vector < -0.5)
+                if self.navigation is not None:
+                    routed = self.navigation.directions(position[moving], self.target[moving])
+                    detour = numpy.any(routed != 0, axis=1)
+                    direction[detour] = routed[detour]
+                factor = numpy.where(numpy.all(direction != 0, axis=1), ANGLE_UNIT_SPEED, 1.0)
+                speed = self.speed[moving] * self.speed_factor[moving]
+                position[moving] += direction * (speed * factor * dt)[:, None]
+                self.direction[moving] = direction
+                self.moved[moving] = True
+
+            # Arrived agents stop, or go to a new target
+            if arrived.any():
+                model.arrive(self, indices[arrived], now, bounds)
+
+        # Keep the sprites inside bounds
+        size = self.size[:count]
+        half_size = size // 2
+        left_top = numpy.trunc(position[active]) - half_size[active]
+        clamped = numpy.clip(left_top, 0, numpy.asarray(bounds) - size[active])
+        outside = numpy.any(clamped != left_top, axis=1)
+        if outside.any():
+            indices = numpy.flatnonzero(active)[outside]
+            position[indices] = clamped[outside] + half_size[indices]
@@ -0,0 +1,12 @@
+"""
+Names the command line accepts (mobility models, habitat shapes).
+
+Only plain constants, so demo.py can check its arguments before NumPy and pygame are loaded.
+"""
+
+# Mobility models (see lib.mobility), in the order of MODELS
+MODEL_NAMES = ("home-work", "random-waypoint", "levy-walk", "schedule", "group")
+DEFAULT_MODEL = "home-work"
+
+# Shapes of the habitat variants (see lib.variants)
+SHAPES = ("ellipse", "circle", "square", "rectangle")
@@ -0,0 +1,190 @@
+"""
+Navigation grid and flow fields, so agents walk around obstacles.
+
+The world is split in square cells, the cells an obstacle (a rectangle grown by a clearance)
+touches are blocked. Destinations are grouped in areas of a few cells. The flow field of an area
+gives, for every cell, the first of the 8 moves of a shortest path to the free cells of the area
+(diagonal moves cost about sqrt(2) and can't cut the corner of a blocked cell). Paths can leave blocked
+cells but not enter them, so agents inside an obstacle take the shortest way out. A field is
+computed once, the first time an agent heads to the area, and shared by every agent heading there:
+routing an agent is then a table lookup.
+
+Distances are integers relaxed with NumPy over the whole (flattened) grid, each direction with
+moves of 1, 2, 4 and 8 cells (a run of free cells), until a sweep changes nothing: a sweep per
+turn of the paths or so. A field only depends on the grid, so agents move the same whatever
+fields are cached (checkpoints and the timeline need not store them).
+"""
+import math
+
+import numpy
+
+# Moves by direction code, 0 is no move (go straight to the target)
+STEPS = numpy.array([(0, 0), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1)],
+                    dtype=numpy.int64)
+
+
+# Costs of a straight and a diagonal move of one cell (about 1 and sqrt(2), integers keep distances exact)
+STRAIGHT_COST = 5
+DIAGONAL_COST = 7
+UNREACHABLE = 1 << 29  # Distance of the cells without a path, and cost of the moves not allowed
+
+
+def shifted(shape, dx, dy):
+    """ Slices (destination, source) of the cells of an array of shape that are dx, dy cells apart """
+    def axis(size, delta):
+        return slice(max(0, delta), size + min(0, delta)), slice(max(0, -delta), size - max(0, delta))
+    columns, rows = axis(shape[0], dx), axis(shape[1], dy)
+    return (columns[0], rows[0]), (columns[1], rows[1])
+
+
+class NavigationGrid(object):
+
+    DEFAULT_CELL_SIZE = 32  # World pixels
+    DEFAULT_AREA_CELLS = 4  # Side of the destination areas in cells
+    DEFAULT_CLEARANCE = 16  # Pixels obstacles are grown by (about half a character)
+    DEFAULT_MAX_FIELDS = 1024  # Fields kept, the least recently used ones are dropped beyond that
+    MAX_MOVE = 8  # Cells of the longest moves of the relaxation
+
+    def __init__(self, world_size, obstacles, cell_size=DEFAULT_CELL_SIZE, area_cells=DEFAULT_AREA_CELLS,
+                 clearance=DEFAULT_CLEARANCE, max_fields=DEFAULT_MAX_FIELDS):
+        self.obstacles = list(obstacles)  # (left, top, right, bottom) rectangles
+        self.cell_size = cell_size
+        self.area_cells = area_cells
+        self.max_fields = max_fields
+        self.shape = (int(math.ceil(float(world_size[0]) / cell_size)),
+                      int(math.ceil(float(world_size[1]) / cell_size)))
+        self.area_shape = (-(-self.shape[0] // area_cells), -(-self.shape[1] // area_cells))
+
+        # Blocked cells, indexed [column, row]
+        self.blocked = numpy.zeros(self.shape, dtype=bool)
+        for left, top, right, bottom in self.obstacles:
+            first_column, first_row = max(0, int((left - clearance) // cell_size)), \
+                max(0, int((top - clearance) // cell_size))
+            last_column, last_row = int((right + clearance) // cell_size), int((bottom + clearance) // cell_size)
+            self.blocked[first_column:last_column + 1, first_row:last_row + 1] = True
+        self._build_moves()
+
+        # Fields by slot (direction codes by cell), slots by area
+        self.fields = numpy.zeros((0, self.blocked.size), dtype=numpy.uint8)
+        self.area_slot = numpy.full(self.area_shape[0] * self.area_shape[1], -1, dtype=numpy.intp)
+        self.slot_area = numpy.zeros(0, dtype=numpy.intp)
+        self.last_used = numpy.zeros(0, dtype=numpy.int64)
+        self.lookups = 0
+
+    def _build_moves(self):
+        """
+        Moves of the relaxation over the flattened grid: (first, end, offset, costs) of every direction and length
+        (1, 2, 4, ... MAX_MOVE cells), the cells [first, end) get the distance of the cells offset before them plus
+        the cost. A move costs UNREACHABLE unless it only crosses free cells (after the blocked cells it starts
+        from), which also keeps moves from wrapping around the edges of the grid.
+        """
+        free = ~self.blocked
+        self.moves = []
+        self.first_moves = []  # Moves of one cell by direction code (1 to 8)
+        for dx, dy in STEPS[1:].tolist():
+            # Moves of one cell: from a blocked cell, or both cells free and for diagonals both corners.
+            # Distances flow from the source to the destination cell, agents move the other way.
+            allowed = numpy.zeros(self.shape, dtype=bool)
+            destination, source = shifted(self.shape, dx, dy)
+            allowed[destination] = free[destination] & free[source]
+            if dx and dy:
+                corner_x = shifted(self.shape, dx, 0)
+                corner_y = shifted(self.shape, 0, dy)
+                allowed[corner_x[0]] &= free[corner_x[1]]
+                allowed[corner_y[0]] &= free[corner_y[1]]
+            allowed[destination] |= self.blocked[destination]
+            length = 1
+            cost = DIAGONAL_COST if dx and dy else STRAIGHT_COST
+            while length <= self.MAX_MOVE:
+                destination = shifted(self.shape, dx * length, dy * length)[0]
+                costs = numpy.full(self.shape, UNREACHABLE, dtype=numpy.int32)
+                costs[destination][allowed[destination]] = cost * length
+                offset = (dx * self.shape[1] + dy) * length
+                first, end = max(0, offset), self.blocked.size + min(0, offset)
+                move = (first, end, offset, costs.ravel()[first:end].copy())
+                self.moves.append(move)
+                if length == 1:
+                    self.first_moves.append(move)
+                # A move of twice the length is two moves in a row
+                doubled = numpy.zeros(self.shape, dtype=bool)
+                destination, source = shifted(self.shape, dx * length, dy * length)
+                doubled[destination] = allowed[destination] & allowed[source]
+                allowed = doubled
+                length *= 2
+
+    def compute_field(self, area):
+        """ Returns the direction codes by cell (flattened) towards the free cells of an area """
+        column, row = divmod(area, self.area_shape[1])
+        sources = numpy.zeros(self.shape, dtype=bool)
+        cells = (slice(column * self.area_cells, (column + 1) * self.area_cells),
+                 slice(row * self.area_cells, (row + 1) * self.area_cells))
+        sources[cells] = ~self.blocked[cells]
+        sources = sources.ravel()
+        if not sources.any():
+            return numpy.zeros(self.blocked.size, dtype=numpy.uint8)
+        distance = numpy.where(sources, 0, UNREACHABLE).astype(numpy.int32)
+
+        while True:
+            previous = distance.copy()
+            for first, end, offset, costs in self.moves:
+                numpy.minimum(distance[first:end], distance[first - offset:end - offset] + costs,
+                              out=distance[first:end])
+            if numpy.array_equal(previous, distance):
+                break
+
+        # The first move of a path goes to the neighbour its distance comes from, the opposite of the move
+        # that relaxed the cell (directions 4 codes apart are opposite)
+        through = numpy.full((len(self.first_moves), self.blocked.size), UNREACHABLE, dtype=numpy.int32)
+        for code, (first, end, offset, costs) in enumerate(self.first_moves):
+            through[(code + 4) % 8, first:end] = distance[first - offset:end - offset] + costs
+        codes = (numpy.argmin(through, axis=0) + 1).astype(numpy.uint8)
+        codes[sources | (distance >= UNREACHABLE)] = 0
+        return codes
+
+    def _slots(self, areas):
+        """
+        Slots of the fields of areas (at most max_fields different ones), computing the missing ones. The fields
+        of the areas are all kept until the next call: only the fields used before are dropped.
+        """
+        self.lookups += 1
+        needed = numpy.unique(areas)
+        slots = self.area_slot[needed]
+        self.last_used[slots[slots >= 0]] = self.lookups
+        for area in needed[slots < 0].tolist():
+            if len(self.slot_area) < self.max_fields:
+                slot = len(self.slot_area)
+                self.fields = numpy.concatenate((self.fields, numpy.zeros((1, self.blocked.size), numpy.uint8)))
+                self.slot_area = numpy.append(self.slot_area, area)
+                self.last_used = numpy.append(self.last_used, 0)
+            else:
+                slot = int(numpy.argmin(self.last_used))
+                self.area_slot[self.slot_area[slot]] = -1
+                self.slot_area[slot] = area
+            self.last_used[slot] = self.lookups
+            self.fields[slot] = self.compute_field(area)
+            self.area_slot[area] = slot
+        return self.area_slot[areas]
+
+    def directions(self, positions, targets):
+        """
+        Direction (-1, 0 or 1 components) of the first move towards each target ((N, 2) arrays) as an (N, 2)
+        array, (0, 0) for the agents that go straight (in the area of their target, or outside the paths)
+        """
+        directions = numpy.zeros((len(positions), 2), dtype=numpy.int64)
+        cell = (positions // self.cell_size).astype(numpy.intp)
+        area = (targets // (self.cell_size * self.area_cells)).astype(numpy.intp)
+        inside = numpy.all((cell >= 0) & (cell < self.shape), axis=1) & \
+            numpy.all((area >= 0) & (area < self.area_shape), axis=1)
+        # Agents in the area of their target go straight
+        routed = numpy.flatnonzero(inside & numpy.any(cell // self.area_cells != area, axis=1))
+        if routed.size:
+            areas = area[routed, 0] * self.area_shape[1] + area[routed, 1]
+            cells = cell[routed, 0] * self.shape[1] + cell[routed, 1]
+            needed = numpy.unique(areas)
+            # Agents heading to more areas than there are fields kept are routed in batches of areas
+            for start in xrange(0, len(needed), self.max_fields):
+                batch = numpy.flatnonzero(numpy.in1d(areas, needed[start:start + self.max_fields])) \
+                    if len(needed) > self.max_fields else numpy.arange(len(areas))
+                slots = self._slots(areas[batch])
+                directions[routed[batch]] = STEPS[self.fields[slots, cells[batch]]]
+        return directions
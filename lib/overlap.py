@@ -0,0 +1,236 @@
+"""
+Sparse matrix of the pairwise overlap areas of habitats, updated incrementally.
+
+Habitat shapes are Regions: ellipses (circles) or boxes (squares) with a center, a unit major axis
+and two half sizes. Regions are kept in a spatial grid (see lib.spatial), so only the pairs whose
+bounds intersect are candidates. Their intersection area is sampled on a fixed grid of points over
+the intersection of both bounds, all the candidates of a region at once with NumPy. The result only
+depends on the two regions (not on which one changed last) and is the same on every run.
+
+Updates only recompute the rows of the regions that changed (regions are immutable, a new one means
+a change). Changed rows wait in a queue and each update recomputes the oldest ones up to a budget of
+pairs, so an update costs about the same however many habitats change or overlap; with many large
+habitats that move all the time some rows lag a few updates behind (see pending).
+"""
+import collections
+import math
+
+import numpy
+
+from lib.spatial import SpatialGrid
+
+
+# Immutable shape of a habitat. axis is the unit vector of the half_length axis, box tells a rectangle
+# (or square) from an ellipse (or circle). area and bounds (left, top, right, bottom) are exact.
+Region = collections.namedtuple("Region", ["center", "axis", "half_length", "half_width", "box", "area", "bounds"])
+
+# Columns of the shape arrays (see contains)
+CENTER_X, CENTER_Y, AXIS_X, AXIS_Y, HALF_LENGTH, HALF_WIDTH, BOX = range(7)
+
+
+def build_region(center, axis, half_length, half_width, box):
+    """ Returns the Region of a shape (see Region) """
+    ux, uy = axis
+    if box:
+        area = 4.0 * half_length * half_width
+        extent_x = abs(half_length * ux) + abs(half_width * uy)
+        extent_y = abs(half_length * uy) + abs(half_width * ux)
+    else:
+        area = math.pi * half_length * half_width
+        extent_x = math.hypot(half_length * ux, half_width * uy)
+        extent_y = math.hypot(half_length * uy, half_width * ux)
+    bounds = (center[0] - extent_x, center[1] - extent_y, center[0] + extent_x, center[1] + extent_y)
+    return Region(tuple(center), (ux, uy), half_length, half_width, box, area, bounds)
+
+
+def contains(x, y, shapes):
+    """ Whether points (x and y (C, P) arrays) are inside shapes ((C, 7) or (1, 7) array) as a (C, P) array """
+    shapes = shapes[:, :, None]
+    offset_x = x - shapes[:, CENTER_X]
+    offset_y = y - shapes[:, CENTER_Y]
+    u = (offset_x * shapes[:, AXIS_X] + offset_y * shapes[:, AXIS_Y]) / shapes[:, HALF_LENGTH]
+    v = (offset_y * shapes[:, AXIS_X] - offset_x * shapes[:, AXIS_Y]) / shapes[:, HALF_WIDTH]
+    boxes = shapes[:, BOX] > 0
+    if not boxes.any():
+        return u * u + v * v <= 1.0
+    return numpy.where(boxes, (numpy.abs(u) <= 1.0) & (numpy.abs(v) <= 1.0), u * u + v * v <= 1.0)
+
+
+class OverlapMatrix(object):
+
+    """
+    Symmetric sparse matrix of intersection areas by pair of keys (only overlapping pairs are stored).
+    Regions are stored by slot in arrays, the spatial grid and the rows are indexed by slot.
+    """
+
+    DEFAULT_CELL_SIZE = 256  # World pixels
+    DEFAULT_SAMPLES = 12  # Sample points per axis of the intersection of the bounds of a pair
+    DEFAULT_PAIR_BUDGET = 1000  # Pairs sampled by an update (at least one row is recomputed)
+    INITIAL_CAPACITY = 16
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE, samples=DEFAULT_SAMPLES, pair_budget=DEFAULT_PAIR_BUDGET):
+        self.index = SpatialGrid(cell_size)
+        self.pair_budget = pair_budget
+        self.regions = {}  # Key -> Region
+        self.rows = {}  # Slot -> {other slot: intersection area}, only for overlapping pairs
+        self.queue = collections.OrderedDict()  # Keys of the rows to recompute, oldest first
+        self.slots = {}  # Key -> slot
+        self.keys = []  # Slot -> key (None for free slots)
+        self.free = []  # Free slots
+        # Single precision is plenty for world coordinates and halves the sampling time
+        self.shapes = numpy.zeros((self.INITIAL_CAPACITY, 7), dtype=numpy.float32)
+        self.bounds = numpy.zeros((self.INITIAL_CAPACITY, 4), dtype=numpy.float32)
+        # Centers of a samples x samples grid of the unit square (x and y)
+        steps = ((numpy.arange(samples) + 0.5) / samples).astype(numpy.float32)
+        self.unit_x, self.unit_y = [coordinates.ravel() for coordinates in numpy.meshgrid(steps, steps)]
+
+    def update(self, regions):
+        """
+        Updates the matrix with the current regions (a dict key -> Region or None, None and keys left out
+        have no area). The rows of the regions that are not the same object as in the last update are queued,
+        and the oldest queued rows are recomputed. Returns the keys of the rows recomputed.
+        """
+        changed = [key for key, region in regions.iteritems() if region is not self.regions.get(key)]
+        changed.extend(key for key in self.regions if key not in regions)
+        for key in changed:
+            region = regions.get(key)
+            if region is None:
+                self._remove(key)
+            else:
+                self._set_region(key, region)
+                self.queue[key] = True
+
+        recomputed = []
+        done = set()  # Slots whose rows are already recomputed with the current regions
+        pairs = 0
+        while self.queue and (pairs < self.pair_budget or not recomputed):
+            key = self.queue.popitem(last=False)[0]
+            done.add(self.slots[key])
+            pairs += self._update_row(key, done)
+            recomputed.append(key)
+        return recomputed
+
+    def _set_region(self, key, region):
+        slot = self.slots.get(key)
+        if slot is None:
+            if self.free:
+                slot = self.free.pop()
+            else:
+                slot = len(self.keys)
+                self.keys.append(None)
+                if slot == len(self.shapes):
+                    self.shapes = numpy.concatenate((self.shapes, numpy.zeros_like(self.shapes)))
+                    self.bounds = numpy.concatenate((self.bounds, numpy.zeros_like(self.bounds)))
+            self.slots[key] = slot
+            self.keys[slot] = key
+        self.regions[key] = region
+        self.shapes[slot] = (region.center[0], region.center[1], region.axis[0], region.axis[1],
+                             region.half_length, region.half_width, region.box)
+        self.bounds[slot] = region.bounds
+        self.index.update(slot, region.bounds)
+
+    def _remove(self, key):
+        self.queue.pop(key, None)
+        self.regions.pop(key, None)
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self._drop_row(slot)
+            self.index.remove(slot)
+            self.keys[slot] = None
+            self.free.append(slot)
+
+    def _drop_row(self, slot, keep=()):
+        """ Removes the overlaps of a region, but those with the slots in keep """
+        rows = self.rows
+        kept = {}
+        for other, area in rows.pop(slot, {}).iteritems():
+            if other in keep:
+                kept[other] = area
+                continue
+            row = rows[other]
+            del row[slot]
+            if not row:
+                del rows[other]
+        if kept:
+            rows[slot] = kept
+
+    def _update_row(self, key, done):
+        """ Recomputes the overlaps of a region with its neighbours (not in done), returns the pairs tested """
+        slot = self.slots[key]
+        self._drop_row(slot, done)
+        others = numpy.fromiter((other for other in self.index.query(self.regions[key].bounds) if other not in done),
+                                dtype=numpy.intp)
+        if not len(others):
+            return 0
+
+        # Intersections of the bounds, pairs whose bounds don't intersect are left out
+        bounds = self.bounds[slot]
+        low = numpy.maximum(self.bounds[others, :2], bounds[:2])
+        sizes = numpy.minimum(self.bounds[others, 2:], bounds[2:]) - low
+        intersecting = (sizes[:, 0] > 0) & (sizes[:, 1] > 0)
+        others, low, sizes = others[intersecting], low[intersecting], sizes[intersecting]
+        if not len(others):
+            return 0
+
+        # Coordinates are kept apart, NumPy is slow on a last axis of 2
+        x = low[:, 0, None] + sizes[:, 0, None] * self.unit_x
+        y = low[:, 1, None] + sizes[:, 1, None] * self.unit_y
+        inside = contains(x, y, self.shapes[slot:slot + 1]) & contains(x, y, self.shapes[others])
+        areas = inside.mean(axis=1) * sizes[:, 0].astype(numpy.float64) * sizes[:, 1]
+
+        overlapping = numpy.flatnonzero(areas > 0)
+        if len(overlapping):
+            found = zip(others[overlapping].tolist(), areas[overlapping].tolist())
+            rows = self.rows
+            rows.setdefault(slot, {}).update(found)
+            for other, area in found:
+                row = rows.get(other)
+                if row is None:
+                    rows[other] = {slot: area}
+                else:
+                    row[slot] = area
+        return len(others)
+
+    def clear(self):
+        self.index.clear()
+        self.regions.clear()
+        self.rows.clear()
+        self.queue.clear()
+        self.slots.clear()
+        del self.keys[:]
+        del self.free[:]
+
+    def pending(self):
+        """ Number of rows waiting to be recomputed """
+        return len(self.queue)
+
+    def overlap(self, key, other):
+        """ Intersection area of two regions """
+        if key not in self.slots or other not in self.slots:
+            return 0.0
+        return self.rows.get(self.slots[key], {}).get(self.slots[other], 0.0)
+
+    def iou(self, key, other):
+        """ Intersection over union of two regions """
+        area = self.overlap(key, other)
+        if not area:
+            return 0.0
+        union = self.regions[key].area + self.regions[other].area - area
+        return min(1.0, area / union) if union > 0 else 0.0
+
+    def row(self, key):
+        """ Returns {other key: intersection area} of the regions overlapping a region """
+        keys = self.keys
+        return dict((keys[other], area) for other, area in self.rows.get(self.slots.get(key), {}).iteritems())
+
+    def pairs(self):
+        """ Yields (key, other key, intersection area) of every overlapping pair once """
+        keys = self.keys
+        for slot, row in self.rows.iteritems():
+            for other, area in row.iteritems():
+                if slot < other:
+                    yield keys[slot], keys[other], area
+
+    def __len__(self):
+        """ Number of overlapping pairs """
+        return sum(len(row) for row in self.rows.itervalues()) // 2
@@ -0,0 +1,2668 @@
+"""
+PrivHab demonstration scene: nodes (character, home and workplace), their habitats and the
+Control class that runs the demo.
+
+This module imports and initializes pygame, demo.py only imports it once arguments are parsed.
+"""
+import os
+import math
+import array
+import random
+import operator
+import logging
+import copy
+import traceback
+import collections
+import hashlib
+import time
+
+import numpy
+import pygame as pg
+
+# Demo dependencies
+from lib.spritesheet import spritesheet
+from lib.registry import NodeRegistry
+from lib.spatial import SpatialGrid
+from lib.heatmap import Heatmap
+from lib.overlap import OverlapMatrix, build_region
+from lib.exposure import ExposureTracker
+from lib.navigation import NavigationGrid
+from lib.variants import HabitatVariants, Variant, VARIANT_COLORS, describe
+import lib.tracing as tracing
+from lib.assets import AssetManager
+from lib.surfacecache import SurfaceCache
+from lib.timeline import Timeline
+from lib.view import View
+import lib.menusystem as ms
+from lib.mobility import MobilityEngine, HOME, WORKPLACE, MODEL_NAMES, DEFAULT_MODEL
+
+COLOR_DICT = {
+    "green": "green",
+    "red": "red3",
+    "grey": "grey",
+    "yellow": "yellow"
+}
+
+# Nodes without their own sprites are named "hue-<degrees>[-<index>]" and use generated variants
+# of the BASE_SPRITE_COLOR sprites.
+HUE_COLOR_PREFIX = "hue-"
+BASE_SPRITE_COLOR = "green"
+GOLDEN_ANGLE = 137.50776  # Degrees. Spreads consecutive hues around the colour wheel.
+
+DIRECT_DICT = {pg.K_LEFT: (-1, 0),
+               pg.K_RIGHT: (1, 0),
+               pg.K_UP: (0, -1),
+               pg.K_DOWN: (0, 1)}
+DIRECTION_KEYS = tuple(sorted(DIRECT_DICT))
+#  X and Y Component magnitude when moving at 45 degree angles
+ANGLE_UNIT_SPEED = math.sqrt(2) / 2
+
+
+def get_random_position(margins, rng=random):
+    left_margin = int((GlobalVars.WORLD_SIZE[0] / 100.0) * margins[0])
+    rigth_margin = int((GlobalVars.WORLD_SIZE[0] / 100.0) * margins[1])
+    top_margin = int((GlobalVars.WORLD_SIZE[1] / 100.0) * margins[2])
+    bottom_margin = int((GlobalVars.WORLD_SIZE[1] / 100.0) * margins[3])
+
+    random_position = [rng.randint(left_margin, GlobalVars.WORLD_SIZE[0] - rigth_margin),
+                       rng.randint(top_margin, GlobalVars.WORLD_SIZE[1] - bottom_margin)]
+
+    return random_position
+
+
+def get_node_random(seed, name):
+    """ Returns the random stream of a node. It only depends on the run seed and the node name. """
+    return random.Random(int(hashlib.sha1("{0}:{1}".format(seed, name)).hexdigest()[:16], 16))
+
+
+def get_node_colors(count):
+    """
+    Returns the color names of `count` nodes: first the colors with their own sprites,
+    then generated hues.
+    """
+    colors = list(Control.COLOR_ACTIVE_NODES[:count])
+    used_hues = {}
+    for i in range(count - len(colors)):
+        hue = int(round(i * GOLDEN_ANGLE)) % 360
+        used_hues[hue] = used_hues.get(hue, 0) + 1
+        if used_hues[hue] == 1:
+            colors.append("{0}{1}".format(HUE_COLOR_PREFIX, hue))
+        else:
+            colors.append("{0}{1}-{2}".format(HUE_COLOR_PREFIX, hue, used_hues[hue]))
+
+    return colors
+
+
+def get_color_hue(color):
+    """ Returns the hue of a generated color name, None for colors with their own sprites """
+    if color.startswith(HUE_COLOR_PREFIX):
+        return int(color[len(HUE_COLOR_PREFIX):].split("-")[0])
+    return None
+
+
+def load_node_image(assets, kind, color, colorkey=None):
+    """
+    Returns the shared image of kind ("mario", "pipe", "castle") for a node color.
+    Generated colors get a hue variant of the BASE_SPRITE_COLOR image.
+    """
+    hue = get_color_hue(color)
+    if hue is None:
+        return assets.image("data/{0}_{1}.png".format(kind, color), colorkey)
+
+    return assets.variant("data/{0}_{1}.png".format(kind, BASE_SPRITE_COLOR), hue, colorkey)
+
+
+# Disc stamps by (color, radius), see get_disc_stamp
+_DISC_STAMPS = {}
+DISC_STAMP_MARGIN = 2  # pygame.draw.circle draws small discs slightly beyond their radius
+
+
+def get_disc_stamp(color, radius):
+    """
+    Returns a surface with a filled disc of radius, as drawn by pygame.draw.circle centered at
+    (radius + DISC_STAMP_MARGIN, radius + DISC_STAMP_MARGIN). Stamps are shared by color and radius.
+    """
+    color = tuple(color)
+    key = (color, radius)
+    if key not in _DISC_STAMPS:
+        center = radius + DISC_STAMP_MARGIN
+        colorkey = (255, 0, 255) if color[:3] != (255, 0, 255) else (0, 0, 0)
+        stamp = pg.Surface((2 * center + 1, 2 * center + 1)).convert()
+        stamp.fill(colorkey)
+        pg.draw.circle(stamp, color, (center, center), radius)
+        stamp.set_colorkey(colorkey, pg.RLEACCEL)
+        _DISC_STAMPS[key] = stamp
+
+    return _DISC_STAMPS[key]
+
+
+def get_color(color):
+    """ Returns the pygame Color that represents a node color name """
+    hue = get_color_hue(color)
+    if hue is None:
+        return pg.color.Color(COLOR_DICT[color])
+
+    color_repr = pg.color.Color(0, 0, 0)
+    color_repr.hsva = (hue, 100, 100, 100)
+    return color_repr
+
+
+class GlobalVars:
+
+    """
+    Everything is an object in python, therefore GlobalVars
+    references to a class without methods (basically a struct) which contains the global variables.
+
+    This way we can access its members from anywhere (including threads).
+    """
+
+    def __init__(self):
+        pass
+    RUNNING = True
+    SCREEN_SIZE = [1024, 768]
+    WORLD_SIZE = [1024, 768]  # Simulated area (the screen size unless it is larger)
+
+
+class Mario(spritesheet):
+
+    """
+    Represents a character from a spritesheet.
+
+    It wrappers how we get the correct image (a Surface object) based on the direction
+    and the movement of the character.
+
+    It also contains surfaces representing its Home and Workplaces
+
+    The images of every direction and movement are sliced once per color and shared.
+    """
+
+    def __init__(self, color, assets, initial_posiiton=(0, 0), direction=0, movement=0):
+        self.color = color
+        # The sheet is shared by every character of the same color (it is only read)
+        self.sheet = load_node_image(assets, "mario", color)
+        self.background = pg.color.Color('white')
+        self.direction = direction
+        self.movement = movement
+
+        # Image parameters
+        self.x_off = 8  # Spritesheet start (x)
+        self.y_off = 4  # Spritesheet start (y)
+        self.x_width = 16  # Sprite width (x)
+        self.y_width = 32  # Sprite width (y)
+        self.x_inter_width = 5  # Horitzontal space between sprites
+        self.y_inter_width = 7  # Vertical space between sprites
+
+        # Direction
+        self.direction_off = 4  # Where is direction 0 (UP)
+        self.direction_next = operator.sub  # Operator that gets the next direction (in order 0,1,2...)
+        self.direction_num = 8  # Number of directions (should be 8)
+
+        # Movement (we don't consider an offset, first image of the strip will be the first movement)
+        self.movements = 8  # Images per direction
+
+        # Home / Work
+        self.home_image = load_node_image(assets, "pipe", color, colorkey="white")
+        self.workplace_image = load_node_image(assets, "castle", color, colorkey="white")
+
+        # Set actual coords
+        self.set_image_coords()
+
+        # Sliced images: {(direction, movement): Surface}
+        self.frames = assets.memo(("mario_frames", color), self.slice_frames)
+
+        logging.debug("Created {0} spritesheet".format(self))
+
+    def __str__(self):
+        return "{0} {1}".format(self.color, self.__class__.__name__)
+
+    def set_direction(self, direction):
+        """ Sets the face direction of the character. """
+        self.direction = direction
+
+    def get_direction(self):
+        """ Gets the configured face direction. """
+        return self.direction
+
+    pos = property(get_direction, set_direction)
+
+    def set_image_coords(self):
+        """ Set sprite coords from direction and movement number. """
+        self.pos_x = self.x_off + (self.x_width * self.movement) + (self.x_inter_width * self.movement)
+        real_direction = self.direction_next(self.direction_off, self.direction) % self.direction_num
+        self.pos_y = self.y_off + real_direction * (self.y_width + self.y_inter_width)
+
+    def slice_frames(self):
+        """ Slices the images of all directions and movements from the sheet """
+        direction, movement = self.direction, self.movement
+        frames = {}
+        for self.direction in range(self.direction_num):
+            for self.movement in range(self.movements):
+                self.set_image_coords()
+                frames[(self.direction, self.movement)] = self.image_at(
+                    (self.pos_x, self.pos_y, self.x_width, self.y_width), self.background)
+
+        self.direction, self.movement = direction, movement
+        self.set_image_coords()
+
+        return frames
+
+    def first(self):
+        self.movement = 0
+        self.set_image_coords()
+
+        return self.frames[(self.direction, self.movement)]
+
+    def next(self):
+        """ Movement iterator. Returns next image. """
+        self.movement = (self.movement + 1) % self.movements
+        self.set_image_coords()
+
+        return self.frames[(self.direction, self.movement)]
+
+
+# Trace events of the hot loops (see lib/tracing.py)
+TRACE_HABITAT_LOCATION = tracing.event_type("habitat.location", "node", "x", "y")
+TRACE_HABITAT_CIRCLE = tracing.event_type("habitat.circle", "node", "x", "y", "radius")
+TRACE_HABITAT_FOCUS_DISTANCE = tracing.event_type("habitat.focus_distance", "node", "focus_1", "focus_2")
+TRACE_HABITAT_FOCI = tracing.event_type("habitat.foci", "node", "x1", "y1", "x2", "y2")
+TRACE_HABITAT_ELLIPSE = tracing.event_type("habitat.ellipse", "node", "x", "y", "radius")
+TRACE_HABITAT_STATIONARY = tracing.event_type("habitat.stationary", "node", "x", "y", "samples")
+# "place" is 0 for homes and 1 for workplaces
+TRACE_POSITIONING_TRY = tracing.event_type("positioning.try", "node", "place", "x", "y")
+TRACE_POSITIONING_COLLISION = tracing.event_type("positioning.collision", "node", "place")
+TRACE_POSITIONING_FAILED = tracing.event_type("positioning.failed", "node", "place")
+NAN = float("nan")
+PLACE_HOME = 0
+PLACE_WORKPLACE = 1
+# Levels of detail: sprites and full habitats, points with habitat outlines, points with habitat markers
+LOD_FULL = 0
+LOD_OUTLINES = 1
+LOD_MARKERS = 2
+LOD_NAMES = {"full": LOD_FULL, "outlines": LOD_OUTLINES, "markers": LOD_MARKERS}
+
+
+# Immutable habitat geometry published by Habitat.update and read by Habitat.draw.
+# last_n_points are integer (x, y) positions ordered from the oldest to the newest point.
+# bounds (left, top, right, bottom) contain everything draw may paint, whatever the shape.
+HabitatState = collections.namedtuple("HabitatState", ["circle_center", "circle_radius",
+                                                       "focus_1", "focus_2", "ellipse_center",
+                                                       "ellipse_radius", "last_n_points", "bounds"])
+
+
+class Habitat(object):
+
+    """
+    Represents a habitat.
+    Supported shapes: circle, square, rectangle, ellipse
+
+    Update modes:
+     * periodic: every sample runs an EWMA update.
+     * event: samples taken while the node doesn't move (further than STATIONARY_THRESHOLD) are only
+       counted. The working state takes them in at once with the closed form of k EWMA updates with
+       the same location (see stationary_values) when the node moves again or a parameter changes,
+       so it matches periodic sampling up to floating point rounding. The published state is brought
+       up to date with the closed form when it is read (see published_state). Its shape is only
+       replaced when it changes by more than PUBLISH_TOLERANCE, so settled habitats keep the same
+       state object and Region.
+    """
+
+    # Defaults
+    DEFAULT_N = 20
+    DEFAULT_BETA = 25
+    DEFAULT_COLOR = "black"
+    DEFAULT_SHAPE = "ellipse"
+    DEFAULT_HABITAT_UPDATE_FREQ = 0.5  # Seconds (of simulation time)
+    DEFAULT_SHOWN_LAST_N_POINTS = False
+    DEFAULT_UPDATE_MODE = "event"
+    UPDATE_MODES = ("event", "periodic")
+    # Pixels. Nodes closer than this to their last sample are stationary (0 keeps results exact)
+    STATIONARY_THRESHOLD = 0
+    # Pixels. Event mode publishes the state of deferred samples when it moves further than this.
+    PUBLISH_TOLERANCE = 0.1
+
+    # Display parameters
+    HABITAT_WIDTH = 3
+    WIDTH_OFFSET = 0  # Pixels
+    HEIGHT_OFFSET = -4  # Pixels (negative values higher the habitat position)
+    LAST_N_POINTS_RADIUS_RATIO = 200  # Pixels
+    OUTLINE_SEGMENTS = 12  # Segments of circle and ellipse outlines (reduced levels of detail)
+    MARKER_PIXELS = 4  # Habitats smaller than this on screen are drawn as a marker at their center
+
+    def __init__(self, node_rect, color=DEFAULT_COLOR, n=DEFAULT_N, beta=DEFAULT_BETA, shape=DEFAULT_SHAPE,
+                 show_last_n_points=DEFAULT_SHOWN_LAST_N_POINTS, update_freq=DEFAULT_HABITAT_UPDATE_FREQ,
+                 update_mode=DEFAULT_UPDATE_MODE):
+
+        # Habitat configuration
+        # We link the node_rect object to this Habitat so we don't need to pass
+        # the node position each time the habitat is updated
+        self.node_rect = node_rect
+        self.color_str = color
+        self.trace_id = tracing.name_id(color)
+        self.color_repr = get_color(self.color_str)
+        self.n = n
+        self.alpha = 2.0 / (self.n + 1)
+        self.beta = beta
+
+        # Habitat attribtues
+        self.update_freq = update_freq
+        self.shape = shape
+        # For circle / square
+        self.circle_center = None
+        self.circle_radius = 0
+        # For rectangle / ellipse
+        self.focus_1 = None
+        self.focus_2 = None
+        self.ellipse_center = None
+        self.ellipse_radius = 0
+
+        # Last N weighted points attributes
+        self.show_last_n_points = show_last_n_points
+        self.last_n_points_radius_ratio = self.LAST_N_POINTS_RADIUS_RATIO
+        # Fixed size ring buffer of x, y pairs. last_n_point_start is the next slot to write
+        # (the oldest point once the buffer is full).
+        self.last_n_points = array.array('d', [0.0]) * (2 * self.n)
+        self.last_n_point_count = 0
+        self.last_n_point_start = 0
+        # Disc radius and (stamp, offset) of each point by age (index 1 is the newest), see get_last_n_stamps
+        self.last_n_radii = self.get_last_n_radii()
+        self.last_n_stamps = None
+
+        # Renderized habitat
+        self.habitat_surface = None
+        self.habitat_surface_pos = None
+        # (state, shape, (points, center, size)) of the last outline and (state, shape, scale, pixels) of
+        # its points scaled to a view, see get_outline
+        self.outline = None
+        self.outline_pixels = None
+        # (state, shape, Region or None) of the last habitat area, see get_region
+        self.region = None
+
+        # Last published HabitatState (read through published_state), the deferred samples it includes and
+        # the deferred samples it was last checked against
+        self.state = None
+        self.state_samples = 0
+        self.checked_samples = 0
+
+        # Simulation time of the next update
+        self.next_update = None
+
+        # Event mode: location of the last sample and samples at it not applied yet
+        self.update_mode = update_mode
+        self.last_location = None
+        self.pending_samples = 0
+
+    def step(self, now):
+        """ Samples the node location every self.update_freq seconds of simulation time. """
+        if self.next_update is None:
+            self.next_update = now
+
+        while now >= self.next_update:
+            self.sample()
+            self.next_update += self.update_freq
+
+    def sample(self):
+        """ Updates the habitat with the current location, deferring the update of stationary nodes """
+        current_location = self.get_center()
+        if self.update_mode == "event" and self.state is not None and \
+                self.distance(self.last_location, current_location) <= self.STATIONARY_THRESHOLD:
+            self.pending_samples += 1
+            return
+
+        self.flush()
+        self.last_location = current_location
+        self.update()
+
+    def flush(self):
+        """ Applies the deferred samples of a stationary node """
+        if self.pending_samples:
+            samples = self.pending_samples
+            self.pending_samples = 0
+            self.update_stationary(self.last_location, samples)
+
+    def published_state(self):
+        """
+        Returns the HabitatState to draw and analyse. The closed form of the deferred samples is computed
+        here, once per sample at most and only for the habitats that are read. A new state is published
+        only if it differs from the last one by more than PUBLISH_TOLERANCE (or in its last N points), so
+        readers that compare states by identity (regions, overlaps, exposure) skip settled habitats. When
+        only the last N points changed, they are published with the shape values of the last state, so the
+        habitat keeps its Region.
+        """
+        if self.pending_samples != self.checked_samples:
+            self.checked_samples = self.pending_samples
+            state = self.get_deferred_state(self.pending_samples)
+            if self.state_changed(state, self.state):
+                self.state = state
+                self.state_samples = self.pending_samples
+            elif state.last_n_points != self.state.last_n_points:
+                self.state = self.build_state(self.get_deferred_points(self.pending_samples), *self.state[:6])
+        return self.state
+
+    def get_deferred_state(self, k):
+        """ Builds the HabitatState of the working state after k samples at the last location """
+        return self.build_state(self.get_deferred_points(k), *self.stationary_values(self.last_location, k))
+
+    def get_deferred_points(self, k):
+        """ Returns the flat last N points after k samples at the last location """
+        points = self.get_last_n_points()
+        if self.show_last_n_points:
+            points = (points + array.array('d', self.last_location) * min(k, self.n))[-2 * self.n:]
+        return points
+
+    def state_changed(self, state, previous):
+        """ Whether the shape of a state differs from the previous one by more than PUBLISH_TOLERANCE """
+        if previous is None:
+            return True
+        values = state.circle_center + state.focus_1 + state.focus_2 + (state.circle_radius, state.ellipse_radius)
+        previous_values = previous.circle_center + previous.focus_1 + previous.focus_2 + \
+            (previous.circle_radius, previous.ellipse_radius)
+        return any(abs(value - previous_value) > self.PUBLISH_TOLERANCE
+                   for value, previous_value in zip(values, previous_values))
+
+    def update(self):
+        """
+        Updates the habitat with the current node location.
+
+        The working state is only touched here. After each update an immutable HabitatState is
+        published with a single reference assignment, so draw() never needs a lock.
+        """
+        current_location = self.get_center()
+        alpha = self.alpha
+        beta = self.beta
+
+        if tracing.ENABLED:
+            tracing.emit(TRACE_HABITAT_LOCATION, self.trace_id, current_location[0], current_location[1])
+
+        # Update circle / square
+        if not self.circle_center and not (self.focus_1 or self.focus_2):
+            self.circle_center = copy.copy(current_location)
+
+        # Update circle_center
+        self.circle_center = self.ewma_points(self.circle_center, current_location, alpha)
+
+        # Update distance between current location and circle_center
+        circle_distance = self.distance(self.circle_center, current_location)
+
+        # Update radius
+        self.circle_radius = circle_distance * alpha + self.circle_radius * (1.0 - alpha)
+
+        if tracing.ENABLED:
+            tracing.emit(TRACE_HABITAT_CIRCLE, self.trace_id,
+                         self.circle_center[0], self.circle_center[1], self.circle_radius)
+
+        # Update rectangle / ellipse
+        # First time set focus to current position
+        if not (self.focus_1 or self.focus_2) and not self.ellipse_center:
+            self.focus_1 = copy.copy(current_location)
+            self.focus_2 = copy.copy(current_location)
+        elif not (self.focus_1 or self.focus_2) and self.ellipse_center:
+            self.focus_1 = copy.copy(self.ellipse_center)
+            self.focus_2 = copy.copy(self.ellipse_center)
+
+        # Update focal points
+        # Get nearer and farther focal point
+        focus_1_distance = self.distance(self.focus_1, current_location)
+        focus_2_distance = self.distance(self.focus_2, current_location)
+
+        if tracing.ENABLED:
+            tracing.emit(TRACE_HABITAT_FOCUS_DISTANCE, self.trace_id, focus_1_distance, focus_2_distance)
+
+        if focus_1_distance <= focus_2_distance:
+            self.focus_1 = self.ewma_points(self.focus_1, current_location, alpha)
+            self.focus_2 = self.ewma_points(self.focus_2, current_location, alpha / beta)
+        else:
+            self.focus_1 = self.ewma_points(self.focus_1, current_location, alpha / beta)
+            self.focus_2 = self.ewma_points(self.focus_2, current_location, alpha)
+
+        if tracing.ENABLED:
+            tracing.emit(TRACE_HABITAT_FOCI, self.trace_id,
+                         self.focus_1[0], self.focus_1[1], self.focus_2[0], self.focus_2[1])
+
+        # Update ellipse_center
+        self.ellipse_center = [(self.focus_1[0] + self.focus_2[0]) / 2, (self.focus_1[1] + self.focus_2[1]) / 2]
+
+        # Update distance between current location and focus points
+        focus_1_distance = self.distance(self.focus_1, current_location)
+        focus_2_distance = self.distance(self.focus_2, current_location)
+        ellipse_distance = focus_1_distance + focus_2_distance
+
+        self.ellipse_radius = ellipse_distance * alpha + self.ellipse_radius * (1.0 - alpha)
+
+        if tracing.ENABLED:
+            tracing.emit(TRACE_HABITAT_ELLIPSE, self.trace_id,
+                         self.ellipse_center[0], self.ellipse_center[1], self.ellipse_radius)
+
+        # Add last point
+        if self.show_last_n_points:
+            self.add_last_n_point(current_location)
+
+        # Publish the new state
+        self.state = self.get_state()
+        self.state_samples = self.checked_samples = 0
+
+    def stationary_values(self, location, k):
+        """
+        Closed form of k updates with the same location, as (circle_center, circle_radius, focus_1, focus_2,
+        ellipse_center, ellipse_radius). A point updated with factor a gets (1 - a) times closer to the
+        location each update, so after k updates it is at location + (point - location) * (1 - a)^k. The
+        nearer focus stays the nearer one, so each focus keeps its factor. Radii add up the decayed
+        distances (see decayed_sum).
+        """
+        alpha = self.alpha
+        q = 1.0 - alpha
+        p = 1.0 - alpha / self.beta
+        q_k = q ** k
+
+        def decay_point(point, factor_k):
+            return [coord + (old_coord - coord) * factor_k for old_coord, coord in zip(point, location)]
+
+        # Circle
+        circle_distance = self.distance(self.circle_center, location)
+        circle_center = decay_point(self.circle_center, q_k)
+        circle_radius = q_k * self.circle_radius + alpha * self.decayed_sum(circle_distance, q, q, k)
+
+        # Foci, the nearer one is updated with alpha and the farther one with alpha / beta
+        focus_1_distance = self.distance(self.focus_1, location)
+        focus_2_distance = self.distance(self.focus_2, location)
+        if focus_1_distance <= focus_2_distance:
+            near_distance, far_distance = focus_1_distance, focus_2_distance
+            focus_1 = decay_point(self.focus_1, q_k)
+            focus_2 = decay_point(self.focus_2, p ** k)
+        else:
+            near_distance, far_distance = focus_2_distance, focus_1_distance
+            focus_1 = decay_point(self.focus_1, p ** k)
+            focus_2 = decay_point(self.focus_2, q_k)
+
+        # Ellipse
+        ellipse_center = [(focus_1[0] + focus_2[0]) / 2, (focus_1[1] + focus_2[1]) / 2]
+        ellipse_radius = q_k * self.ellipse_radius + alpha * (self.decayed_sum(near_distance, q, q, k) +
+                                                              self.decayed_sum(far_distance, q, p, k))
+
+        return circle_center, circle_radius, focus_1, focus_2, ellipse_center, ellipse_radius
+
+    def update_stationary(self, location, k):
+        """ Applies k updates with the same location to the working state (see stationary_values) """
+        (self.circle_center, self.circle_radius, self.focus_1, self.focus_2,
+         self.ellipse_center, self.ellipse_radius) = self.stationary_values(location, k)
+
+        if tracing.ENABLED:
+            tracing.emit(TRACE_HABITAT_STATIONARY, self.trace_id, location[0], location[1], k)
+            tracing.emit(TRACE_HABITAT_CIRCLE, self.trace_id,
+                         self.circle_center[0], self.circle_center[1], self.circle_radius)
+            tracing.emit(TRACE_HABITAT_ELLIPSE, self.trace_id,
+                         self.ellipse_center[0], self.ellipse_center[1], self.ellipse_radius)
+
+        # The last N points are k copies of the location
+        if self.show_last_n_points:
+            for _ in range(min(k, self.n)):
+                self.add_last_n_point(location)
+
+        self.state = self.get_state()
+        self.state_samples = self.checked_samples = 0
+
+    def decayed_sum(self, distance, q, p, k):
+        """
+        Sum for j = 1..k of q^(k - j) * distance * p^j: the contribution to a radius (decaying by q) of
+        k updates whose distance decays by p. Distances under 1e-5 count as 0, as in self.distance.
+        """
+        if not distance:
+            return 0.0
+        if p > 0 and distance * p ** k < 1e-5:
+            # Only the first m distances are not rounded to 0
+            m = min(k, max(0, int(math.floor(math.log(1e-5 / distance) / math.log(p)))))
+        else:
+            m = k if p > 0 else 0
+        if m == 0:
+            return 0.0
+        if p == q:
+            return distance * m * q ** k
+        return distance * q ** (k - m) * p * (p ** m - q ** m) / (p - q)
+
+    def add_last_n_point(self, location):
+        """ Adds a point to the last N points ring buffer, replacing the oldest one when full """
+        offset = 2 * self.last_n_point_start
+        self.last_n_points[offset] = location[0]
+        self.last_n_points[offset + 1] = location[1]
+        self.last_n_point_start = (self.last_n_point_start + 1) % self.n
+        if self.last_n_point_count < self.n:
+            self.last_n_point_count += 1
+
+    def get_last_n_points(self):
+        """ Returns the flat [x0, y0, x1, y1...] last N points from the oldest to the newest one """
+        if self.last_n_point_count < self.n:
+            return self.last_n_points[:2 * self.last_n_point_count]
+        start = 2 * self.last_n_point_start
+        return self.last_n_points[start:] + self.last_n_points[:start]
+
+    def get_last_n_radii(self, scale=1.0):
+        """ Radius of the last N points by age: age 1 (the newest point) has weight alpha * (1 - alpha) """
+        return [0] + [int(self.alpha * pow(1 - self.alpha, age) * self.last_n_points_radius_ratio * scale)
+                      for age in range(1, self.n + 1)]
+
+    def get_last_n_stamps(self, scale=1.0):
+        """ Disc stamps (and the offset of their center) of the last N points by age at a view scale """
+        if self.last_n_stamps is None or self.last_n_stamps[0] != scale:
+            radii = self.last_n_radii if scale == 1.0 else self.get_last_n_radii(scale)
+            self.last_n_stamps = (scale, [(get_disc_stamp(self.color_repr, radius), radius + DISC_STAMP_MARGIN)
+                                          for radius in radii])
+        return self.last_n_stamps[1]
+
+    def get_state(self):
+        """ Builds an immutable HabitatState from the working state of the update thread. """
+        return self.build_state(self.get_last_n_points(), self.circle_center, self.circle_radius,
+                                self.focus_1, self.focus_2, self.ellipse_center, self.ellipse_radius)
+
+    def build_state(self, points, circle_center, circle_radius, focus_1, focus_2, ellipse_center, ellipse_radius):
+        """ Builds an immutable HabitatState from flat [x0, y0, x1, y1...] last N points and shape values """
+        last_n_points = tuple(zip([int(x) for x in points[0::2]], [int(y) for y in points[1::2]]))
+
+        # The circle (or square) and the ellipse (or rectangle, its half diagonal is below 0.71 times
+        # the major axis) around their centers, and the discs of the last N points
+        radius = circle_radius + self.HABITAT_WIDTH
+        left, top = circle_center[0] - radius, circle_center[1] - radius
+        right, bottom = circle_center[0] + radius, circle_center[1] + radius
+        radius = ellipse_radius * 0.71 + self.HABITAT_WIDTH
+        left, top = min(left, ellipse_center[0] - radius), min(top, ellipse_center[1] - radius)
+        right, bottom = max(right, ellipse_center[0] + radius), max(bottom, ellipse_center[1] + radius)
+        if last_n_points:
+            radius = max(self.last_n_radii) + DISC_STAMP_MARGIN
+            left, top = min(left, min(points[0::2]) - radius), min(top, min(points[1::2]) - radius)
+            right, bottom = max(right, max(points[0::2]) + radius), max(bottom, max(points[1::2]) + radius)
+
+        return HabitatState(circle_center=tuple(circle_center),
+                            circle_radius=circle_radius,
+                            focus_1=tuple(focus_1),
+                            focus_2=tuple(focus_2),
+                            ellipse_center=tuple(ellipse_center),
+                            ellipse_radius=ellipse_radius,
+                            last_n_points=last_n_points,
+                            bounds=(left, top, right, bottom))
+
+    def draw(self, surface, view):
+        """ Draws a habitat and its last N points from the published state through a View """
+        state = self.published_state()
+        if state is None:
+            return
+        habitat_width = max(1, int(round(self.HABITAT_WIDTH * view.scale)))
+
+        if (self.shape == "circle" or self.shape == "square") and state.circle_radius and state.circle_center and \
+                state.circle_radius > self.HABITAT_WIDTH + 1:
+
+            if self.shape == "circle":
+                # pg.draw.circle(surface, pg.color.Color("black"), map(int, self.center),
+                #                int(self.radius), self.HABITAT_WIDTH + 1)
+                # pg.draw.circle(surface, pg.color.Color("black"), map(int, self.center),
+                #                int(self.radius) + self.HABITAT_WIDTH, 1)
+                pg.draw.circle(surface, self.color_repr, view.point(state.circle_center),
+                               int(view.length(state.circle_radius)), habitat_width)
+            elif self.shape == "square":
+
+                # Calculate edge length as twice the length of the radius
+                edge = view.length(state.circle_radius * 2)
+                rect = pg.Rect(0, 0, edge, edge)
+                rect.center = view.point(state.circle_center)
+
+                pg.draw.rect(surface, self.color_repr, rect, habitat_width)
+
+        elif (self.shape == "ellipse" or self.shape == "rectangle") and state.focus_1 and state.focus_2 and \
+                state.ellipse_center:
+
+            # Calculate minimum rectangle that contains the ellipse with focus points
+            # Major axis is a + b (a,b are the distances from each focus to any point on the ellipse (radius))
+            # Minor axis is the hypotenuse of the triangle rectangle with edges major axis and distance
+            # between focal points. We calculate Minor axis with Pitagoras.
+
+            major_axis = view.length(state.ellipse_radius)
+            minor_axis = None
+
+            focus_distance = view.length(self.distance(state.focus_2, state.focus_1))
+            if pow(major_axis, 2) - pow(focus_distance, 2) > 0:
+                minor_axis = math.sqrt(pow(major_axis, 2) - pow(focus_distance, 2))
+
+            if minor_axis and minor_axis > habitat_width * 2 + 1:
+                # Create minimum rectangle that contains the habitat
+                rect = pg.Rect(0, 0, major_axis, minor_axis)
+
+                # Draw habitat into intermediate surface
+                habitat_surface = pg.Surface((major_axis, minor_axis))
+                habitat_surface.set_colorkey(pg.color.Color("black"))
+                if self.shape == "ellipse":
+                    pg.draw.ellipse(habitat_surface, self.color_repr, rect, habitat_width)
+                elif self.shape == "rectangle":
+                    pg.draw.rect(habitat_surface, self.color_repr, rect, habitat_width)
+
+                # Get inclination
+                dx, dy = state.focus_1[0] - state.focus_2[0], state.focus_1[1] - state.focus_2[1]
+                rads_angle = math.atan2(dx, dy)
+                degs_angle = (math.degrees(rads_angle) + 90) % 360.0
+
+                # Incline habitat if necessary
+                if degs_angle != 0:
+                    habitat_surface = pg.transform.rotate(habitat_surface, degs_angle)
+
+                # Draw intermediate surface into surface
+                center_x, center_y = view.transform(state.ellipse_center)
+                position = [center_x - habitat_surface.get_width() / 2,
+                            center_y - habitat_surface.get_height() / 2]
+                surface.blit(habitat_surface, position)
+
+        # Show last N points (ordered from the oldest to the newest one) blitting all their discs at once
+        if self.show_last_n_points and state.last_n_points:
+            stamps = self.get_last_n_stamps(view.scale)
+            # The state may still have more points than a just reduced N
+            points = state.last_n_points[-(len(stamps) - 1):]
+            blits = []
+            for age, point in zip(xrange(len(points), 0, -1), points):
+                stamp, offset = stamps[age]
+                x, y = view.point(point)
+                blits.append((stamp, (x - offset, y - offset)))
+            surface.blits(blits, False)
+
+    def get_outline(self, state):
+        """
+        Low segment outline of the habitat shape of a state as (world points or None, center, size), size
+        being the radius or half the major axis. It is computed once per published state and shape.
+        """
+        if self.outline is not None and self.outline[0] is state and self.outline[1] == self.shape:
+            return self.outline[2]
+
+        segments = self.OUTLINE_SEGMENTS
+        points = None
+        if self.shape == "circle" or self.shape == "square":
+            (x, y), size = state.circle_center, state.circle_radius
+            if self.shape == "circle":
+                points = [(x + size * math.cos(2 * math.pi * i / segments),
+                           y + size * math.sin(2 * math.pi * i / segments)) for i in xrange(segments)]
+            else:
+                points = [(x - size, y - size), (x + size, y - size), (x + size, y + size), (x - size, y + size)]
+        else:
+            # Major axis along the foci, as drawn by draw
+            (x, y), size = state.ellipse_center, state.ellipse_radius / 2.0
+            focus_distance = self.distance(state.focus_2, state.focus_1)
+            minor = math.sqrt(max(0.0, pow(state.ellipse_radius, 2) - pow(focus_distance, 2))) / 2.0
+            if minor:
+                dx, dy = state.focus_1[0] - state.focus_2[0], state.focus_1[1] - state.focus_2[1]
+                ux, uy = (dx / focus_distance, dy / focus_distance) if focus_distance else (1.0, 0.0)
+                if self.shape == "ellipse":
+                    axes = [(size * math.cos(2 * math.pi * i / segments), minor * math.sin(2 * math.pi * i / segments))
+                            for i in xrange(segments)]
+                else:
+                    axes = [(-size, -minor), (size, -minor), (size, minor), (-size, minor)]
+                points = [(x + a * ux - b * uy, y + a * uy + b * ux) for a, b in axes]
+
+        self.outline = (state, self.shape, (points, (x, y), size))
+        return self.outline[2]
+
+    def get_region(self):
+        """
+        Area of the published habitat shape as a Region (see lib.overlap), None while it has no area. The same
+        object is returned until the values of the shape change.
+        """
+        state = self.published_state()
+        if self.region is not None and self.region[0] is state and self.region[1] == self.shape:
+            return self.region[2]
+
+        region = None
+        if state is not None and (self.shape == "circle" or self.shape == "square"):
+            if state.circle_radius > 0:
+                region = build_region(state.circle_center, (1.0, 0.0), state.circle_radius, state.circle_radius,
+                                      self.shape == "square")
+        elif state is not None:
+            # Same axes as get_outline
+            focus_distance = self.distance(state.focus_2, state.focus_1)
+            minor = math.sqrt(max(0.0, pow(state.ellipse_radius, 2) - pow(focus_distance, 2))) / 2.0
+            if minor:
+                dx, dy = state.focus_1[0] - state.focus_2[0], state.focus_1[1] - state.focus_2[1]
+                axis = (dx / focus_distance, dy / focus_distance) if focus_distance else (1.0, 0.0)
+                region = build_region(state.ellipse_center, axis, state.ellipse_radius / 2.0, minor,
+                                      self.shape == "rectangle")
+
+        # A new state with the same shape values keeps the Region, so readers skip it
+        if self.region is not None and self.region[2] == region:
+            region = self.region[2]
+        self.region = (state, self.shape, region)
+        return region
+
+    def draw_simplified(self, surface, view, outline=True):
+        """ Draws the habitat as a low segment outline, or as a marker at its center when it is small on screen """
+        state = self.published_state()
+        if state is None:
+            return
+        points, center, size = self.get_outline(state)
+        if outline and points and size * view.scale >= self.MARKER_PIXELS:
+            # Points scaled once per state and scale, only translated while the camera moves
+            cached = self.outline_pixels
+            if cached is None or cached[0] is not state or cached[1] != self.shape or cached[2] != view.scale:
+                cached = self.outline_pixels = (state, self.shape, view.scale,
+                                                [view.scaled_point(point) for point in points])
+            offset_x, offset_y = view.offset()
+            pg.draw.lines(surface, self.color_repr, True, [(x - offset_x, y - offset_y) for x, y in cached[3]])
+        else:
+            x, y = view.point(center)
+            surface.fill(self.color_repr, (x - 1, y - 1, 2, 2))
+
+    def __str__(self):
+        return self.color_str
+
+    def distance(self, point1, point2):
+        distance = math.sqrt(pow(point2[0] - point1[0], 2.0) +
+                             pow(point2[1] - point1[1], 2.0))
+        if distance < 1e-5:
+            distance = 0
+
+        return distance
+
+    def ewma_points(self, center_old, current_location, factor):
+        return [current_loc_coord * factor + center_old_coord * (1.0 - factor)
+                for center_old_coord, current_loc_coord in zip(center_old, current_location)]
+
+    def get_center(self):
+        """
+        Calculates the center of the habitat from the node rectangle.
+        takes into consideration HEIGHT_OFFSET and WIDTH_OFFSET
+        """
+        node_center = [self.node_rect.left + self.node_rect.width / 2 + self.WIDTH_OFFSET,
+                       self.node_rect.top + self.node_rect.height + self.HEIGHT_OFFSET]
+
+        return node_center
+
+    def get_checkpoint(self):
+        """ Returns the numeric state of the habitat as a tuple (NaN for points not set yet) """
+        def point(value):
+            return tuple(value) if value is not None else (NAN, NAN)
+
+        return ((self.n, self.beta, self.update_freq, self.show_last_n_points) +
+                point(self.circle_center) + (self.circle_radius,) +
+                point(self.focus_1) + point(self.focus_2) + point(self.ellipse_center) + (self.ellipse_radius,) +
+                (NAN if self.next_update is None else self.next_update,) + point(self.last_location) +
+                (self.pending_samples, self.last_n_point_count, self.last_n_point_start))
+
+    def set_checkpoint(self, values, last_n_points, state_samples=None):
+        """
+        Restores a state returned by get_checkpoint, its last N points ring buffer and the deferred samples
+        its published state included (state_samples, all of them by default)
+        """
+        def point(x, y):
+            return None if math.isnan(x) else [x, y]
+
+        (n, self.beta, self.update_freq, show_last_n_points,
+         circle_x, circle_y, self.circle_radius, focus_1_x, focus_1_y, focus_2_x, focus_2_y,
+         ellipse_x, ellipse_y, self.ellipse_radius, next_update, location_x, location_y,
+         pending_samples, last_n_point_count, last_n_point_start) = values
+        self.n = int(n)
+        self.alpha = 2.0 / (self.n + 1)
+        self.beta = int(self.beta)
+        self.show_last_n_points = bool(show_last_n_points)
+        self.circle_center = point(circle_x, circle_y)
+        self.focus_1 = point(focus_1_x, focus_1_y)
+        self.focus_2 = point(focus_2_x, focus_2_y)
+        self.ellipse_center = point(ellipse_x, ellipse_y)
+        self.next_update = None if math.isnan(next_update) else next_update
+        self.last_location = point(location_x, location_y)
+        self.pending_samples = int(pending_samples)
+
+        self.last_n_points = array.array('d', last_n_points)
+        self.last_n_point_count = int(last_n_point_count)
+        self.last_n_point_start = int(last_n_point_start)
+        self.last_n_radii = self.get_last_n_radii()
+        self.last_n_stamps = None
+
+        # Nothing has been published before the first update. The published state is built again with the
+        # deferred samples it included, so restored runs read the same states.
+        self.state = self.get_state() if self.circle_center is not None else None
+        self.state_samples = self.checked_samples = 0
+        if state_samples is None:
+            state_samples = self.pending_samples
+        if self.state is not None and state_samples:
+            self.state = self.get_deferred_state(state_samples)
+            self.state_samples = self.checked_samples = state_samples
+
+    def set_n(self, n):
+        """ Updates N, keeping the newest last N points """
+        self.flush()
+        points = self.get_last_n_points()[-2 * n:]
+        self.n = n
+        self.alpha = 2.0 / (self.n + 1)
+        self.last_n_points = array.array('d', [0.0]) * (2 * n)
+        self.last_n_points[:len(points)] = points
+        self.last_n_point_count = len(points) // 2
+        self.last_n_point_start = self.last_n_point_count % n
+        self.last_n_radii = self.get_last_n_radii()
+        self.last_n_stamps = None
+
+    def set_beta(self, beta):
+        """ Updates beta """
+        self.flush()
+        self.beta = beta
+
+    def set_habitat_update_freq(self, update_freq):
+        """ Updates habitat update frequency """
+        self.update_freq = update_freq
+
+    def set_shape(self, shape):
+        """ Updates habitat shape """
+        self.flush()
+        self.shape = shape
+
+    def set_show_last_n_points(self, show_last_n_points):
+        """ Updates if habitat should show its last N weighted points """
+        self.flush()
+        if show_last_n_points == "True":
+            self.show_last_n_points = True
+        else:
+            self.show_last_n_points = False
+
+
+class Work(pg.sprite.Sprite):
+
+    """
+    Represents a work destination
+    """
+    #  [LEFT, RIGHT, TOP, BOTTOM]
+    MARGINS = [70, 10, 10, 10]
+
+    def __init__(self, image):
+        # Call the parent class (Sprite) constructor
+        pg.sprite.Sprite.__init__(self)
+
+        self.image = image
+        # self.mask = pg.mask.from_surface(self.image)
+        self.rect = image.get_rect()
+
+    def set_random_position(self, rng=random):
+        """ Sets workplace at random position """
+        self.rect.center = get_random_position(self.MARGINS, rng)
+
+    def draw(self, surface, view):
+        """ Draws workplace into surface """
+        view.blit(surface, self.image, self.rect.topleft)
+
+    def draw_marker(self, surface, view, color):
+        """ Draws a small square of color at the center (reduced levels of detail) """
+        x, y = view.point(self.rect.center)
+        pg.draw.rect(surface, color, (x - 2, y - 2, 5, 5), 1)
+
+
+class Home(pg.sprite.Sprite):
+
+    """
+    Represents a home destination
+    """
+    #  [LEFT, RIGHT, TOP, BOTTOM]
+    MARGINS = [10, 70, 10, 10]
+
+    def __init__(self, image):
+        # Call the parent class (Sprite) constructor
+        pg.sprite.Sprite.__init__(self)
+
+        self.image = image
+        # self.mask = pg.mask.from_surface(self.image)
+        self.rect = image.get_rect()
+
+    def set_random_position(self, rng=random):
+        """ Sets home at random position """
+        self.rect.center = get_random_position(self.MARGINS, rng)
+
+    def draw(self, surface, view):
+        """ Draws home into surface """
+        view.blit(surface, self.image, self.rect.topleft)
+
+    def draw_marker(self, surface, view, color):
+        """ Draws a small square of color at the center (reduced levels of detail) """
+        x, y = view.point(self.rect.center)
+        pg.draw.rect(surface, color, (x - 2, y - 2, 5, 5), 1)
+
+
+class AvoidablePlace(pg.sprite.Sprite):
+
+    """
+    Represents a home destination
+    """
+    #  [LEFT, RIGHT, TOP, BOTTOM]
+    MARGINS = [40, 40, 10, 10]
+
+    def __init__(self, image):
+        # Call the parent class (Sprite) constructor
+        pg.sprite.Sprite.__init__(self)
+
+        self.image = image
+        # self.mask = pg.mask.from_surface(self.image)
+        self.rect = image.get_rect()
+
+    def set_random_position(self, rng=random):
+        """ Sets home at random position """
+        self.rect.center = get_random_position(self.MARGINS, rng)
+
+    def draw(self, surface, view):
+        """ Draws home into surface """
+        view.blit(surface, self.image, self.rect.topleft)
+
+
+class Character(pg.sprite.Sprite):
+
+    """
+    Represents the character of a node.
+
+    Automatic (random) movement is computed for all characters at once by a MobilityEngine,
+    characters only follow the position of their agent.
+    """
+
+    DEFAULT_SPEED = 100
+    DEFAULT_MOVEMENT = "automatic"
+    UPDATE_COUNT = 2  # Every how many position changes update character movement iamge.
+    INITIAL_RANDOM_POSIITON_MARGINS = [15, 15, 15, 15]
+
+    HOME_AREA = [250, 250]
+    WORK_AREA = [250, 250]
+
+    def __init__(self, character_spritesheet, speed=DEFAULT_SPEED, movement=DEFAULT_MOVEMENT, rng=random,
+                 mobility_model=DEFAULT_MODEL):
+        # Call the parent class (Sprite) constructor
+        pg.sprite.Sprite.__init__(self)
+
+        # Random stream of this character (seeded per node for reproducible runs)
+        self.random = rng
+
+        # Load character facing the direction of the node
+        self.character_spritesheet = character_spritesheet
+        self.trace_id = tracing.name_id(character_spritesheet.color)
+        self.image = self.character_spritesheet.first()
+        self.rect = self.image.get_rect()
+        self.update_count = 0
+
+        # Get random inital posiiton
+        self.move = get_random_position(self.INITIAL_RANDOM_POSIITON_MARGINS, self.random)
+        self.rect.center = self.move  # Set initial position
+        self.previous_move = list(self.move)  # Position before the last update (for interpolation)
+        self.speed = speed  # Node speed
+
+        # Character movement image update frequency.
+        # Means: update character movement every self.update_freq position changes.
+        self.update_freq = self.UPDATE_COUNT
+        self.update_count = 0
+
+        # Character home and workplaces
+        # Needed for random movement
+        self.home_rect = None
+        self.workplace_rect = None
+        self.home_area = None
+        self.workplace_area = None
+
+        # Movement type
+        self.movement = movement
+
+        # Position received from an external device, applied on the next update ("external" movement)
+        self.external_position = None
+
+        # Agent of the mobility engine (see attach_mobility) and its mobility model
+        self.mobility = None
+        self.mobility_index = None
+        self.mobility_model = mobility_model
+
+        logging.debug("Created {0} node. Initial position ({1})".format(self.character_spritesheet, self.move))
+
+    def attach_mobility(self, mobility):
+        """ Registers the character as an agent of a MobilityEngine, its random stream keyed from this node's one """
+        self.mobility = mobility
+        self.mobility_index = mobility.add_agent(self.move, self.rect.size, self.speed,
+                                                 active=self.movement == "automatic",
+                                                 trace_id=self.trace_id, model=self.mobility_model,
+                                                 key=self.random.getrandbits(64))
+
+    def set_home_rect(self, home_rect):
+        """ Set home Rect and calculates its area """
+        self.home_rect = home_rect
+        self.home_area = pg.Rect(0, 0, self.HOME_AREA[0], self.HOME_AREA[1])
+        self.home_area.center = home_rect.center
+        if self.mobility:
+            self.mobility.set_area(self.mobility_index, HOME, self.home_area)
+
+    def set_workplace_rect(self, worplace_rect):
+        """ Set workplace Rect and calculates its area """
+        self.workplace_rect = worplace_rect
+        self.workplace_area = pg.Rect(0, 0, self.WORK_AREA[0], self.WORK_AREA[1])
+        self.workplace_area.center = worplace_rect.center
+        if self.mobility:
+            self.mobility.set_area(self.mobility_index, WORKPLACE, self.workplace_area)
+
+    def draw(self, surface, view, interpolation=1.0):
+        """
+        Draws a chracter. interpolation (0..1) places it between its position before
+        and after the last simulation update.
+        """
+        rect = self.rect.copy()
+        rect.center = (self.previous_move[0] + (self.move[0] - self.previous_move[0]) * interpolation,
+                       self.previous_move[1] + (self.move[1] - self.previous_move[1]) * interpolation)
+        view.blit(surface, self.image, rect.topleft)
+
+    def draw_point(self, surface, view, color, interpolation=1.0):
+        """ Draws the character as a point of color (reduced levels of detail) """
+        x, y = view.point((self.previous_move[0] + (self.move[0] - self.previous_move[0]) * interpolation,
+                           self.previous_move[1] + (self.move[1] - self.previous_move[1]) * interpolation))
+        surface.fill(color, (x - 1, y - 1, 3, 3))
+
+    def update(self, world_rect, keys, dt, now, animate=True):
+        """
+        Updates chracter position. now is the simulation time. The sprite is only animated if animate
+        (characters drawn as points don't need it).
+        """
+        self.previous_move = list(self.move)
+        if self.movement == "automatic":
+            # The position has already been advanced by the mobility engine
+            if animate and self.mobility.moved[self.mobility_index]:
+                self.update_char(self.mobility.direction[self.mobility_index].tolist())
+            self.move = self.mobility.get_position(self.mobility_index).tolist()
+            self.rect.center = self.move
+        elif self.movement == "external":
+            # Positions of external devices (see lib.ingest), only the newest one since the last step
+            if self.external_position is not None:
+                dx = self.external_position[0] - self.move[0]
+                dy = self.external_position[1] - self.move[1]
+                if animate:
+                    self.update_char([(dx > 0.5) - (dx < -0.5), (dy > 0.5) - (dy < -0.5)])
+                self.move = list(self.external_position)
+                self.rect.center = self.move
+                self.external_position = None
+                if not world_rect.contains(self.rect):
+                    self.rect.clamp_ip(world_rect)
+                    self.move = list(self.rect.center)
+        else:
+            vector = [0, 0]
+            for key in DIRECT_DICT:
+                if keys[key]:
+                    vector[0] += DIRECT_DICT[key][0]
+                    vector[1] += DIRECT_DICT[key][1]
+            if animate:
+                self.update_char(vector)
+            frame_speed = self.get_frame_speed(vector, dt)
+            self.move[0] += vector[0] * frame_speed
+            self.move[1] += vector[1] * frame_speed
+            self.rect.center = self.move
+
+            # Stop node of going off limits (the mobility engine does it for automatic movement)
+            if not world_rect.contains(self.rect):
+                self.rect.clamp_ip(world_rect)
+                self.move = list(self.rect.center)
+
+    def get_checkpoint(self):
+        """ Returns the numeric state of the character (position, sprite and mobility agent) """
+        external = self.external_position if self.external_position is not None else (NAN, NAN)
+        return (tuple(self.move) + tuple(self.previous_move) + self.rect.topleft + tuple(external) +
+                (self.speed, self.update_count, self.character_spritesheet.direction,
+                 self.character_spritesheet.movement, -1 if self.mobility_index is None else self.mobility_index))
+
+    def set_checkpoint(self, values, mobility):
+        """ Restores a state returned by get_checkpoint. The agent is already in the (restored) mobility engine. """
+        (move_x, move_y, previous_x, previous_y, left, top, external_x, external_y,
+         self.speed, update_count, direction, movement, mobility_index) = values
+        self.move = [move_x, move_y]
+        self.previous_move = [previous_x, previous_y]
+        self.rect.topleft = (int(left), int(top))
+        self.external_position = None if math.isnan(external_x) else (external_x, external_y)
+        self.update_count = int(update_count)
+        spritesheet = self.character_spritesheet
+        spritesheet.direction = int(direction)
+        spritesheet.movement = int(movement)
+        spritesheet.set_image_coords()
+        self.image = spritesheet.frames[(spritesheet.direction, spritesheet.movement)]
+        if mobility_index >= 0:
+            self.mobility = mobility
+            self.mobility_index = int(mobility_index)
+
+    def set_external_position(self, position):
+        """ Sets the position the character will have on its next update ("external" movement) """
+        self.external_position = position
+
+    def get_frame_speed(self, vector, dt):
+        """ Get speed using dt to adjust speed to different frame rates """
+        factor = (ANGLE_UNIT_SPEED if all(vector) else 1)
+        frame_speed = self.speed * factor * dt
+
+        return frame_speed
+
+    def update_char(self, direction_vector):
+        """
+        Updates character movement image.
+        Only if character moves.
+        """
+        if direction_vector == [0, -1]:
+            self.update_char_image(0)
+        elif direction_vector == [1, -1]:
+            self.update_char_image(1)
+        elif direction_vector == [1, 0]:
+            self.update_char_image(2)
+        elif direction_vector == [1, 1]:
+            self.update_char_image(3)
+        elif direction_vector == [0, 1]:
+            self.update_char_image(4)
+        elif direction_vector == [-1, 1]:
+            self.update_char_image(5)
+        elif direction_vector == [-1, 0]:
+            self.update_char_image(6)
+        elif direction_vector == [-1, -1]:
+            self.update_char_image(7)
+
+    def update_char_image(self, direction):
+        """ Update character image. """
+        if self.update_count == self.update_freq:
+            # Update node character movement
+            self.character_spritesheet.set_direction(direction)
+            self.image = self.character_spritesheet.next()
+
+            self.update_count = 0
+        else:
+            self.update_count += 1
+
+    def set_movement(self, movement):
+        self.movement = movement
+        if self.mobility:
+            # Automatic movement continues from the current position
+            self.mobility.set_position(self.mobility_index, self.move)
+            self.mobility.set_active(self.mobility_index, movement == "automatic")
+
+    def set_mobility_model(self, mobility_model):
+        """ Changes the model of automatic movement (see lib.mobility), it restarts from the current position """
+        self.mobility_model = mobility_model
+        if self.mobility:
+            self.mobility.set_position(self.mobility_index, self.move)
+            self.mobility.set_model(self.mobility_index, mobility_model)
+
+
+class Node(object):
+
+    """
+    Groups all the elemtns that represent a node and manages its update and drawing.
+    """
+
+    def __init__(self, character, home, workplace, habitat_update_mode=Habitat.DEFAULT_UPDATE_MODE):
+        self.character = character
+        self.home = home
+        self.workplace = workplace
+        # The habitat is first updated by the first simulation step,
+        # so it starts from the intial position of the node.
+        self.habitat = Habitat(self.character.rect,
+                               color=self.character.character_spritesheet.color,
+                               update_mode=habitat_update_mode)
+
+    def update(self, world_rect, keys, dt, now, animate=True):
+        """ One simulation step: update character position and movement, then its habitat """
+        self.character.update(world_rect, keys, dt, now, animate)
+        self.habitat.step(now)
+
+    def get_bounds(self):
+        """ World bounds (left, top, right, bottom) of the character (at both its last positions) and habitat """
+        character = self.character
+        half_width, half_height = character.rect.width / 2.0, character.rect.height / 2.0
+        left = min(character.move[0], character.previous_move[0]) - half_width
+        top = min(character.move[1], character.previous_move[1]) - half_height
+        right = max(character.move[0], character.previous_move[0]) + half_width
+        bottom = max(character.move[1], character.previous_move[1]) + half_height
+        state = self.habitat.published_state()
+        if state is not None:
+            bounds = state.bounds
+            left, top = min(left, bounds[0]), min(top, bounds[1])
+            right, bottom = max(right, bounds[2]), max(bottom, bounds[3])
+        return left, top, right, bottom
+
+    def draw(self, surface, view, interpolation=1.0, detail=LOD_FULL):
+        """ Draw all components of a node through a View (see lib.view) at a level of detail """
+        # Draw home / work
+        self.draw_place(surface, view, self.home, detail)
+        self.draw_place(surface, view, self.workplace, detail)
+
+        self.draw_moving(surface, view, interpolation, detail)
+
+    def draw_place(self, surface, view, place, detail=LOD_FULL):
+        """ Draw the home or the workplace of the node (markers leave them out) """
+        if place and detail == LOD_FULL:
+            place.draw(surface, view)
+        elif place and detail == LOD_OUTLINES:
+            place.draw_marker(surface, view, self.habitat.color_repr)
+
+    def draw_moving(self, surface, view, interpolation=1.0, detail=LOD_FULL):
+        """ Draw the habitat and the character of a node """
+        if detail == LOD_FULL:
+            # Draw habitat
+            self.habitat.draw(surface, view)
+
+            # Draw character
+            self.character.draw(surface, view, interpolation)
+        else:
+            self.habitat.draw_simplified(surface, view, outline=detail == LOD_OUTLINES)
+            self.character.draw_point(surface, view, self.habitat.color_repr, interpolation)
+
+
+class Control(object):
+
+    """
+    Controls demo scenario.
+
+    The simulation advances in fixed steps of 1 / tick_rate seconds (an accumulator collects
+    the real frame time), independently of the render rate. Frames draw characters
+    interpolated between the last two steps. With the same seed, runs are reproducible.
+    """
+    FPS = 60.0
+    TICK_RATE = 60.0  # Simulation steps per second
+    MAX_FRAME_TIME = 0.25  # Seconds. Longer frames are simulated as this long (avoids spiralling)
+    COLOR_ACTIVE_NODES = ('green', 'grey', 'red', 'yellow')
+
+    HOME_SEPARATION_RATIO = 5
+    WORK_SEPARATION_RATIO = 3
+
+    DEFAULT_SEPARATION_RATIO = 2
+    # Separation ratios are relaxed by this factor each time positioning fails (many nodes)
+    SEPARATION_RELAX_FACTOR = 0.9
+
+    AVOIDABLE_PLACE_IMAGE = "data/disco.png"
+    BACKGROUND_IMAGE = "data/grass4.jpg"
+    AVOIDABLE_PLACE_MARGINS = [15, 15, 15, 15]
+
+    SELECTABLE_N = ('2', '5', '10', '15', '25', '50')
+    SELECTABLE_BETA = ('1', '5', '10', '15', '25', '50')
+    SELECTABLE_UPDATE_FREQS = ('0.1', '0.25', '0.5', '0.75', '1')
+    SELECTABLE_SHAPES = ('Ellipse', 'Circle', 'Square', 'Rectangle')
+    SELECTABLE_MOVEMENTS = ('automatic', 'manual')
+    SELECTABLE_MOBILITY_MODELS = MODEL_NAMES
+    DEVICE_NODE_NAME = "device-{0}"
+    DEVICE_WARNING_INTERVAL = 10  # Seconds between the warnings about ignored devices
+    TIMELINE_HEIGHT = 24  # Pixels
+    MIN_RENDER_SCALE = 0.25
+    RENDER_SCALE_STEP = 0.85  # Factor of each adaptive resolution change
+    ADAPT_FRAMES = 30  # Frames averaged before each adaptive resolution decision
+    # Frame work time (without waiting for the next frame) as a fraction of the frame time that lowers / raises
+    # the render resolution
+    OVER_BUDGET = 0.95
+    UNDER_BUDGET = 0.6
+    TIMELINE_KEYFRAME_COLOR = (120, 120, 120)
+    TIMELINE_CURSOR_COLOR = (255, 255, 255)
+    # Zoom levels are powers of ZOOM_STEP (few distinct scales, so scaled images stay cached)
+    ZOOM_STEP = 2 ** 0.25
+    MAX_ZOOM_LEVEL = 8  # 4x
+    # Automatic level of detail: characters smaller than LOD_SPRITE_PIXELS on screen or more visible nodes than
+    # LOD_MAX_FULL_NODES are drawn as points with habitat outlines, more than LOD_MAX_OUTLINE_NODES with habitat
+    # markers. Going back to more detail needs LOD_HYSTERESIS times fewer nodes (no flicker around the limits).
+    LOD_SPRITE_PIXELS = 12
+    LOD_MAX_FULL_NODES = 300
+    LOD_MAX_OUTLINE_NODES = 2000
+    LOD_HYSTERESIS = 0.8
+    SELECTABLE_SHOW_LAST_N_POINTS = ('True', 'False')
+    VARIANT_VIEWS = ("overlay", "split", None)  # Views V cycles through
+    VARIANT_PANE_COLOR = (30, 45, 30)
+    VARIANT_PANE_BORDER_COLOR = (200, 200, 200)
+
+    def __init__(self, options):
+        os.environ['SDL_VIDEO_CENTERED'] = '1'  # Center screen
+        self.headless = options.headless
+        if self.headless:
+            # Render into an offscreen surface, as fast as possible
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        pg.init()  # Init pygame
+        if self.headless:
+            # The dummy display is 8 bits deep by default
+            self.screen = pg.display.set_mode(GlobalVars.SCREEN_SIZE, 0, 32)
+        elif options.fullscreen:
+            display_info = pg.display.Info()
+            GlobalVars.SCREEN_SIZE[0] = display_info.current_w
+            GlobalVars.SCREEN_SIZE[1] = display_info.current_h
+            self.screen = pg.display.set_mode(GlobalVars.SCREEN_SIZE, pg.FULLSCREEN)
+        else:
+            self.screen = pg.display.set_mode(GlobalVars.SCREEN_SIZE)
+        self.screen_rect = self.screen.get_rect()  # Get screen rectangle (so we know screen limits)
+
+        # Simulated world (at least as large as the screen). Node components are kept in a spatial index,
+        # so when the camera shows part of the world only the visible ones are drawn.
+        world_size = options.world_size or self.screen_rect.size
+        GlobalVars.WORLD_SIZE[0] = max(world_size[0], self.screen_rect.width)
+        GlobalVars.WORLD_SIZE[1] = max(world_size[1], self.screen_rect.height)
+        self.world_rect = pg.Rect((0, 0), GlobalVars.WORLD_SIZE)
+        self.spatial_index = SpatialGrid()
+        self.indexed_tick = None  # Tick of the node bounds in the spatial index
+        self.background_tile = None  # (scale, background image scaled to the view), see _draw_background
+
+        # Decayed visit density of the nodes (see lib.heatmap), H shows and hides it
+        self.heatmap = None
+        self.show_heatmap = True
+        if options.heatmap:
+            self.heatmap = Heatmap(self.world_rect.size, options.heatmap, options.heatmap_half_life)
+        self.node_table = None  # Node keys and where their positions are (by snapshot), see _node_positions
+
+        # Pairwise overlap areas of the habitats (see lib.overlap), updated every step, O logs the largest ones
+        self.overlaps = OverlapMatrix() if options.overlaps else None
+
+        # Navigation grid of the obstacles ("places" avoidable places, "all" also homes and workplaces) the
+        # automatic nodes walk around (see lib.navigation), rebuilt when they change
+        self.navigation_obstacles = options.navigation
+        self.navigation = None
+        self.navigation_key = None  # (mobility engine, avoidable places, nodes) the grid was set for
+
+        # Habitat model variants of every node fed the same samples (see lib.variants), V draws them over the
+        # scene, in a pane each or not at all
+        self.variants = None
+        self.variant_view = self.VARIANT_VIEWS[0]
+        self.variant_font = None
+        if options.habitat_variants:
+            self.variants = HabitatVariants([Variant(int(spec.get("n", Habitat.DEFAULT_N)),
+                                                     int(spec.get("beta", Habitat.DEFAULT_BETA)),
+                                                     spec.get("shape", Habitat.DEFAULT_SHAPE))
+                                             for spec in options.habitat_variants],
+                                            Habitat.DEFAULT_HABITAT_UPDATE_FREQ)
+
+        # Level of detail of the nodes drawn ("auto" chooses it every frame), sprites are only animated at full detail
+        self.detail = options.detail
+        self.lod = LOD_FULL
+        self.animate = True
+
+        # The scene is drawn through a View at render_scale times the screen resolution into an offscreen
+        # surface scaled to the screen once per frame (directly into the screen at scale 1). The adaptive
+        # mode lowers the scale when frames go over budget, and raises it back up to the given one.
+        self.view = View()
+        self.scene = None
+        self.max_render_scale = min(max(options.render_scale, self.MIN_RENDER_SCALE), 1.0)
+        self.adaptive_resolution = options.adaptive_resolution and not self.headless
+        self.frame_work_times = []
+        self._set_render_scale(self.max_render_scale)
+
+        # Camera: right drag pans, the mouse wheel (or page up / down) zooms, 0 shows the whole world
+        self.min_zoom_level = int(math.floor(math.log(min(
+            float(self.screen_rect.width) / self.world_rect.width,
+            float(self.screen_rect.height) / self.world_rect.height)) / math.log(self.ZOOM_STEP) + 1e-9))
+        self.zoom_level = 0
+        self.camera_center = (self.world_rect.centerx, self.world_rect.centery)
+        self.panning = False
+        self._set_camera(self.camera_center, self.zoom_level)
+        self.clock = pg.time.Clock()  # Get pygame clock
+        self.fps = Control.FPS  # Set frames per second
+
+        # Fixed step simulation. Checkpoints keep their tick rate unless one is given (requested_tick_rate).
+        self.requested_tick_rate = options.tick_rate
+        self.tick_rate = options.tick_rate or self.TICK_RATE
+        self.tick_dt = 1.0 / self.tick_rate
+        self.tick = 0  # Simulation steps done (simulation time is tick * tick_dt)
+        self.accumulator = 0.0
+
+        # Random streams: one for the scenario layout, one per node (see get_node_random)
+        self.seed = options.seed if options.seed is not None else random.randrange(2 ** 32)
+        logging.info("Simulation seed: {0}".format(self.seed))
+        self.random = random.Random(self.seed)
+        self.generation = 0  # Incremented on each node setup so RESET gets new streams
+
+        # Mobility models: default one and per node choices (kept on RESET)
+        self.mobility_model = options.mobility
+        self.node_mobility = dict(options.node_mobility)
+        self.habitat_update_mode = options.habitat_updates
+
+        # Positions of external devices (nodes are created on demand, up to ingest_max_devices nodes), and the
+        # positions of the devices beyond that ignored since the last warning
+        self.ingest = None
+        self.ingest_max_devices = options.ingest_max_devices
+        self.ignored_devices = 0
+        self.ignored_warning_time = None
+        if options.ingest:
+            from lib.ingest import IngestServer
+            self.ingest = IngestServer(options.ingest)
+            self.ingest.start()
+
+        # Get pressed keys
+        self.keys = pg.key.get_pressed()
+
+        # Demonstration nodes (copy-on-write, the frame loop iterates snapshots without locking)
+        self.nodes = NodeRegistry()
+        self.node_colors = get_node_colors(options.nodes or len(self.COLOR_ACTIVE_NODES))
+        self.surface_cache = SurfaceCache(options.cache_dir) if not options.no_cache else None
+        self.assets = AssetManager(self.surface_cache)
+
+        # Set background
+        self._set_background()
+
+        # Setup nodes
+        self._setup_nodes()
+
+        # Setup avoidable (sensitive) places. They are indexed to draw only the visible ones, and the exposure of
+        # their visits by each node and its habitat is counted (see lib.exposure) when a report is requested.
+        self.avoidable_image = self.assets.image(self.AVOIDABLE_PLACE_IMAGE, colorkey="white")
+        self.avoidable_places = []
+        self.avoidable_index = SpatialGrid()
+        self.exposure = None
+        self.exposure_report = options.exposure_report
+        positions = []
+        for _ in xrange(options.avoidable_places):
+            place = AvoidablePlace(self.avoidable_image)
+            place.set_random_position(self.random)
+            positions.append(place.rect.topleft)
+        self._set_avoidable_places(positions)
+        if self.exposure_report:
+            self.exposure = ExposureTracker([self._place_bounds(avoidable) for avoidable in self.avoidable_places])
+
+        # Setup menu
+        self._setup_menu()
+
+        # Checkpoints of the simulation state: every checkpoint_every seconds of simulation time (and on
+        # quit) into checkpoint_path, F5 writes one and F9 restores it
+        self.checkpoint_path = options.checkpoint
+        self.checkpoint_every = options.checkpoint_every
+        self.next_checkpoint = self.checkpoint_every
+        self.checkpoint_tick = None  # Tick of the last checkpoint written
+
+        # Timeline of the run (see lib.timeline): F7 reviews past instants, F8 resumes from the reviewed one
+        self.timeline = None
+        self.keyframe_every = options.keyframe_every
+        self.timeline_memory = options.timeline_memory * 1024 * 1024
+        self.reviewing = False
+        self.seek_target = None  # Tick to reconstruct on the next frame (reviewing)
+        self.seeking = False  # Dragging the timeline bar
+        self.timeline_font = None
+        self.direction_keys = (False,) * len(DIRECTION_KEYS)  # Direction keys pressed (manual movement)
+
+        if options.restore:
+            if os.path.exists(options.restore):
+                self.load_checkpoint(options.restore)
+            else:
+                logging.warning("No checkpoint to restore in {0}, starting a new simulation".format(options.restore))
+        if self.keyframe_every and not self.timeline:
+            self._reset_timeline()
+
+        # Stop after this many seconds of simulation time (None runs until quit)
+        self.duration = options.duration
+
+        # Recording of the rendered frames (headless recordings write every frame)
+        self.recorder = None
+        if options.record:
+            from lib.recorder import Recorder
+            self.recorder = Recorder(options.record, self.screen, self.fps, every=options.record_every,
+                                     workers=options.record_workers, block=self.headless)
+
+    def _set_render_scale(self, scale):
+        """ Sets the render resolution as a fraction of the screen resolution """
+        self.view.set_scale(scale)
+        if scale == 1.0:
+            self.scene = None
+        else:
+            size = (max(1, int(round(self.screen_rect.width * scale))),
+                    max(1, int(round(self.screen_rect.height * scale))))
+            if self.scene is None or self.scene.get_size() != size:
+                self.scene = pg.Surface(size, 0, self.screen)
+        logging.debug("Render scale {0:.2f}".format(scale))
+
+    def _adapt_render_scale(self, work_time):
+        """ Lowers the render resolution when frames are over budget and raises it when there is time left """
+        self.frame_work_times.append(work_time)
+        if len(self.frame_work_times) < self.ADAPT_FRAMES:
+            return
+
+        load = sum(self.frame_work_times) / len(self.frame_work_times) * self.fps
+        self.frame_work_times = []
+        scale = self.view.render_scale
+        if load > self.OVER_BUDGET and scale > self.MIN_RENDER_SCALE:
+            self._set_render_scale(max(self.MIN_RENDER_SCALE, scale * self.RENDER_SCALE_STEP))
+        elif load < self.UNDER_BUDGET and scale < self.max_render_scale:
+            scale /= self.RENDER_SCALE_STEP
+            # Snap to the given scale once close to it
+            self._set_render_scale(self.max_render_scale if scale > self.max_render_scale * 0.99 else scale)
+
+    def _set_camera(self, center, zoom_level):
+        """ Moves the camera to a world center and zoom level, keeping the view inside the world """
+        self.zoom_level = min(max(zoom_level, self.min_zoom_level), self.MAX_ZOOM_LEVEL)
+        zoom = self.ZOOM_STEP ** self.zoom_level
+        half_width = self.screen_rect.width / 2.0 / zoom
+        half_height = self.screen_rect.height / 2.0 / zoom
+
+        def clamp(value, half, size):
+            # Centered when the view is larger than the world
+            return size / 2.0 if 2 * half >= size else min(max(value, half), size - half)
+
+        self.camera_center = (clamp(center[0], half_width, self.world_rect.width),
+                              clamp(center[1], half_height, self.world_rect.height))
+        self.view.set_camera((self.camera_center[0] - half_width, self.camera_center[1] - half_height), zoom)
+
+    def _zoom_at(self, zoom_level, position):
+        """ Zooms keeping the world point under a display position in place """
+        world_x, world_y = self.view.display_to_world(position)
+        zoom = self.ZOOM_STEP ** min(max(zoom_level, self.min_zoom_level), self.MAX_ZOOM_LEVEL)
+        self._set_camera((world_x + (self.screen_rect.centerx - position[0]) / zoom,
+                          world_y + (self.screen_rect.centery - position[1]) / zoom), zoom_level)
+
+    def _camera_event(self, event):
+        """ Camera keys and mouse (the wheel only zooms while no menu is open) """
+        if event.type == pg.MOUSEBUTTONDOWN and event.button in (4, 5) and not self.bar and \
+                not self.bar.rect.collidepoint(event.pos):
+            self._zoom_at(self.zoom_level + (1 if event.button == 4 else -1), event.pos)
+        elif event.type == pg.MOUSEBUTTONDOWN and event.button == 3:
+            self.panning = True
+        elif event.type == pg.MOUSEBUTTONUP and event.button == 3:
+            self.panning = False
+        elif event.type == pg.MOUSEMOTION and self.panning:
+            zoom = self.view.zoom
+            self._set_camera((self.camera_center[0] - event.rel[0] / zoom,
+                              self.camera_center[1] - event.rel[1] / zoom), self.zoom_level)
+        elif event.type == pg.KEYDOWN and event.key in (pg.K_PAGEUP, pg.K_PAGEDOWN):
+            self._zoom_at(self.zoom_level + (1 if event.key == pg.K_PAGEUP else -1), self.screen_rect.center)
+        elif event.type == pg.KEYDOWN and event.key == pg.K_0:
+            # Whole world, or back to the actual size
+            self._set_camera(self.camera_center, 0 if self.zoom_level == self.min_zoom_level else self.min_zoom_level)
+
+    def _draw_background(self, scene):
+        """ Draws the background mosaic of the world part shown (the prepared screen mosaic without camera) """
+        view = self.view
+        if view.is_identity():
+            scene.blit(view.image(self.background), (0, 0))
+            return
+
+        tile = self.assets.image(self.BACKGROUND_IMAGE)
+        if self.background_tile is None or self.background_tile[0] != view.scale:
+            # Rounded up, so consecutive tiles don't leave gaps
+            self.background_tile = (view.scale, pg.transform.scale(tile, (
+                int(math.ceil(tile.get_width() * view.scale)), int(math.ceil(tile.get_height() * view.scale)))))
+        scaled_tile = self.background_tile[1]
+
+        scene.fill((0, 0, 0))
+        left, top = view.point(self.world_rect.topleft)
+        right, bottom = view.point(self.world_rect.bottomright)
+        scene.set_clip(pg.Rect(left, top, right - left, bottom - top))
+        width, height = tile.get_size()
+        bounds = view.world_bounds(self.screen_rect.size)
+        columns = xrange(max(0, int(bounds[0] // width)), int(min(bounds[2], self.world_rect.width) // width) + 1)
+        rows = xrange(max(0, int(bounds[1] // height)), int(min(bounds[3], self.world_rect.height) // height) + 1)
+        scene.blits([(scaled_tile, view.point((column * width, row * height))) for row in rows for column in columns],
+                    False)
+        scene.set_clip(None)
+
+    def _index_places(self, nodes):
+        """ Indexes the homes and workplaces of a new node set (the moving components are indexed when drawn) """
+        self.spatial_index.clear()
+        self.indexed_tick = None
+        for name, node in nodes.iteritems():
+            for kind, place in ((PLACE_HOME, node.home), (PLACE_WORKPLACE, node.workplace)):
+                if place:
+                    self.spatial_index.update((name, kind), (place.rect.left, place.rect.top,
+                                                             place.rect.right, place.rect.bottom))
+
+    def _query_visible(self, nodes, bounds):
+        """ Returns the keys of the places and the names of the nodes in world bounds (sorted) """
+        if self.indexed_tick != self.tick:
+            update = self.spatial_index.update
+            for name, node in nodes.iteritems():
+                update(name, node.get_bounds())
+            self.indexed_tick = self.tick
+
+        places = []
+        names = []
+        for key in sorted(self.spatial_index.query(bounds)):
+            if isinstance(key, tuple):
+                places.append(key)
+            elif key in nodes:
+                names.append(key)
+        return places, names
+
+    def _level_of_detail(self, nodes, count):
+        """ Level of detail to draw count visible nodes """
+        if self.detail != "auto":
+            return LOD_NAMES[self.detail]
+
+        sprite_height = next(nodes.itervalues()).character.rect.height if nodes else 0
+        full_nodes, outline_nodes = self.LOD_MAX_FULL_NODES, self.LOD_MAX_OUTLINE_NODES
+        if self.lod >= LOD_OUTLINES:
+            full_nodes *= self.LOD_HYSTERESIS
+        if self.lod == LOD_MARKERS:
+            outline_nodes *= self.LOD_HYSTERESIS
+        if count > outline_nodes:
+            return LOD_MARKERS
+        if count > full_nodes or sprite_height * self.view.scale < self.LOD_SPRITE_PIXELS:
+            return LOD_OUTLINES
+        return LOD_FULL
+
+    def _draw_nodes(self, surface, interpolation):
+        """
+        Draws the nodes between the last two steps: only the visible ones when the camera shows part of
+        the world, at a level of detail chosen by their number and size on screen.
+        """
+        nodes = self.nodes.snapshot()
+        bounds = self.view.world_bounds(self.screen_rect.size)
+        if bounds[0] <= 0 and bounds[1] <= 0 and \
+                bounds[2] >= self.world_rect.width and bounds[3] >= self.world_rect.height:
+            self.lod = self._level_of_detail(nodes, len(nodes))
+            for node in nodes.itervalues():
+                node.draw(surface, self.view, interpolation, self.lod)
+        else:
+            places, names = self._query_visible(nodes, bounds)
+            self.lod = self._level_of_detail(nodes, len(names))
+            for name, kind in places:
+                node = nodes.get(name)
+                if node:
+                    node.draw_place(surface, self.view, node.home if kind == PLACE_HOME else node.workplace, self.lod)
+            for name in names:
+                nodes[name].draw_moving(surface, self.view, interpolation, self.lod)
+        self.animate = self.lod == LOD_FULL
+
+    def _set_avoidable_places(self, positions):
+        """ Places the avoidable places at positions (top left corners) """
+        self.avoidable_places = []
+        self.avoidable_index.clear()
+        for index, position in enumerate(positions):
+            place = AvoidablePlace(self.avoidable_image)
+            place.rect.topleft = position
+            self.avoidable_places.append(place)
+            self.avoidable_index.update(index, self._place_bounds(place))
+        if self.exposure:
+            self.exposure.set_places([self._place_bounds(avoidable) for avoidable in self.avoidable_places])
+
+    @staticmethod
+    def _place_bounds(place):
+        return place.rect.left, place.rect.top, place.rect.right, place.rect.bottom
+
+    def _draw_avoidable_places(self, surface):
+        """ Draws the avoidable places shown by the camera """
+        places = self.avoidable_places
+        for index in sorted(self.avoidable_index.query(self.view.world_bounds(self.screen_rect.size))):
+            places[index].draw(surface, self.view)
+
+    def write_exposure_report(self):
+        """ Writes the exposure of the avoidable places by node into the report file """
+        try:
+            self.exposure.write_report(self.exposure_report)
+        except (IOError, OSError), message:
+            logging.error("Exposure report failed: {0}".format(message))
+            return
+        inside = self.exposure.inside.sum()
+        logging.info("Exposure report of {0} nodes written to {1}: {2:.1f} s inside avoidable places, "
+                     "{3:.0%} exposed by the habitats".format(len(self.exposure.keys), self.exposure_report, inside,
+                                                              self.exposure.exposed.sum() / inside if inside else 0.0))
+
+    def _set_background(self):
+        """ Set mosaic background (cached on disk by tile file and screen size) """
+        if self.surface_cache:
+            key = self.surface_cache.key(self.surface_cache.file_hash(self.BACKGROUND_IMAGE),
+                                         "background", self.screen_rect.size)
+            self.background = self.surface_cache.get_or_create(key, self._build_background,
+                                                               lambda surface: surface.convert())
+        else:
+            self.background = self._build_background().convert()
+
+    def _build_background(self):
+        """ Builds the mosaic of the background file (display independent, so it can be cached) """
+        background = pg.Surface((self.screen_rect.width, self.screen_rect.height), 0, 24)
+        background.fill((0, 0, 0))
+
+        temp = self.assets.load(self.BACKGROUND_IMAGE)
+        width = temp.get_width()
+        height = temp.get_height()
+
+        dif_h = float(self.screen_rect.height) / height
+        dif_h = int(math.ceil(dif_h))
+        dif_w = float(self.screen_rect.width) / width
+        dif_w = int(math.ceil(dif_w))
+
+        if dif_h < 1:
+            dif_h = 1
+
+        if dif_w < 1:
+            dif_w = 1
+
+        # Fill all background with the mosaic of background file
+        for iterator1 in range(dif_h):
+            for iterator2 in range(dif_w):
+                background.blit(temp, (iterator2 * width, iterator1 * height))
+
+        return background
+
+    def _setup_menu(self):
+        """ Initializes the top menubar """
+        # Initialize menu
+        ms.init()
+
+        # Set colors
+        ms.BGCOLOR = pg.color.Color("black")
+        ms.FGCOLOR = pg.color.Color(200, 200, 200, 255)
+        ms.BGHIGHTLIGHT = pg.color.Color(100, 100, 100, 180)
+        ms.BORDER_HL = pg.color.Color(200, 200, 200, 180)
+
+        # Create menu
+        n = ms.Menu('N', self.SELECTABLE_N)
+        beta = ms.Menu("BETA", self.SELECTABLE_BETA)
+        freq = ms.Menu('UPDATE FREQ.', self.SELECTABLE_UPDATE_FREQS)
+        shape = ms.Menu('SHAPE', self.SELECTABLE_SHAPES)
+        show_last_n_points = ms.Menu('SHOW LAST N POINTS', self.SELECTABLE_SHOW_LAST_N_POINTS)
+        movements = ms.Menu('MOVEMENT', self.SELECTABLE_MOVEMENTS)
+        mobility_models = ms.Menu('MOBILITY', self.SELECTABLE_MOBILITY_MODELS)
+        self.bar = ms.MenuBar()
+        options = []
+        # Add a menu option for each node with its own sprites (generated ones only through ALL)
+        for color in self.node_colors:
+            if get_color_hue(color) is not None:
+                continue
+            options.append(ms.Menu(color.upper(), (n, beta, freq, shape, show_last_n_points, movements,
+                                                   mobility_models)))
+        # Add a menu option for all active nodes
+        options.append(ms.Menu('ALL', (n, beta, freq, shape, show_last_n_points, mobility_models, "RESET")))
+        # Set up bar
+        self.bar.set(options)
+
+    def _setup_nodes(self):
+        """
+        Initializes all the active ndoes and its components.
+        The new node set is published at once, returns the previous one.
+        """
+        nodes = {}
+        self.generation += 1
+        mobility = MobilityEngine()
+        for color in self.node_colors:
+
+            # Create character
+            mario = Mario(color, self.assets)
+            character = Character(mario, rng=get_node_random(self.seed, "{0}:{1}".format(self.generation, color)),
+                                  mobility_model=self.node_mobility.get(color, self.mobility_model))
+            character.attach_mobility(mobility)
+
+            # Extract home image from character
+            home = Home(mario.home_image)
+
+            # Extract workplace image from character
+            workplace = Work(mario.workplace_image)
+
+            # Create node
+            node = Node(character, home, workplace, habitat_update_mode=self.habitat_update_mode)
+
+            nodes[color] = node
+
+        # Randomly positioning all node elements
+        self._random_node_positioning(nodes)
+        self._index_places(nodes)
+
+        self.mobility = mobility
+        return self.nodes.reset(nodes)
+
+    def _random_node_positioning(self, nodes):
+        """ Position homes and workplaces of nodes (a dict not published yet) """
+        # Position homes
+        separation_ratio = self.HOME_SEPARATION_RATIO
+        while True:
+            for node in nodes.itervalues():
+                node.home.set_random_position(self.random)
+                if tracing.ENABLED:
+                    tracing.emit(TRACE_POSITIONING_TRY, node.character.trace_id, PLACE_HOME,
+                                 node.home.rect.centerx, node.home.rect.centery)
+                failed = False
+                tried = 0
+                while self._home_work_collision(node.home, nodes, separation_ratio):
+                    if tracing.ENABLED:
+                        tracing.emit(TRACE_POSITIONING_COLLISION, node.character.trace_id, PLACE_HOME)
+                    node.home.set_random_position(self.random)
+                    if tracing.ENABLED:
+                        tracing.emit(TRACE_POSITIONING_TRY, node.character.trace_id, PLACE_HOME,
+                                     node.home.rect.centerx, node.home.rect.centery)
+                    tried += 1
+                    if tried == 10:
+                        failed = True
+                        break
+                if failed:
+                    break
+                else:
+                    node.character.set_home_rect(node.home.rect)
+            if failed:
+                if tracing.ENABLED:
+                    tracing.emit(TRACE_POSITIONING_FAILED, node.character.trace_id, PLACE_HOME)
+                # Start again
+                for node in nodes.itervalues():
+                    node.home.rect.center = (-self.world_rect.width, -self.world_rect.height)
+                separation_ratio *= self.SEPARATION_RELAX_FACTOR
+            else:
+                break
+
+        # Position workplaces
+        separation_ratio = self.WORK_SEPARATION_RATIO
+        while True:
+            for node in nodes.itervalues():
+                node.workplace.set_random_position(self.random)
+                if tracing.ENABLED:
+                    tracing.emit(TRACE_POSITIONING_TRY, node.character.trace_id, PLACE_WORKPLACE,
+                                 node.workplace.rect.centerx, node.workplace.rect.centery)
+                failed = False
+                tried = 0
+                while self._home_work_collision(node.workplace, nodes, separation_ratio):
+                    if tracing.ENABLED:
+                        tracing.emit(TRACE_POSITIONING_COLLISION, node.character.trace_id, PLACE_WORKPLACE)
+                    node.workplace.set_random_position(self.random)
+                    if tracing.ENABLED:
+                        tracing.emit(TRACE_POSITIONING_TRY, node.character.trace_id, PLACE_WORKPLACE,
+                                     node.workplace.rect.centerx, node.workplace.rect.centery)
+                    tried += 1
+                    if tried == 10:
+                        failed = True
+                        break
+                if failed:
+                    break
+                else:
+                    node.character.set_workplace_rect(node.workplace.rect)
+            if failed:
+                if tracing.ENABLED:
+                    tracing.emit(TRACE_POSITIONING_FAILED, node.character.trace_id, PLACE_WORKPLACE)
+                # Start again
+                for node in nodes.itervalues():
+                    node.workplace.rect.center = (-self.world_rect.width, -self.world_rect.height)
+                separation_ratio *= self.SEPARATION_RELAX_FACTOR
+            else:
+                break
+
+    def _home_work_collision(self, sprite, nodes, ratio=DEFAULT_SEPARATION_RATIO):
+        """ Check if sprite collides with any other elemnt of the demo """
+        collide_function = pg.sprite.collide_rect_ratio(ratio)
+
+        for node in nodes.itervalues():
+            if sprite is not node.workplace and collide_function(sprite, node.workplace):
+                return True
+
+            if sprite is not node.home and collide_function(sprite, node.home):
+                return True
+
+        return False
+
+    def _update_nodes(self, choice):
+        """
+        Updates representation of nodes based on a menu action. A choice is an array with the format:
+        [("MENU_POSIITON", "MENU_TAG"), ("SUBMENU_POSITION","SUBMENU_TAG"), (...)]
+        """
+        # Top menu (selects node(s))
+        target = choice[0][1].lower()
+
+        # 1 submenu (property)
+        submenu1 = choice[1][1].lower()
+
+        if target == 'all':
+            if submenu1 == "reset":
+                # Setup nodes again, publishing the new set replaces the old one
+                self._setup_nodes()
+                if self.heatmap:
+                    self.heatmap.clear()
+                if self.exposure:
+                    self.exposure.clear()
+                if self.variants:
+                    self.variants.clear()
+            elif submenu1 == 'mobility':
+                self.mobility_model = choice[2][1]
+                self.node_mobility.clear()
+
+            for node in self.nodes.itervalues():
+                if submenu1 == 'n':
+                    node.habitat.set_n(int(choice[2][1]))
+                if submenu1 == 'beta':
+                    node.habitat.set_beta(int(choice[2][1]))
+                elif submenu1 == 'update freq.':
+                    node.habitat.set_habitat_update_freq(float(choice[2][1]))
+                elif submenu1 == 'shape':
+                    node.habitat.set_shape(choice[2][1].lower())
+                elif submenu1 == 'show last n points':
+                    node.habitat.set_show_last_n_points(choice[2][1])
+                elif submenu1 == 'mobility':
+                    node.character.set_mobility_model(choice[2][1])
+
+        else:
+            if submenu1 == 'n':
+                self.nodes[target].habitat.set_n(int(choice[2][1]))
+            if submenu1 == 'beta':
+                self.nodes[target].habitat.set_beta(int(choice[2][1]))
+            elif submenu1 == 'update freq.':
+                self.nodes[target].habitat.set_habitat_update_freq(float(choice[2][1]))
+            elif submenu1 == 'shape':
+                self.nodes[target].habitat.set_shape(choice[2][1].lower())
+            elif submenu1 == 'show last n points':
+                self.nodes[target].habitat.set_show_last_n_points(choice[2][1])
+            elif submenu1 == 'movement':
+                self.nodes[target].character.set_movement(choice[2][1])
+                self.node_table = None
+            elif submenu1 == 'mobility':
+                self.node_mobility[target] = choice[2][1]
+                self.nodes[target].character.set_mobility_model(choice[2][1])
+
+    def event_loop(self):
+        """ One event loop. """
+        self.keys = pg.key.get_pressed()
+        for event in pg.event.get():
+            # Check if user QUITS (Escapes or clase the demo window)
+            if event.type == pg.QUIT or self.keys[pg.K_ESCAPE]:
+                GlobalVars.RUNNING = False
+
+            # Dump trace buffer on demand
+            if event.type == pg.KEYDOWN and event.key == pg.K_F12 and tracing.ENABLED:
+                tracing.dump()
+
+            # Write or restore a checkpoint on demand
+            if event.type == pg.KEYDOWN and event.key in (pg.K_F5, pg.K_F9) and self.checkpoint_path:
+                try:
+                    if event.key == pg.K_F5:
+                        self.save_checkpoint(self.checkpoint_path)
+                    else:
+                        self.load_checkpoint(self.checkpoint_path)
+                except (IOError, OSError, ValueError), message:
+                    logging.error("Checkpoint failed: {0}".format(message))
+
+            if self.timeline:
+                self._timeline_event(event)
+            self._camera_event(event)
+
+            if event.type == pg.KEYDOWN and event.key == pg.K_h and self.heatmap:
+                self.show_heatmap = not self.show_heatmap
+
+            if event.type == pg.KEYDOWN and event.key == pg.K_o and self.overlaps is not None:
+                self.log_overlaps()
+
+            if event.type == pg.KEYDOWN and event.key == pg.K_e and self.exposure:
+                self.write_exposure_report()
+
+            if event.type == pg.KEYDOWN and event.key == pg.K_v and self.variants:
+                views = self.VARIANT_VIEWS
+                self.variant_view = views[(views.index(self.variant_view) + 1) % len(views)]
+
+            # Pass event to MenuBar to update the Menu
+            self.bar.update(event)
+            if self.bar.choice:
+                if self.reviewing:
+                    # Changes while reviewing would rewrite the past, resume first (F8)
+                    logging.info("Menu choices are ignored while reviewing the timeline")
+                else:
+                    if self.timeline:
+                        self.timeline.record(self.tick, "menu", list(self.bar.choice))
+                    self._update_nodes(self.bar.choice)
+
+    def _timeline_event(self, event):
+        """
+        Timeline keys and mouse: F7 starts and ends reviewing (back to the newest instant), F8 resumes
+        the run from the reviewed instant. While reviewing, left / right seek 1 second (10 with shift),
+        home / end go to the start / newest instant and the bar at the bottom can be clicked and dragged.
+        """
+        if event.type == pg.KEYDOWN:
+            if event.key == pg.K_F7:
+                self.toggle_review()
+            elif event.key == pg.K_F8 and self.reviewing:
+                self.resume_from_review()
+            elif self.reviewing and event.key in (pg.K_LEFT, pg.K_RIGHT, pg.K_HOME, pg.K_END):
+                target = self.seek_target if self.seek_target is not None else self.tick
+                seconds = 10 if event.mod & pg.KMOD_SHIFT else 1
+                if event.key == pg.K_LEFT:
+                    target -= int(seconds * self.tick_rate)
+                elif event.key == pg.K_RIGHT:
+                    target += int(seconds * self.tick_rate)
+                elif event.key == pg.K_HOME:
+                    target = self.timeline.get_start()
+                else:
+                    target = self.timeline.head
+                self.seek_target = target
+        elif self.reviewing and event.type == pg.MOUSEBUTTONDOWN and event.button == 1 and \
+                self._timeline_rect().collidepoint(event.pos):
+            self.seeking = True
+            self.seek_target = self._timeline_tick_at(event.pos[0])
+        elif self.seeking and event.type == pg.MOUSEMOTION:
+            self.seek_target = self._timeline_tick_at(event.pos[0])
+        elif event.type == pg.MOUSEBUTTONUP and event.button == 1:
+            self.seeking = False
+
+    def _reset_timeline(self):
+        """ Starts a new timeline from the current state """
+        self.timeline = Timeline(max(1, int(round(self.keyframe_every * self.tick_rate))), self.timeline_memory)
+        self.reviewing = False
+        self.seek_target = None
+        self._add_keyframe()
+
+    def _add_keyframe(self):
+        metadata, arrays = self.get_simulation_state()
+        metadata["direction_keys"] = self.direction_keys
+        self.timeline.add_keyframe(self.tick, (metadata, arrays))
+
+    def toggle_review(self):
+        """ Starts reviewing the timeline (pausing the run) or goes back to the newest instant and continues """
+        if not self.reviewing:
+            # Keyframe of the newest instant, going back to it is instant
+            self._add_keyframe()
+            self.reviewing = True
+        else:
+            self.seek(self.timeline.head)
+            self.reviewing = False
+            self.accumulator = 0.0
+
+    def resume_from_review(self):
+        """ Continues the run from the reviewed instant, forgetting what came after it """
+        self.timeline.truncate(self.tick)
+        self.reviewing = False
+        self.accumulator = 0.0
+
+    def seek(self, tick):
+        """
+        Reconstructs the simulation at tick: replays the logged inputs from the nearest keyframe before it,
+        or from the current state when it is between that keyframe and tick.
+        """
+        tick = max(self.timeline.get_start(), min(tick, self.timeline.head))
+        keyframe_tick, (metadata, arrays) = self.timeline.keyframe_before(tick)
+        if not keyframe_tick <= self.tick <= tick:
+            self.set_simulation_state(metadata, arrays)
+            self.direction_keys = tuple(metadata["direction_keys"])
+
+        while self.tick < tick:
+            positions = None
+            for kind, value in self.timeline.inputs_at(self.tick):
+                if kind == "menu":
+                    self._update_nodes(value)
+                elif kind == "keys":
+                    self.direction_keys = value
+                elif kind == "positions":
+                    positions = value
+            self._advance(positions)
+
+    def _timeline_rect(self):
+        return pg.Rect(0, self.screen_rect.height - self.TIMELINE_HEIGHT, self.screen_rect.width, self.TIMELINE_HEIGHT)
+
+    def _timeline_tick_at(self, x):
+        """ Tick of an x coordinate of the timeline bar """
+        start = self.timeline.get_start()
+        fraction = min(max(float(x) / max(1, self.screen_rect.width - 1), 0.0), 1.0)
+        return start + int(round(fraction * (self.timeline.head - start)))
+
+    def _draw_timeline(self, surface):
+        """ Draws the timeline bar: keyframes, reviewed instant and times """
+        if self.timeline_font is None:
+            self.timeline_font = pg.font.Font(None, 20)
+
+        rect = self._timeline_rect()
+        surface.fill(ms.BGCOLOR, rect)
+        start = self.timeline.get_start()
+        length = max(1, self.timeline.head - start)
+        for tick in self.timeline.ticks:
+            x = rect.left + (tick - start) * (rect.width - 1) // length
+            pg.draw.line(surface, self.TIMELINE_KEYFRAME_COLOR, (x, rect.top + 2), (x, rect.top + 6))
+        x = rect.left + (self.tick - start) * (rect.width - 1) // length
+        surface.fill(ms.FGCOLOR, (rect.left, rect.bottom - 3, x - rect.left, 2))
+        pg.draw.line(surface, self.TIMELINE_CURSOR_COLOR, (x, rect.top), (x, rect.bottom))
+
+        text = self.timeline_font.render("REVIEW {0:.1f} s / {1:.1f} s   (F7 back, F8 resume from here)".format(
+            self.get_sim_time(), self.timeline.head * self.tick_dt), True, ms.FGCOLOR)
+        surface.blit(text, (rect.left + 8, rect.top + (rect.height - text.get_height()) // 2))
+
+    def get_sim_time(self):
+        """ Simulation time in seconds """
+        return self.tick * self.tick_dt
+
+    def _ingest_positions(self, positions):
+        """
+        Applies the newest received position of each external device, creating the new device nodes. Devices
+        without a node are ignored once there are ingest_max_devices device nodes.
+        """
+        nodes = self.nodes.snapshot()
+        added = {}
+        devices = None  # Device nodes, only counted when a new device shows up
+        ignored = 0
+        width, height = self.world_rect.size
+        for device, (_, x, y) in positions.iteritems():
+            # Devices outside the world are kept at its edge
+            x, y = min(max(x, 0.0), width), min(max(y, 0.0), height)
+            name = self.DEVICE_NODE_NAME.format(device)
+            node = nodes.get(name) or added.get(name)
+            if node is None:
+                if devices is None:
+                    devices = sum(1 for other in nodes.itervalues() if other.character.movement == "external")
+                if devices + len(added) >= self.ingest_max_devices:
+                    ignored += 1
+                    continue
+                node = added[name] = self._create_device_node(device, (x, y))
+            else:
+                node.character.set_external_position((x, y))
+
+        if added:
+            self.nodes.update(added=added)
+            logging.info("{0} new device nodes ({1} updates received)".format(len(added), self.ingest.received))
+
+        if ignored:
+            # Senders of many ids would log every step, warnings are rate limited
+            self.ignored_devices += ignored
+            now = time.time()
+            if self.ignored_warning_time is None or now - self.ignored_warning_time >= self.DEVICE_WARNING_INTERVAL:
+                logging.warning("Ignored {0} positions of new devices, there are {1} device nodes already "
+                                "(--ingest-max-devices)".format(self.ignored_devices, self.ingest_max_devices))
+                self.ignored_devices = 0
+                self.ignored_warning_time = now
+
+    def _create_device_node(self, device, position):
+        """ Creates the node of an external device at position, with a generated color and without home or workplace """
+        color = "{0}{1}".format(HUE_COLOR_PREFIX, int(round(device * GOLDEN_ANGLE)) % 360)
+        character = Character(Mario(color, self.assets), movement="external",
+                              rng=get_node_random(self.seed, self.DEVICE_NODE_NAME.format(device)))
+        character.move = list(position)
+        character.rect.center = position
+        if not self.world_rect.contains(character.rect):
+            character.rect.clamp_ip(self.world_rect)
+            character.move = list(character.rect.center)
+        character.previous_move = list(character.move)
+        return Node(character, None, None, habitat_update_mode=self.habitat_update_mode)
+
+    def save_checkpoint(self, path):
+        """ Writes the whole simulation state into a checkpoint file (see lib.checkpoint) """
+        from lib.checkpoint import write_checkpoint
+
+        started = time.time()
+        metadata, arrays = self.get_simulation_state()
+        write_checkpoint(path, metadata, arrays)
+        self.checkpoint_tick = self.tick
+        self.next_checkpoint = self.get_sim_time() + self.checkpoint_every if self.checkpoint_every else None
+        logging.info("Checkpoint of {0} nodes at {1:.1f} s written into {2} in {3:.3f} s".format(
+            len(metadata["names"]), self.get_sim_time(), path, time.time() - started))
+
+    def load_checkpoint(self, path):
+        """ Restores the simulation state of a checkpoint file, replacing every node """
+        from lib.checkpoint import read_checkpoint
+
+        started = time.time()
+        metadata, arrays = read_checkpoint(path)
+        self.set_simulation_state(metadata, arrays)
+        self.next_checkpoint = self.get_sim_time() + self.checkpoint_every if self.checkpoint_every else None
+        if self.timeline:
+            # The recorded run is not the past of the restored one
+            self._reset_timeline()
+        logging.info("Restored {0} nodes at {1:.1f} s from {2} in {3:.3f} s".format(
+            len(metadata["names"]), self.get_sim_time(), path, time.time() - started))
+
+    def get_simulation_state(self):
+        """ Returns the whole simulation state as (metadata, arrays) (see lib.checkpoint) """
+        from lib.checkpoint import encode_strings, python_random_state
+
+        names = sorted(self.nodes.snapshot())
+        nodes = [self.nodes[name] for name in names]
+        habitats = [node.habitat for node in nodes]
+        characters = [node.character for node in nodes]
+
+        def place_positions(places):
+            return numpy.array([place.rect.topleft if place else (NAN, NAN) for place in places],
+                               dtype=numpy.float64).reshape(len(places), 2)
+
+        arrays = {
+            "node.character": numpy.array([character.get_checkpoint() for character in characters],
+                                          dtype=numpy.float64).reshape(len(nodes), -1),
+            "node.habitat": numpy.array([habitat.get_checkpoint() for habitat in habitats],
+                                        dtype=numpy.float64).reshape(len(nodes), -1),
+            "node.last_n_points": numpy.concatenate(
+                [numpy.frombuffer(habitat.last_n_points, numpy.float64) for habitat in habitats] or [[]]),
+            "node.state_samples": numpy.array([habitat.state_samples for habitat in habitats], dtype=numpy.int64),
+            "node.home": place_positions([node.home for node in nodes]),
+            "node.workplace": place_positions([node.workplace for node in nodes]),
+        }
+        arrays["node.random.words"], arrays["node.random.gauss"] = python_random_state(
+            [character.random for character in characters])
+        arrays["control.random.words"], arrays["control.random.gauss"] = python_random_state([self.random])
+        for name, values in self.mobility.get_state().iteritems():
+            arrays["mobility." + name] = values
+        if self.heatmap:
+            arrays["heatmap.density"], heatmap_weight = self.heatmap.get_state()
+
+        strings = {}
+        for field, values in (("color", [character.character_spritesheet.color for character in characters]),
+                              ("movement", [character.movement for character in characters]),
+                              ("mobility_model", [character.mobility_model for character in characters]),
+                              ("shape", [habitat.shape for habitat in habitats]),
+                              ("update_mode", [habitat.update_mode for habitat in habitats])):
+            strings[field], arrays["node." + field] = encode_strings(values)
+
+        metadata = {"names": names, "strings": strings,
+                    "seed": self.seed, "generation": self.generation, "random_version": self.random.getstate()[0],
+                    "tick": self.tick, "tick_rate": self.tick_rate, "accumulator": self.accumulator,
+                    "screen_size": list(self.screen_rect.size), "world_size": list(self.world_rect.size),
+                    "mobility_model": self.mobility_model, "node_mobility": dict(self.node_mobility),
+                    "habitat_update_mode": self.habitat_update_mode, "node_colors": list(self.node_colors),
+                    "avoidable_places": [list(place.rect.topleft) for place in self.avoidable_places]}
+        if self.heatmap:
+            metadata["heatmap_weight"] = heatmap_weight
+        if self.exposure:
+            metadata["exposure_keys"], exposure_arrays = self.exposure.get_state()
+            for name, values in exposure_arrays.iteritems():
+                arrays["exposure." + name] = values
+        if self.variants:
+            metadata["variants"] = [list(variant) for variant in self.variants.variants]
+            metadata["variant_keys"], metadata["variant_next_update"], variant_arrays = self.variants.get_state()
+            for name, values in variant_arrays.iteritems():
+                arrays["variants." + name] = values
+        return metadata, arrays
+
+    def set_simulation_state(self, metadata, arrays):
+        """ Restores a state returned by get_simulation_state, replacing every node """
+        from lib.checkpoint import decode_strings, set_python_random_state
+
+        world_size = tuple(metadata.get("world_size", metadata["screen_size"]))
+        if world_size != self.world_rect.size:
+            logging.warning("Checkpoint world size {0} differs from the current one {1}".format(
+                world_size, self.world_rect.size))
+
+        self.seed = metadata["seed"]
+        self.generation = metadata["generation"]
+        self.tick = metadata["tick"]
+        self.accumulator = metadata["accumulator"]
+        tick_rate = metadata["tick_rate"]
+        if self.requested_tick_rate and self.requested_tick_rate != tick_rate:
+            # --tick-rate wins over the rate of the checkpoint, the run goes on at the same simulation time
+            logging.warning("Checkpoint tick rate {0} replaced by --tick-rate {1}".format(
+                tick_rate, self.requested_tick_rate))
+            self.tick = int(round(self.tick * self.requested_tick_rate / tick_rate))
+            self.accumulator = 0.0
+            tick_rate = self.requested_tick_rate
+        self.tick_rate = tick_rate
+        self.tick_dt = 1.0 / self.tick_rate
+        self.mobility_model = metadata["mobility_model"]
+        self.node_mobility = dict(metadata["node_mobility"])
+        self.habitat_update_mode = metadata["habitat_update_mode"]
+        menu_changed = self.node_colors != metadata["node_colors"]
+        self.node_colors = list(metadata["node_colors"])
+        # Checkpoints of a single avoidable place store it as avoidable_place
+        places = [tuple(position) for position in metadata.get("avoidable_places", [metadata.get("avoidable_place")])]
+        if places != [place.rect.topleft for place in self.avoidable_places]:
+            self._set_avoidable_places(places)
+        random_version = metadata["random_version"]
+        set_python_random_state(self.random, random_version,
+                                arrays["control.random.words"][0], arrays["control.random.gauss"][0])
+
+        mobility = MobilityEngine()
+        prefix = "mobility."
+        mobility.set_state(dict((name[len(prefix):], values) for name, values in arrays.iteritems()
+                                if name.startswith(prefix)))
+
+        strings = dict((field, decode_strings(table, arrays["node." + field]))
+                       for field, table in metadata["strings"].iteritems())
+        nodes = {}
+        ring_offset = 0
+        for i, name in enumerate(metadata["names"]):
+            color = strings["color"][i]
+            mario = Mario(color, self.assets)
+            character = Character(mario, movement=strings["movement"][i], rng=random.Random(0),
+                                  mobility_model=strings["mobility_model"][i])
+            set_python_random_state(character.random, random_version,
+                                    arrays["node.random.words"][i], arrays["node.random.gauss"][i])
+            character.set_checkpoint(arrays["node.character"][i].tolist(), mobility)
+
+            home = workplace = None
+            if not numpy.isnan(arrays["node.home"][i, 0]):
+                home = Home(mario.home_image)
+                home.rect.topleft = arrays["node.home"][i].astype(int).tolist()
+                character.set_home_rect(home.rect)
+            if not numpy.isnan(arrays["node.workplace"][i, 0]):
+                workplace = Work(mario.workplace_image)
+                workplace.rect.topleft = arrays["node.workplace"][i].astype(int).tolist()
+                character.set_workplace_rect(workplace.rect)
+
+            node = Node(character, home, workplace, habitat_update_mode=strings["update_mode"][i])
+            habitat_values = arrays["node.habitat"][i].tolist()
+            ring_size = 2 * int(habitat_values[0])
+            node.habitat.set_checkpoint(habitat_values,
+                                        arrays["node.last_n_points"][ring_offset:ring_offset + ring_size].tolist(),
+                                        int(arrays["node.state_samples"][i]) if "node.state_samples" in arrays
+                                        else None)
+            # Not set_shape, which would apply the restored deferred samples and change the run
+            node.habitat.shape = strings["shape"][i]
+            ring_offset += ring_size
+            nodes[name] = node
+
+        self.mobility = mobility
+        self.nodes.reset(nodes)
+        self._index_places(nodes)
+        if self.heatmap:
+            if "heatmap.density" in arrays and arrays["heatmap.density"].shape == self.heatmap.shape:
+                self.heatmap.set_state(arrays["heatmap.density"], metadata["heatmap_weight"])
+            else:
+                logging.warning("No heatmap of this resolution in the checkpoint, it starts empty")
+                self.heatmap.clear()
+        if self.exposure:
+            if "exposure_keys" in metadata:
+                prefix = "exposure."
+                self.exposure.set_state(metadata["exposure_keys"], dict(
+                    (name[len(prefix):], values) for name, values in arrays.iteritems() if name.startswith(prefix)))
+            else:
+                logging.warning("No exposure counts in the checkpoint, they start from zero")
+                self.exposure.clear()
+        if self.variants:
+            if metadata.get("variants") == [list(variant) for variant in self.variants.variants]:
+                prefix = "variants."
+                self.variants.set_state(metadata["variant_keys"], metadata["variant_next_update"], dict(
+                    (name[len(prefix):], values) for name, values in arrays.iteritems() if name.startswith(prefix)))
+            else:
+                logging.warning("No habitat variants like these in the checkpoint, they start from the nodes")
+                self.variants.clear()
+        if menu_changed:
+            # The node menus follow the restored colors
+            self._setup_menu()
+
+    def step(self):
+        """ Advances the simulation one fixed step with the live inputs, logging them into the timeline """
+        direction_keys = tuple(bool(self.keys[key]) for key in DIRECTION_KEYS)
+        positions = self.ingest.drain() if self.ingest else None
+        if self.timeline:
+            if direction_keys != self.direction_keys:
+                self.timeline.record(self.tick, "keys", direction_keys)
+            if positions:
+                self.timeline.record(self.tick, "positions", positions)
+        self.direction_keys = direction_keys
+
+        self._advance(positions)
+
+        if self.timeline and self.timeline.due(self.tick):
+            self._add_keyframe()
+
+    def _advance(self, positions=None):
+        """ Advances the simulation one fixed step with the given inputs """
+        self.tick += 1
+        now = self.get_sim_time()
+        if positions:
+            self._ingest_positions(positions)
+        if self.navigation_obstacles:
+            self._update_navigation()
+        self.mobility.step(self.tick_dt, now, self.world_rect.size)
+        keys = dict(zip(DIRECTION_KEYS, self.direction_keys))
+        for node in self.nodes.snapshot().itervalues():
+            node.update(self.world_rect, keys, self.tick_dt, now, self.animate)
+        if self.variants:
+            samples = self.variants.due(now)
+            if samples:
+                # The locations the habitats of the nodes sample
+                keys = self._node_positions()[0]
+                locations = numpy.array([habitat.get_center() for habitat in self.node_table[2]],
+                                        dtype=numpy.float64).reshape(len(keys), 2)
+                self.variants.update(keys, locations, samples)
+        if self.heatmap or self.overlaps is not None or self.exposure:
+            keys, positions = self._node_positions()
+            if self.heatmap:
+                self.heatmap.add(positions, self.tick_dt)
+            if self.overlaps is not None or self.exposure:
+                regions = [habitat.get_region() for habitat in self.node_table[2]]
+                if self.overlaps is not None:
+                    self.overlaps.update(dict(zip(keys, regions)))
+                if self.exposure:
+                    self.exposure.update(keys, positions, regions, self.tick_dt)
+
+    def _update_navigation(self):
+        """ Sets the navigation grid of the mobility engine, building it again if the obstacles changed """
+        nodes = self.nodes.snapshot() if self.navigation_obstacles == "all" else None
+        key = (self.mobility, self.avoidable_places, nodes)
+        if self.navigation_key and all(item is previous for item, previous in zip(key, self.navigation_key)):
+            return
+
+        obstacles = [self._place_bounds(place) for place in self.avoidable_places]
+        if nodes:
+            for name in sorted(nodes):
+                obstacles.extend(self._place_bounds(place) for place in (nodes[name].home, nodes[name].workplace)
+                                 if place)
+        if self.navigation is None or self.navigation.obstacles != obstacles:
+            self.navigation = NavigationGrid(self.world_rect.size, obstacles)
+            logging.debug("Navigation grid of {0} obstacles, {1} of {2} cells blocked".format(
+                len(obstacles), self.navigation.blocked.sum(), self.navigation.blocked.size))
+        self.mobility.navigation = self.navigation
+        self.navigation_key = key
+
+    def _node_positions(self):
+        """
+        Returns the node keys (the same list while the nodes don't change) and their positions as an (N, 2) array,
+        the automatic ones straight from the mobility engine
+        """
+        nodes = self.nodes.snapshot()
+        if self.node_table is None or self.node_table[0] is not nodes:
+            keys = sorted(nodes)
+            characters = [nodes[key].character for key in keys]
+            automatic = numpy.array([character.movement == "automatic" and character.mobility is not None
+                                     for character in characters], dtype=bool)
+            agents = numpy.array([character.mobility_index for character, engine in zip(characters, automatic)
+                                  if engine], dtype=numpy.intp)
+            others = [character for character, engine in zip(characters, automatic) if not engine]
+            self.node_table = (nodes, keys, [nodes[key].habitat for key in keys], automatic, agents, others)
+        keys, automatic, agents, others = self.node_table[1], self.node_table[3], self.node_table[4], self.node_table[5]
+        positions = numpy.empty((len(keys), 2), dtype=numpy.float64)
+        positions[automatic] = self.mobility.position[agents]
+        if others:
+            positions[~automatic] = [character.move for character in others]
+        return keys, positions
+
+    def _variant_panes(self):
+        """ Display rects of the panes of the habitat variants, in rows of about the same number of panes """
+        count = len(self.variants.variants)
+        columns = int(math.ceil(math.sqrt(count)))
+        rows = int(math.ceil(float(count) / columns))
+        width, height = self.screen_rect.width // columns, self.screen_rect.height // rows
+        return [pg.Rect((variant % columns) * width, (variant // columns) * height, width, height)
+                for variant in xrange(count)]
+
+    def _draw_variant_panes(self, scene):
+        """
+        Draws a pane per habitat variant showing the world the camera shows (scaled down to fit), with the nodes
+        as points and the variant of their habitats in their colour
+        """
+        keys, positions = self._node_positions()
+        colors = [habitat.color_repr for habitat in self.node_table[2]]
+        bounds = self.view.world_bounds(self.screen_rect.size)
+        center = ((bounds[0] + bounds[2]) / 2.0, (bounds[1] + bounds[3]) / 2.0)
+        render_scale = self.view.render_scale
+        scene.fill(self.VARIANT_PANE_COLOR)  # Panes left over in the last row
+        for variant, pane in enumerate(self._variant_panes()):
+            zoom = self.view.zoom * min(float(pane.width) / self.screen_rect.width,
+                                        float(pane.height) / self.screen_rect.height)
+            view = View(render_scale)
+            view.set_camera((center[0] - pane.width / (2.0 * zoom), center[1] - pane.height / (2.0 * zoom)), zoom)
+            rect = pg.Rect(int(pane.left * render_scale), int(pane.top * render_scale),
+                           int(pane.width * render_scale), int(pane.height * render_scale)).clip(scene.get_rect())
+            surface = scene.subsurface(rect)
+            pixels = numpy.floor((positions - view.origin) * view.scale).astype(numpy.int64).tolist()
+            for (x, y), color in zip(pixels, colors):
+                surface.fill(color, (x - 1, y - 1, 3, 3))
+            self.variants.draw(surface, view, pane.size, variant, colors)
+            pg.draw.rect(surface, self.VARIANT_PANE_BORDER_COLOR, surface.get_rect(), 1)
+
+    def _draw_variant_labels(self, surface):
+        """ Labels of the habitat variants: at the top of their panes, or a legend of the overlay colours """
+        if self.variant_font is None:
+            self.variant_font = pg.font.Font(None, 20)
+        variants = self.variants.variants
+        if self.variant_view == "split":
+            for variant, pane in zip(variants, self._variant_panes()):
+                surface.blit(self.variant_font.render(describe(variant), True, ms.FGCOLOR),
+                             (pane.left + 8, pane.top + self.bar.rect.height + 4))
+        else:
+            height = self.variant_font.get_linesize()
+            top = self.screen_rect.bottom - height * len(variants) - 8
+            for index, variant in enumerate(variants):
+                surface.blit(self.variant_font.render(describe(variant), True,
+                                                      VARIANT_COLORS[index % len(VARIANT_COLORS)]),
+                             (8, top + index * height))
+
+    def log_overlaps(self, count=10):
+        """ Logs the habitat pairs that overlap the most (intersection over union) """
+        overlaps = self.overlaps
+        pairs = sorted(((overlaps.iou(key, other), key, other, area) for key, other, area in overlaps.pairs()),
+                       reverse=True)
+        logging.info("{0} overlapping habitat pairs of {1} habitats ({2} rows to update)".format(
+            len(pairs), len(overlaps.regions), overlaps.pending()))
+        for iou, key, other, area in pairs[:count]:
+            logging.info("  {0} / {1}: {2:.0f} pixels, IoU {3:.2f}".format(key, other, area, iou))
+
+    def main_loop(self):
+        """ Main game loop. """
+        while GlobalVars.RUNNING:
+            try:
+                # Clear screen (the scene is drawn into the offscreen surface when rendering at a lower resolution)
+                scene = self.scene or self.screen
+                self._draw_background(scene)
+                # self.screen.fill(pg.color.Color("white"))
+
+                # Check for events
+                self.event_loop()
+
+                # Draw avoidable places
+                self._draw_avoidable_places(scene)
+
+                # Draw the visit density below the nodes, so the habitats can be compared with it
+                if self.heatmap and self.show_heatmap:
+                    self.heatmap.draw(scene, self.view, self.screen_rect.size)
+
+                # Run as many fixed simulation steps as real time has passed.
+                # Headless frames don't wait and always advance 1 / fps seconds.
+                if self.headless:
+                    frame_time = 1.0 / self.fps
+                else:
+                    frame_time = min(self.clock.tick(self.fps) / 1000.0, self.MAX_FRAME_TIME)
+                    if self.adaptive_resolution:
+                        # Work of the previous frame, without the wait for this one
+                        self._adapt_render_scale(self.clock.get_rawtime() / 1000.0)
+                if self.reviewing:
+                    # The run is paused, only the reviewed instant changes (once per frame)
+                    if self.seek_target is not None:
+                        self.seek(self.seek_target)
+                        self.seek_target = None
+                    interpolation = 1.0
+                else:
+                    self.accumulator += frame_time
+                    while self.accumulator >= self.tick_dt:
+                        self.step()
+                        self.accumulator -= self.tick_dt
+                    interpolation = self.accumulator / self.tick_dt
+
+                    if self.next_checkpoint is not None and self.checkpoint_path and \
+                            self.get_sim_time() >= self.next_checkpoint:
+                        self.save_checkpoint(self.checkpoint_path)
+
+                # Draw all elements of the demonstration between the last two steps, or a pane per habitat variant
+                if self.variants and self.variant_view == "split":
+                    self._draw_variant_panes(scene)
+                else:
+                    self._draw_nodes(scene, interpolation)
+                    if self.variants and self.variant_view == "overlay":
+                        for variant in xrange(len(self.variants.variants)):
+                            self.variants.draw(scene, self.view, self.screen_rect.size, variant,
+                                               VARIANT_COLORS[variant % len(VARIANT_COLORS)])
+
+                # Scale the scene to the screen
+                if self.scene:
+                    pg.transform.scale(self.scene, self.screen_rect.size, self.screen)
+                if self.variants and self.variant_view:
+                    self._draw_variant_labels(self.screen)
+
+                # Draw menu
+                self.bar.draw()
+                # Iterate over all active Menu items and draw them
+                for bar in self.bar:
+                    bar.draw()
+                if self.reviewing:
+                    self._draw_timeline(self.screen)
+
+                # Update display
+                pg.display.flip()
+
+                if self.recorder:
+                    self.recorder.capture(self.screen)
+
+                if self.duration is not None and not self.reviewing and self.get_sim_time() >= self.duration:
+                    GlobalVars.RUNNING = False
+            except Exception:
+                traceback.print_exc()
+                # Keep the events that led to the crash
+                if tracing.ENABLED:
+                    tracing.dump()
+                # Any exception will terminate the simulation gracefully
+                break
+
+        if self.reviewing:
+            # Back to the newest instant of the run
+            self.toggle_review()
+        if self.checkpoint_path and self.checkpoint_tick != self.tick:
+            self.save_checkpoint(self.checkpoint_path)
+        if self.exposure:
+            self.write_exposure_report()
+        if self.recorder:
+            self.recorder.close()
+        if self.ingest:
+            self.ingest.stop()
@@ -0,0 +1,183 @@
+"""
+Recording of the rendered frames.
+
+Each captured frame is blitted into a free surface of a preallocated pool (the only copy) and
+queued for background writer threads, which save numbered PNG files or pipe the raw pixels to an
+external encoder (ffmpeg or avconv) when one is installed.
+
+PNGs are encoded with NumPy and zlib, which release the GIL while they work (pygame.image.save
+holds it and would stall the main loop). The raw pixels of a frame are written to the encoder
+straight from the surface buffer.
+
+When the writers fall behind, frames are dropped so the main loop keeps its frame rate, unless
+the recorder blocks (headless mode, where every frame must be written).
+"""
+import Queue
+import logging
+import os
+import struct
+import subprocess
+import threading
+import zlib
+from distutils.spawn import find_executable
+
+import numpy
+import pygame
+
+VIDEO_EXTENSIONS = (".mp4", ".mkv", ".webm", ".avi", ".mov")
+ENCODERS = ("ffmpeg", "avconv")
+PNG_COMPRESSION = 3  # zlib level, speed matters more than size here
+PNG_SIGNATURE = "\x89PNG\r\n\x1a\n"
+
+
+def find_encoder():
+    """ Returns the path of an installed video encoder or None """
+    for encoder in ENCODERS:
+        path = find_executable(encoder)
+        if path:
+            return path
+    return None
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + \
+        struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff)
+
+
+def write_png(path, surface, compression=PNG_COMPRESSION):
+    """ Writes an RGB PNG of a 24 or 32 bit surface """
+    width, height = surface.get_size()
+    pixels = pygame.surfarray.pixels3d(surface)
+    # Rows of the PNG: a filter type byte (0, none) and the RGB values of the row
+    rows = numpy.zeros((height, 1 + width * 3), dtype=numpy.uint8)
+    rows[:, 1:].reshape(height, width, 3)[...] = pixels.transpose(1, 0, 2)
+    del pixels
+
+    with open(path, "wb") as png_file:
+        png_file.write(PNG_SIGNATURE)
+        png_file.write(png_chunk("IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        png_file.write(png_chunk("IDAT", zlib.compress(rows.data, compression)))
+        png_file.write(png_chunk("IEND", ""))
+
+
+def raw_pixel_format(surface):
+    """ Encoder pixel format of the surface buffer (as stored in memory) or None if it isn't supported """
+    if surface.get_bitsize() != 32 or surface.get_pitch() != surface.get_width() * 4:
+        return None
+    masks = surface.get_masks()[:3]
+    alpha = "a" if surface.get_masks()[3] else "0"
+    if masks == (0xff0000, 0xff00, 0xff):
+        return "bgr" + alpha
+    if masks == (0xff, 0xff00, 0xff0000):
+        return "rgb" + alpha
+    return None
+
+
+class Recorder(object):
+
+    """
+    Records captured frames as numbered PNGs in a directory or, for video file names, as a video
+    encoded by an external encoder (falling back to PNGs if there is none).
+    """
+
+    FRAME_NAME = "frame-{0:06d}.png"
+    DEFAULT_WORKERS = 2
+
+    def __init__(self, path, surface, fps, every=1, workers=DEFAULT_WORKERS, block=False, encoder=None):
+        self.every = max(1, every)
+        self.block = block
+        self.captured = 0  # Frames given to capture
+        self.queued = 0  # Frames queued for the writers
+        self.dropped = 0
+        self.encoder_process = None
+
+        # Frames are stored as 32 bit surfaces whatever the display depth
+        size = surface.get_size()
+        pool = [pygame.Surface(size, 0, 32) for _ in range(2 * workers)]
+        pixel_format = raw_pixel_format(pool[0])
+        if os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS:
+            encoder = encoder or find_encoder()
+            if encoder:
+                self.start_encoder(encoder, path, size, float(fps) / self.every, pixel_format)
+                workers = 1  # The encoder needs the frames in order
+                pool = pool[:2]
+            else:
+                path = os.path.splitext(path)[0]
+                logging.warning("No video encoder found ({0}), recording PNG frames into {1}".format(
+                    "/".join(ENCODERS), path))
+
+        if self.encoder_process is None:
+            self.directory = path
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        # Pool of frame buffers (two per writer) and queue of frames to write
+        self.free = Queue.Queue()
+        for frame in pool:
+            self.free.put(frame)
+        self.frames = Queue.Queue()
+        self.writers = [threading.Thread(target=self.write_frames, name="recorder-{0}".format(i))
+                        for i in range(workers)]
+        for writer in self.writers:
+            writer.daemon = True
+            writer.start()
+
+        logging.info("Recording every {0} frame(s) into {1}".format(self.every, path))
+
+    def start_encoder(self, encoder, path, size, fps, pixel_format):
+        self.raw = pixel_format is not None
+        command = [encoder, "-loglevel", "error", "-y",
+                   "-f", "rawvideo", "-pix_fmt", pixel_format or "rgb24",
+                   "-s", "{0}x{1}".format(*size), "-r", str(fps), "-i", "-",
+                   "-an", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", path]
+        self.encoder_process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def capture(self, surface):
+        """ Queues a copy of surface to be written (every self.every calls) """
+        self.captured += 1
+        if (self.captured - 1) % self.every:
+            return
+
+        try:
+            frame = self.free.get(self.block)
+        except Queue.Empty:
+            # Writers are behind, don't slow down the main loop
+            self.dropped += 1
+            return
+
+        frame.blit(surface, (0, 0))
+        self.frames.put((self.queued, frame))
+        self.queued += 1
+
+    def write_frames(self):
+        """ Writer thread: writes queued frames until it gets None """
+        while True:
+            item = self.frames.get()
+            if item is None:
+                return
+            number, frame = item
+            try:
+                if self.encoder_process is not None:
+                    if self.raw:
+                        self.encoder_process.stdin.write(frame.get_buffer())
+                    else:
+                        self.encoder_process.stdin.write(pygame.image.tostring(frame, "RGB"))
+                else:
+                    write_png(os.path.join(self.directory, self.FRAME_NAME.format(number)), frame)
+            except (IOError, OSError), message:
+                logging.error("Unable to write frame {0}: {1}".format(number, message))
+            finally:
+                self.free.put(frame)
+
+    def close(self):
+        """ Writes the pending frames and stops the writers (and the encoder) """
+        for _ in self.writers:
+            self.frames.put(None)
+        for writer in self.writers:
+            writer.join()
+
+        if self.encoder_process is not None:
+            self.encoder_process.stdin.close()
+            self.encoder_process.wait()
+
+        logging.info("Recorded {0} frames ({1} dropped)".format(self.queued, self.dropped))
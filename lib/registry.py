@@ -0,0 +1,71 @@
+import threading
+
+
+class NodeRegistry(object):
+
+    """
+    Copy-on-write registry of demo nodes.
+
+    Readers get an immutable snapshot (a dict that is never modified once published) and can
+    iterate it without locking. Writers build a new dict and publish it with a single reference
+    assignment; they are serialized among themselves by a writer lock, which readers never take.
+    """
+
+    def __init__(self, nodes=None):
+        self._nodes = dict(nodes) if nodes else {}
+        self._write_lock = threading.Lock()
+
+    def snapshot(self):
+        """ Returns the current node set. It must be treated as read-only. """
+        return self._nodes
+
+    def add(self, key, node):
+        """ Adds (or replaces) a single node """
+        self.update(added={key: node})
+
+    def remove(self, key):
+        """ Removes a single node. Returns the removed node or None. """
+        return self.update(removed=(key,)).get(key)
+
+    def update(self, added=None, removed=()):
+        """
+        Adds and removes nodes in bulk publishing a single new snapshot.
+        Returns a dict with the nodes that have been removed.
+        """
+        with self._write_lock:
+            nodes = dict(self._nodes)
+            removed_nodes = {}
+            for key in removed:
+                if key in nodes:
+                    removed_nodes[key] = nodes.pop(key)
+            if added:
+                nodes.update(added)
+            self._nodes = nodes
+
+        return removed_nodes
+
+    def reset(self, nodes=None):
+        """ Replaces the whole node set. Returns the previous snapshot. """
+        with self._write_lock:
+            old_nodes = self._nodes
+            self._nodes = dict(nodes) if nodes else {}
+
+        return old_nodes
+
+    def __getitem__(self, key):
+        return self._nodes[key]
+
+    def __contains__(self, key):
+        return key in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __iter__(self):
+        return iter(self._nodes)
+
+    def itervalues(self):
+        return self._nodes.itervalues()
+
+    def iteritems(self):
+        return self._nodes.iteritems()
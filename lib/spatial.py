@@ -0,0 +1,79 @@
+"""
+Uniform grid spatial index.
+
+Items are bounding boxes (left, top, right, bottom) stored under a key in every cell they overlap.
+Updating an item that stays in the same cells costs a few integer divisions, so moving items can
+be updated every step. Queries return the keys of the items in the cells a rectangle overlaps
+(a superset of the items that intersect it, which is enough for culling).
+"""
+
+
+class SpatialGrid(object):
+
+    DEFAULT_CELL_SIZE = 256  # World pixels
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}  # (column, row) -> set of keys
+        self.ranges = {}  # Key -> (first column, first row, last column, last row)
+
+    def update(self, key, bounds):
+        """ Inserts or moves an item with bounds (left, top, right, bottom) """
+        cell_size = self.cell_size
+        cell_range = (int(bounds[0] // cell_size), int(bounds[1] // cell_size),
+                      int(bounds[2] // cell_size), int(bounds[3] // cell_size))
+        previous = self.ranges.get(key)
+        if cell_range == previous:
+            return
+
+        if previous is not None:
+            self._remove_cells(key, previous)
+        self.ranges[key] = cell_range
+        cells = self.cells
+        for column in xrange(cell_range[0], cell_range[2] + 1):
+            for row in xrange(cell_range[1], cell_range[3] + 1):
+                cell = cells.get((column, row))
+                if cell is None:
+                    cell = cells[(column, row)] = set()
+                cell.add(key)
+
+    def remove(self, key):
+        cell_range = self.ranges.pop(key, None)
+        if cell_range is not None:
+            self._remove_cells(key, cell_range)
+
+    def _remove_cells(self, key, cell_range):
+        cells = self.cells
+        for column in xrange(cell_range[0], cell_range[2] + 1):
+            for row in xrange(cell_range[1], cell_range[3] + 1):
+                cell = cells[(column, row)]
+                cell.discard(key)
+                if not cell:
+                    del cells[(column, row)]
+
+    def clear(self):
+        self.cells.clear()
+        self.ranges.clear()
+
+    def query(self, bounds):
+        """ Returns the keys of the items in the cells overlapped by bounds (left, top, right, bottom) """
+        cell_size = self.cell_size
+        first_column, first_row = int(bounds[0] // cell_size), int(bounds[1] // cell_size)
+        last_column, last_row = int(bounds[2] // cell_size), int(bounds[3] // cell_size)
+        keys = set()
+        cells = self.cells
+        if (last_column - first_column + 1) * (last_row - first_row + 1) > len(cells):
+            # Large queries go through the occupied cells
+            for (column, row), cell in cells.iteritems():
+                if first_column <= column <= last_column and first_row <= row <= last_row:
+                    keys.update(cell)
+        else:
+            for column in xrange(first_column, last_column + 1):
+                for row in xrange(first_row, last_row + 1):
+                    cell = cells.get((column, row))
+                    if cell:
+                        keys.update(cell)
+        return keys
+
+    def __len__(self):
+        return len(self.ranges)
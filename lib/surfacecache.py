@@ -0,0 +1,120 @@
+"""
+Persistent on-disk cache of prepared surfaces.
+
+Expensive results (decoded images, colour variants, the background mosaic...) are stored as raw
+pixel buffers with a small header, one file per entry. Entries are keyed by the hash of their
+source files plus any parameter they depend on (screen size, hue...), so a changed source file
+never hits a stale entry. Loading an entry maps the file and builds the surface straight from
+the mapped buffer.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+
+import pygame
+
+MAGIC = "PHSC"
+VERSION = 1
+# Magic, version, width, height, pixel format ("RGB " / "RGBA")
+HEADER = struct.Struct("<4sHII4s")
+
+
+def copy_surface(surface):
+    return surface.copy()
+
+
+class SurfaceCache(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.file_hashes = {}
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.enabled = True
+        except OSError, message:
+            logging.warning("Surface cache disabled: {0}".format(message))
+            self.enabled = False
+
+    def file_hash(self, filename):
+        """ Returns the SHA-1 of a file (memoized by path, size and modification time) """
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+        memo_key = (filename, stat.st_size, stat.st_mtime)
+        if memo_key not in self.file_hashes:
+            with open(filename, "rb") as source_file:
+                self.file_hashes[memo_key] = hashlib.sha1(source_file.read()).hexdigest()
+
+        return self.file_hashes[memo_key]
+
+    def key(self, *parts):
+        """ Builds an entry key from its parts (file hashes, sizes, parameters...) """
+        return hashlib.sha1("|".join(str(part) for part in (VERSION,) + parts)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".surface")
+
+    def get(self, key, prepare=copy_surface):
+        """
+        Returns prepare(surface) for a cached entry or None if it is not cached.
+        The surface given to prepare points into the mapped file, prepare must copy it
+        (e.g. Surface.convert or Surface.copy).
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            with open(self.path(key), "rb") as entry_file:
+                mapped = mmap.mmap(entry_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+
+        try:
+            magic, version, width, height, pixel_format = HEADER.unpack_from(mapped)
+            pixel_format = pixel_format.strip()
+            if magic != MAGIC or version != VERSION or \
+                    len(mapped) != HEADER.size + width * height * len(pixel_format):
+                return None
+            surface = pygame.image.frombuffer(buffer(mapped, HEADER.size), (width, height), pixel_format)
+            prepared = prepare(surface)
+            del surface
+            return prepared
+        except (struct.error, pygame.error, ValueError):
+            return None
+        finally:
+            mapped.close()
+
+    def put(self, key, surface):
+        """ Stores the pixels of surface (with its alpha channel if it has one) """
+        if not self.enabled:
+            return
+
+        pixel_format = "RGBA" if surface.get_flags() & pygame.SRCALPHA else "RGB"
+        width, height = surface.get_size()
+        try:
+            # Write into a temporary file and rename it so readers never see partial entries
+            descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+            try:
+                with os.fdopen(descriptor, "wb") as entry_file:
+                    entry_file.write(HEADER.pack(MAGIC, VERSION, width, height, pixel_format.ljust(4)))
+                    entry_file.write(pygame.image.tostring(surface, pixel_format))
+                os.rename(temp_path, self.path(key))
+            except:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+        except (IOError, OSError), message:
+            logging.warning("Unable to write surface cache entry: {0}".format(message))
+
+    def get_or_create(self, key, create, prepare=copy_surface):
+        """ Returns prepare(cached surface), creating and storing it with create() on a miss """
+        surface = self.get(key, prepare)
+        if surface is None:
+            created = create()
+            self.put(key, created)
+            surface = prepare(created)
+
+        return surface
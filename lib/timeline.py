@@ -0,0 +1,120 @@
+"""
+Timeline of a run: periodic keyframes of the simulation state plus a log of the inputs.
+
+The simulation is deterministic for a given state and inputs (fixed steps and seeded random
+streams), so any past step can be reconstructed by restoring the nearest keyframe before it and
+replaying the logged inputs of the few steps in between, never from the start of the run.
+
+Inputs are whatever changes the simulation from outside: menu choices, the direction keys (manual
+movement) and positions of external devices. They are logged by the step they are applied before.
+
+Keyframes and inputs are kept up to max_bytes. Beyond that, while keyframes take most of it, every
+other keyframe is dropped and the interval doubles, so long runs keep keyframes over their whole length
+with a longer replay between them. Once inputs take most of it (a long run with many external devices),
+the oldest keyframe is dropped instead with the inputs before the next one: the timeline then starts
+later. Inputs before the oldest keyframe are never replayed, so they are dropped with it.
+"""
+import bisect
+
+
+def state_size(state):
+    """ Approximate size in bytes of a (metadata, arrays) simulation state """
+    return sum(array.nbytes for array in state[1].itervalues())
+
+
+def input_size(value):
+    """ Approximate size in bytes of a logged input value (a list, tuple or dict of small items) """
+    return 64 + 48 * len(value)
+
+
+class Timeline(object):
+
+    DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+    def __init__(self, interval, max_bytes=DEFAULT_MAX_BYTES):
+        self.interval = interval  # Steps between keyframes
+        self.max_bytes = max_bytes
+        self.ticks = []  # Ticks of the keyframes, sorted
+        self.keyframes = []  # (state, sizes in bytes) by keyframe
+        self.inputs = {}  # Tick -> [(kind, value, size in bytes)] applied before the step that follows tick
+        self.bytes = 0  # Keyframes and inputs
+        self.head = 0  # Newest tick of the run
+
+    def due(self, tick):
+        """ Whether a keyframe should be taken at tick """
+        return not self.ticks or tick - self.ticks[-1] >= self.interval
+
+    def add_keyframe(self, tick, state):
+        """ Stores the simulation state at tick (replacing a keyframe at the same tick) """
+        size = state_size(state)
+        position = bisect.bisect_left(self.ticks, tick)
+        if position < len(self.ticks) and self.ticks[position] == tick:
+            self.bytes -= self.keyframes[position][1]
+            self.keyframes[position] = (state, size)
+        else:
+            self.ticks.insert(position, tick)
+            self.keyframes.insert(position, (state, size))
+        self.bytes += size
+        self.head = max(self.head, tick)
+        self.shrink()
+
+    def shrink(self):
+        """ Drops keyframes and inputs until they fit in max_bytes (see the module documentation) """
+        while self.bytes > self.max_bytes and len(self.ticks) > 1:
+            if len(self.ticks) > 2 and self.keyframe_bytes() > self.bytes / 2:
+                self.thin()
+            else:
+                self.drop_first()
+
+    def keyframe_bytes(self):
+        return sum(size for _, size in self.keyframes)
+
+    def thin(self):
+        """ Drops every other keyframe (keeping the first and the newest ones) and doubles the interval """
+        keep = set(range(0, len(self.ticks), 2)) | set([len(self.ticks) - 1])
+        self.bytes -= sum(size for i, (_, size) in enumerate(self.keyframes) if i not in keep)
+        self.ticks = [tick for i, tick in enumerate(self.ticks) if i in keep]
+        self.keyframes = [keyframe for i, keyframe in enumerate(self.keyframes) if i in keep]
+        self.interval *= 2
+
+    def drop_first(self):
+        """ Drops the oldest keyframe and the inputs before the next one """
+        del self.ticks[0]
+        self.bytes -= self.keyframes.pop(0)[1]
+        start = self.ticks[0]
+        for input_tick in [input_tick for input_tick in self.inputs if input_tick < start]:
+            self.bytes -= sum(size for _, _, size in self.inputs.pop(input_tick))
+
+    def keyframe_before(self, tick):
+        """ Returns (tick, state) of the newest keyframe at or before tick, or None """
+        position = bisect.bisect_right(self.ticks, tick) - 1
+        if position < 0:
+            return None
+        return self.ticks[position], self.keyframes[position][0]
+
+    def record(self, tick, kind, value):
+        """ Logs an input applied before the step that follows tick """
+        size = input_size(value)
+        self.inputs.setdefault(tick, []).append((kind, value, size))
+        self.bytes += size
+        self.head = max(self.head, tick)
+        if self.bytes > self.max_bytes:
+            self.shrink()
+
+    def inputs_at(self, tick):
+        """ Returns the [(kind, value)] inputs applied before the step that follows tick """
+        return [(kind, value) for kind, value, _ in self.inputs.get(tick, ())]
+
+    def truncate(self, tick):
+        """ Forgets everything after tick (the run continues differently from there) """
+        position = bisect.bisect_right(self.ticks, tick)
+        for _, size in self.keyframes[position:]:
+            self.bytes -= size
+        del self.ticks[position:]
+        del self.keyframes[position:]
+        for input_tick in [input_tick for input_tick in self.inputs if input_tick >= tick]:
+            self.bytes -= sum(size for _, _, size in self.inputs.pop(input_tick))
+        self.head = tick
+
+    def get_start(self):
+        return self.ticks[0] if self.ticks else 0
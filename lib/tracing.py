@@ -0,0 +1,148 @@
+"""
+Low overhead structured event tracing.
+
+Hot loops guard every call with the module flag, so when tracing is disabled the only cost is a
+global lookup and a branch (no formatting, no function call):
+
+    if tracing.ENABLED:
+        tracing.emit(HABITAT_CIRCLE, node_id, x, y, radius)
+
+When enabled, events are stored as numbers into a preallocated ring buffer (the last `capacity`
+events are kept). They are only formatted when the buffer is dumped to a file.
+"""
+import array
+import itertools
+import logging
+import sys
+import time
+import traceback
+
+ENABLED = False
+FIELDS = 5  # Maximum number of values per event
+
+_event_types = []  # Index is the event id: (name, field names)
+_names = []  # Interned strings (node names...). Index is the string id.
+_name_ids = {}
+_buffer = None
+_echo = False
+_dump_path = None
+
+
+def event_type(name, *fields):
+    """ Registers an event type, returns its id """
+    if len(fields) > FIELDS:
+        raise ValueError("Events can have at most {0} fields".format(FIELDS))
+    _event_types.append((name, fields))
+    return len(_event_types) - 1
+
+
+def name_id(string):
+    """ Returns a numeric id for a string (e.g. a node name) so it can be stored as an event value """
+    string = str(string)
+    if string not in _name_ids:
+        _names.append(string)
+        _name_ids[string] = len(_names) - 1
+    return _name_ids[string]
+
+
+def id_name(string_id):
+    """ Returns the string of a numeric id given by name_id """
+    return _names[int(string_id)]
+
+
+class TraceBuffer(object):
+
+    """ Preallocated ring buffer of events. """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.event_ids = array.array('i', [0]) * capacity
+        self.timestamps = array.array('d', [0.0]) * capacity
+        self.values = array.array('d', [0.0]) * (capacity * FIELDS)
+        self.recorded = 0
+        # next() on itertools.count is atomic, so threads never get the same slot
+        self._counter = itertools.count()
+
+    def record(self, event_id, values):
+        index = next(self._counter)
+        slot = index % self.capacity
+        self.event_ids[slot] = event_id
+        self.timestamps[slot] = time.time()
+        offset = slot * FIELDS
+        for i, value in enumerate(values):
+            self.values[offset + i] = value
+        if index >= self.recorded:
+            self.recorded = index + 1
+
+    def events(self):
+        """ Yields (timestamp, event id, values) from the oldest to the newest event """
+        stored = min(self.recorded, self.capacity)
+        start = self.recorded - stored
+        for index in range(start, self.recorded):
+            slot = index % self.capacity
+            offset = slot * FIELDS
+            yield self.timestamps[slot], self.event_ids[slot], self.values[offset:offset + FIELDS]
+
+
+def format_event(event_id, values):
+    """ Formats an event as 'name field=value ...'. Fields called 'node' are name ids. """
+    event_name, fields = _event_types[event_id]
+    formatted = []
+    for field, value in zip(fields, values):
+        if field == "node":
+            formatted.append("{0}={1}".format(field, id_name(value)))
+        else:
+            formatted.append("{0}={1:g}".format(field, value))
+    return "{0} {1}".format(event_name, " ".join(formatted))
+
+
+def enable(capacity=65536, dump_path=None, echo=False):
+    """
+    Enables tracing into a new buffer of `capacity` events.
+    With echo, events are also logged at debug level (and therefore formatted at emit time).
+    """
+    global ENABLED, _buffer, _echo, _dump_path
+    _buffer = TraceBuffer(capacity)
+    _echo = echo
+    _dump_path = dump_path
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def emit(event_id, *values):
+    """ Records an event. Callers should check ENABLED first. """
+    _buffer.record(event_id, values)
+    if _echo:
+        logging.debug(format_event(event_id, values))
+
+
+def dump(path=None):
+    """ Writes the buffered events to path (or the configured dump path). Returns the path used. """
+    path = path or _dump_path
+    if _buffer is None or not path:
+        return None
+
+    with open(path, "w") as trace_file:
+        for timestamp, event_id, values in _buffer.events():
+            trace_file.write("{0:.6f} {1}\n".format(timestamp, format_event(event_id, values)))
+
+    logging.info("Dumped {0} trace events to {1}".format(min(_buffer.recorded, _buffer.capacity), path))
+    return path
+
+
+def install_crash_dump():
+    """ Dumps the trace buffer when an uncaught exception reaches the interpreter """
+    previous_hook = sys.excepthook
+
+    def excepthook(exc_type, exc_value, exc_traceback):
+        try:
+            dump()
+        except Exception:
+            traceback.print_exc()
+        previous_hook(exc_type, exc_value, exc_traceback)
+
+    sys.excepthook = excepthook
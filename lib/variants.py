@@ -0,0 +1,201 @@
+"""
+Habitat model variants of every node, computed together.
+
+A variant is a habitat configuration (N, beta and shape, see Habitat in lib.privhab). All the
+variants of all the nodes are fed the same samples of the node locations: their circles, foci and
+radii are (nodes, variants) arrays, and each sample is one EWMA update of all of them with NumPy,
+the same arithmetic as Habitat.update (without the last N points). Comparing K configurations
+then costs one movement and one sampling, not K runs.
+
+Variants are drawn as outlines, over the scene in a colour per variant or in a pane per variant.
+"""
+import collections
+import math
+
+import numpy
+
+# Habitat configuration of a variant (shape one of lib.names.SHAPES)
+Variant = collections.namedtuple("Variant", ["n", "beta", "shape"])
+
+# Outline colours of the variants drawn over the scene
+VARIANT_COLORS = ((255, 255, 255), (255, 64, 64), (64, 160, 255), (255, 200, 0), (200, 64, 255), (0, 220, 160))
+
+
+def describe(variant):
+    return "N={0} beta={1} {2}".format(variant.n, variant.beta, variant.shape)
+
+
+def distance(x1, y1, x2, y2):
+    """ Distances between points (arrays), under 1e-5 they are 0 like Habitat.distance """
+    distances = numpy.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+    distances[distances < 1e-5] = 0.0
+    return distances
+
+
+class HabitatVariants(object):
+
+    OUTLINE_SEGMENTS = 12  # Segments of circle and ellipse outlines
+    MARKER_PIXELS = 4  # Habitats smaller than this on screen are drawn as a marker at their center
+    # Arrays by node (row) and variant (column) stored in the simulation state, started by node
+    STATE_ARRAYS = ("started", "circle_x", "circle_y", "circle_radius", "focus_1_x", "focus_1_y", "focus_2_x",
+                    "focus_2_y", "ellipse_radius")
+
+    def __init__(self, variants, update_freq):
+        self.variants = list(variants)
+        self.update_freq = update_freq
+        self.alpha = numpy.array([2.0 / (variant.n + 1) for variant in self.variants])
+        self.beta = numpy.array([variant.beta for variant in self.variants], dtype=numpy.float64)
+        self.keys = []  # Node keys by row
+        self.next_update = None  # Simulation time of the next sample
+        self._allocate(0)
+
+    def _allocate(self, count):
+        shape = (count, len(self.variants))
+        self.started = numpy.zeros(count, dtype=bool)
+        for name in self.STATE_ARRAYS[1:]:
+            setattr(self, name, numpy.zeros(shape, dtype=numpy.float64))
+
+    def _set_keys(self, keys):
+        """ Sets the nodes (rows) keeping the variants of the nodes that remain """
+        previous = dict((key, row) for row, key in enumerate(self.keys))
+        kept = [(row, previous[key]) for row, key in enumerate(keys) if key in previous]
+        old = dict((name, getattr(self, name)) for name in self.STATE_ARRAYS)
+        self._allocate(len(keys))
+        if kept:
+            rows, old_rows = [numpy.array(indices, dtype=numpy.intp) for indices in zip(*kept)]
+            for name, values in old.iteritems():
+                getattr(self, name)[rows] = values[old_rows]
+        self.keys = keys
+
+    def due(self, now):
+        """ Number of samples due at simulation time now, every update_freq seconds from the first call """
+        if self.next_update is None:
+            self.next_update = now
+        samples = 0
+        while now >= self.next_update:
+            samples += 1
+            self.next_update += self.update_freq
+        return samples
+
+    def update(self, keys, locations, samples=1):
+        """ Updates every variant of the nodes with samples at their locations ((N, 2) array), both by key in keys """
+        if keys is not self.keys:
+            self._set_keys(keys)
+        if not len(keys):
+            return
+        x, y = locations[:, 0, None], locations[:, 1, None]
+        for _ in xrange(samples):
+            self._sample(x, y)
+
+    def _sample(self, x, y):
+        alpha = self.alpha
+        new = ~self.started
+        if new.any():
+            # Variants start at the first location of their node
+            for name in ("circle_x", "focus_1_x", "focus_2_x"):
+                getattr(self, name)[new] = x[new]
+            for name in ("circle_y", "focus_1_y", "focus_2_y"):
+                getattr(self, name)[new] = y[new]
+            self.started[new] = True
+
+        # Circle (or square)
+        self.circle_x = x * alpha + self.circle_x * (1.0 - alpha)
+        self.circle_y = y * alpha + self.circle_y * (1.0 - alpha)
+        self.circle_radius = distance(self.circle_x, self.circle_y, x, y) * alpha + \
+            self.circle_radius * (1.0 - alpha)
+
+        # Foci of the ellipse (or rectangle): the nearer one is updated with alpha, the farther one with alpha / beta
+        near_1 = distance(self.focus_1_x, self.focus_1_y, x, y) <= distance(self.focus_2_x, self.focus_2_y, x, y)
+        far_alpha = alpha / self.beta
+        factor_1 = numpy.where(near_1, alpha, far_alpha)
+        factor_2 = numpy.where(near_1, far_alpha, alpha)
+        self.focus_1_x = x * factor_1 + self.focus_1_x * (1.0 - factor_1)
+        self.focus_1_y = y * factor_1 + self.focus_1_y * (1.0 - factor_1)
+        self.focus_2_x = x * factor_2 + self.focus_2_x * (1.0 - factor_2)
+        self.focus_2_y = y * factor_2 + self.focus_2_y * (1.0 - factor_2)
+        ellipse_distance = distance(self.focus_1_x, self.focus_1_y, x, y) + \
+            distance(self.focus_2_x, self.focus_2_y, x, y)
+        self.ellipse_radius = ellipse_distance * alpha + self.ellipse_radius * (1.0 - alpha)
+
+    def outlines(self, variant):
+        """
+        Outlines of a variant of every node as (points (N, S, 2), centers (N, 2), sizes), size being the radius
+        or half the major axis, with the axes of Habitat.get_outline. Nodes without an area have a size of 0.
+        """
+        shape = self.variants[variant].shape
+        segments = self.OUTLINE_SEGMENTS
+        angles = 2 * math.pi * numpy.arange(segments) / segments
+        if shape == "circle" or shape == "square":
+            centers = numpy.column_stack((self.circle_x[:, variant], self.circle_y[:, variant]))
+            sizes = self.circle_radius[:, variant].copy()
+            minor = sizes
+            axis_x, axis_y = numpy.ones(len(sizes)), numpy.zeros(len(sizes))
+        else:
+            focus_1_x, focus_1_y = self.focus_1_x[:, variant], self.focus_1_y[:, variant]
+            focus_2_x, focus_2_y = self.focus_2_x[:, variant], self.focus_2_y[:, variant]
+            centers = numpy.column_stack(((focus_1_x + focus_2_x) / 2, (focus_1_y + focus_2_y) / 2))
+            radius = self.ellipse_radius[:, variant]
+            focus_distance = distance(focus_2_x, focus_2_y, focus_1_x, focus_1_y)
+            sizes = radius / 2.0
+            minor = numpy.sqrt(numpy.maximum(0.0, radius ** 2 - focus_distance ** 2)) / 2.0
+            sizes[minor == 0] = 0.0
+            apart = focus_distance > 0
+            axis_x = numpy.where(apart, (focus_1_x - focus_2_x) / numpy.where(apart, focus_distance, 1.0), 1.0)
+            axis_y = numpy.where(apart, (focus_1_y - focus_2_y) / numpy.where(apart, focus_distance, 1.0), 0.0)
+        sizes[~self.started] = 0.0
+
+        if shape == "circle" or shape == "ellipse":
+            major_offsets, minor_offsets = numpy.cos(angles), numpy.sin(angles)
+        else:
+            major_offsets, minor_offsets = numpy.array([-1.0, 1.0, 1.0, -1.0]), numpy.array([-1.0, -1.0, 1.0, 1.0])
+        a = sizes[:, None] * major_offsets
+        b = minor[:, None] * minor_offsets
+        points = numpy.empty((len(sizes), len(major_offsets), 2))
+        points[..., 0] = centers[:, 0, None] + a * axis_x[:, None] - b * axis_y[:, None]
+        points[..., 1] = centers[:, 1, None] + a * axis_y[:, None] + b * axis_x[:, None]
+        return points, centers, sizes
+
+    def draw(self, surface, view, size, variant, colors):
+        """
+        Draws the outlines of a variant of the nodes shown on a display of size through a View (see lib.view),
+        in a colour, or a colour by node (a list by row)
+        """
+        import pygame
+
+        points, centers, sizes = self.outlines(variant)
+        bounds = view.world_bounds(size)
+        visible = numpy.flatnonzero((centers[:, 0] + sizes >= bounds[0]) & (centers[:, 0] - sizes <= bounds[2]) &
+                                    (centers[:, 1] + sizes >= bounds[1]) & (centers[:, 1] - sizes <= bounds[3]) &
+                                    self.started)
+        if not visible.size:
+            return
+        origin = numpy.array(view.origin)
+        pixels = numpy.floor((points[visible] - origin) * view.scale).astype(numpy.int64).tolist()
+        markers = numpy.floor((centers[visible] - origin) * view.scale).astype(numpy.int64).tolist()
+        outlined = (sizes[visible] * view.scale >= self.MARKER_PIXELS).tolist()
+        single = isinstance(colors, tuple)
+        for row, outline, marker, large in zip(visible.tolist(), pixels, markers, outlined):
+            color = colors if single else colors[row]
+            if large:
+                pygame.draw.lines(surface, color, True, outline)
+            else:
+                surface.fill(color, (marker[0] - 1, marker[1] - 1, 2, 2))
+
+    def get_state(self):
+        """ Returns (keys, next update, {name: array copy}) of the variants """
+        return (list(self.keys), self.next_update,
+                dict((name, getattr(self, name).copy()) for name in self.STATE_ARRAYS))
+
+    def set_state(self, keys, next_update, arrays):
+        """ Restores a state returned by get_state """
+        self.keys = []
+        self._allocate(0)
+        self._set_keys(list(keys))
+        self.next_update = next_update
+        for name in self.STATE_ARRAYS:
+            getattr(self, name)[:] = arrays[name]
+
+    def clear(self):
+        self.keys = []
+        self.next_update = None
+        self._allocate(0)
@@ -0,0 +1,90 @@
+"""
+Mapping of the simulated world (pixels of the simulation area) onto a render surface.
+
+The simulation always works in world coordinates. Scene objects draw through a View, which
+offsets and scales positions, lengths and images. The offset and a zoom factor are the camera
+(the world can be larger than the display), the render scale renders the scene at a lower
+internal resolution (then scaled to the display) without changing the simulation.
+"""
+import math
+
+import pygame
+
+
+class View(object):
+
+    """
+    World to render surface transformation with a cache of scaled images. A world point p is drawn
+    at (p - origin) * scale, where scale is the render scale times the zoom of the camera.
+    """
+
+    def __init__(self, scale=1.0):
+        self.render_scale = scale
+        self.zoom = 1.0
+        self.origin = (0.0, 0.0)  # World point at the top left corner of the render surface
+        self.scale = scale
+        self.images = {}  # Image -> image scaled by self.scale
+
+    def set_scale(self, scale):
+        """ Sets the render scale (render surface pixels per display pixel) """
+        self.render_scale = scale
+        self._set_scale(scale * self.zoom)
+
+    def set_camera(self, origin, zoom):
+        """ Sets the world point at the top left corner and the zoom (display pixels per world pixel) """
+        self.origin = (float(origin[0]), float(origin[1]))
+        self.zoom = zoom
+        self._set_scale(self.render_scale * zoom)
+
+    def _set_scale(self, scale):
+        if scale != self.scale:
+            self.scale = scale
+            self.images.clear()
+
+    def is_identity(self):
+        """ Whether world points are drawn at the same pixels of the display """
+        return self.zoom == 1.0 and self.origin == (0.0, 0.0)
+
+    def transform(self, point):
+        """ Render surface coordinates (floats) of a world point """
+        return (point[0] - self.origin[0]) * self.scale, (point[1] - self.origin[1]) * self.scale
+
+    def point(self, point):
+        """ Render surface pixel of a world point """
+        return (int(math.floor((point[0] - self.origin[0]) * self.scale)),
+                int(math.floor((point[1] - self.origin[1]) * self.scale)))
+
+    def scaled_point(self, point):
+        """ Pixel of a world point without the camera offset (point(p) is about scaled_point(p) - offset()) """
+        return int(math.floor(point[0] * self.scale)), int(math.floor(point[1] * self.scale))
+
+    def offset(self):
+        """ Pixel offset of the camera origin """
+        return int(math.floor(self.origin[0] * self.scale)), int(math.floor(self.origin[1] * self.scale))
+
+    def display_to_world(self, position):
+        """ World point under a display pixel """
+        return self.origin[0] + position[0] / self.zoom, self.origin[1] + position[1] / self.zoom
+
+    def world_bounds(self, size):
+        """ World bounds (left, top, right, bottom) shown on a display of size """
+        return (self.origin[0], self.origin[1],
+                self.origin[0] + size[0] / self.zoom, self.origin[1] + size[1] / self.zoom)
+
+    def length(self, length):
+        return length * self.scale
+
+    def image(self, image):
+        """ Returns image scaled to the view (scaled once per image and scale) """
+        if self.scale == 1.0:
+            return image
+        scaled = self.images.get(image)
+        if scaled is None:
+            width, height = image.get_size()
+            scaled = self.images[image] = pygame.transform.scale(
+                image, (max(1, int(round(width * self.scale))), max(1, int(round(height * self.scale)))))
+        return scaled
+
+    def blit(self, surface, image, position):
+        """ Draws image with its top left corner at a world position """
+        surface.blit(self.image(image), self.point(position))
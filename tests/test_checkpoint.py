@@ -0,0 +1,172 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import demo
+from lib import checkpoint
+from lib.checkpoint import (read_checkpoint, write_checkpoint, encode_strings, decode_strings, python_random_state,
+                            set_python_random_state)
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state.phck")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """ Metadata and arrays of any dtype and shape are read back as written """
+        metadata = {"names": ["green", "red"], "tick": 12, "accumulator": 0.25, "nested": {"a": [1, 2]}}
+        arrays = {"float": numpy.arange(12, dtype=numpy.float64).reshape(3, 4) / 7.0,
+                  "int": numpy.array([-1, 0, 2 ** 40], dtype=numpy.int64),
+                  "uint": numpy.array([2 ** 64 - 1, 3], dtype=numpy.uint64),
+                  "bool": numpy.array([[True, False]]),
+                  "big_endian": numpy.array([1.5, 2.5], dtype=">f4"),
+                  "empty": numpy.zeros((0, 5)),
+                  "nan": numpy.array([numpy.nan, numpy.inf])}
+        write_checkpoint(self.path, metadata, arrays)
+        read_metadata, read_arrays = read_checkpoint(self.path)
+        self.assertEqual(read_metadata, metadata)
+        self.assertEqual(sorted(read_arrays), sorted(arrays))
+        for name, values in arrays.iteritems():
+            numpy.testing.assert_array_equal(read_arrays[name], values)
+            self.assertEqual(read_arrays[name].shape, values.shape)
+        self.assertEqual(os.listdir(self.directory), ["state.phck"])
+
+    def test_invalid_files(self):
+        write_checkpoint(self.path, {"tick": 1}, {"values": numpy.arange(100.0)})
+        with open(self.path, "rb") as checkpoint_file:
+            data = checkpoint_file.read()
+        version = checkpoint.HEADER.unpack_from(data)[1]
+        for invalid in (data[:-8], data[:5], "XXXX" + data[4:],
+                        checkpoint.HEADER.pack(checkpoint.MAGIC, version + 1, 1, 10) + data[checkpoint.HEADER.size:]):
+            with open(self.path, "wb") as checkpoint_file:
+                checkpoint_file.write(invalid)
+            with self.assertRaises(ValueError):
+                read_checkpoint(self.path)
+
+    def test_failed_write_leaves_no_file(self):
+        with self.assertRaises(TypeError):
+            write_checkpoint(self.path, {"tick": object()}, {})
+        with self.assertRaises(TypeError):
+            write_checkpoint(self.path, {}, {5: numpy.arange(3)})
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_strings_and_random_states(self):
+        values = ["event", "periodic", "event", "event"]
+        table, indices = encode_strings(values)
+        self.assertEqual(decode_strings(table, indices), values)
+
+        rngs = [random.Random(seed) for seed in (1, 2)]
+        rngs[1].gauss(0, 1)  # Keeps a cached gaussian
+        words, gauss = python_random_state(rngs)
+        expected = [(rng.random(), rng.gauss(0, 1)) for rng in rngs]
+        for index, seed in enumerate((5, 6)):
+            rng = random.Random(seed)
+            set_python_random_state(rng, rngs[0].getstate()[0], words[index], gauss[index])
+            self.assertEqual((rng.random(), rng.gauss(0, 1)), expected[index])
+
+
+class SimulationStateTest(unittest.TestCase):
+
+    """ Checkpoints of a headless demo with every optional state """
+
+    ARGUMENTS = ["--headless", "--no-cache", "--seed", "3", "--nodes", "12", "--mobility", "group",
+                 "--node-mobility", "red=levy-walk", "--avoidable-places", "4", "--heatmap", "64", "--overlaps",
+                 "--habitat-variant", "n=5,beta=10,shape=circle", "--keyframe-every", "1"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state.phck")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def control(self, *arguments):
+        from lib.privhab import Control
+        exposure_report = os.path.join(self.directory, "exposure.csv")
+        return Control(demo.get_parser().parse_args(self.ARGUMENTS + ["--exposure-report", exposure_report] +
+                                                    list(arguments)))
+
+    def run_steps(self, control, steps):
+        for _ in xrange(steps):
+            control.step()
+
+    def assertStatesEqual(self, state, expected):
+        self.assertEqual(state[0], expected[0])
+        self.assertEqual(sorted(state[1]), sorted(expected[1]))
+        for name, values in expected[1].iteritems():
+            numpy.testing.assert_array_equal(state[1][name], values, err_msg=name)
+
+    def test_restored_run_continues_exactly(self):
+        """ A run restored from a checkpoint file goes on exactly as the run that wrote it """
+        original = self.control()
+        self.run_steps(original, 300)
+        original.save_checkpoint(self.path)
+        restored = self.control("--seed", "4")
+        restored.load_checkpoint(self.path)
+        self.assertStatesEqual(restored.get_simulation_state(), original.get_simulation_state())
+        self.run_steps(original, 300)
+        self.run_steps(restored, 300)
+        self.assertStatesEqual(restored.get_simulation_state(), original.get_simulation_state())
+
+    def test_tick_rate(self):
+        """ A --tick-rate given on the command line replaces the one of the checkpoint, with the same time """
+        original = self.control()
+        self.run_steps(original, 100)
+        original.save_checkpoint(self.path)
+        restored = self.control("--tick-rate", "25")
+        restored.load_checkpoint(self.path)
+        self.assertEqual(restored.tick_rate, 25)
+        self.assertAlmostEqual(restored.get_sim_time(), original.get_sim_time(), delta=1 / 25.0)
+        self.assertEqual(restored.timeline.interval, 25)
+        self.run_steps(restored, 100)
+
+        # Without --tick-rate the checkpoint keeps its own
+        restored = self.control()
+        restored.load_checkpoint(self.path)
+        self.assertEqual((restored.tick_rate, restored.tick), (original.tick_rate, original.tick))
+
+    def test_version_1(self):
+        """ A version 1 file, without the fields added since, is upgraded and goes on """
+        original = self.control()
+        self.run_steps(original, 100)
+        metadata, arrays = original.get_simulation_state()
+        # Version 1 had a RandomState for the mobility engine instead of per agent streams
+        rng = numpy.random.RandomState(5)
+        _, keys, position, has_gauss, cached_gaussian = rng.get_state()
+        arrays["mobility.random.keys"] = keys
+        arrays["mobility.random.values"] = numpy.array([position, has_gauss, cached_gaussian], dtype=numpy.float64)
+        for name in list(arrays):
+            if name.startswith(("heatmap.", "exposure.", "variants.")) or \
+                    name in ("node.state_samples", "mobility.stream_key", "mobility.stream_count",
+                             "mobility.group.reference_key", "mobility.group.reference_count"):
+                del arrays[name]
+        metadata["avoidable_place"] = metadata.pop("avoidable_places")[0]
+        for name in ("world_size", "heatmap_weight", "exposure_keys", "variants", "variant_keys",
+                     "variant_next_update"):
+            metadata.pop(name, None)
+        write_checkpoint(self.path, metadata, arrays)
+        with open(self.path, "r+b") as checkpoint_file:
+            header = checkpoint.HEADER.unpack(checkpoint_file.read(checkpoint.HEADER.size))
+            checkpoint_file.seek(0)
+            checkpoint_file.write(checkpoint.HEADER.pack(header[0], 1, *header[2:]))
+
+        restored = self.control()
+        restored.load_checkpoint(self.path)
+        self.assertEqual(restored.tick, original.tick)
+        self.assertEqual(len(restored.avoidable_places), 1)
+        streams = restored.mobility.stream_key[:restored.mobility.count]
+        self.assertEqual(len(numpy.unique(streams)), len(streams))
+        self.run_steps(restored, 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
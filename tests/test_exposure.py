@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from lib.exposure import ExposureTracker
+from lib.overlap import build_region
+
+PLACES = [(0, 0, 100, 100), (300, 300, 400, 350)]
+
+
+def circle(x, y, radius):
+    return build_region((x, y), (1.0, 0.0), radius, radius, False)
+
+
+class ExposureTrackerTest(unittest.TestCase):
+
+    def test_locate(self):
+        tracker = ExposureTracker(PLACES, cell_size=64)
+        positions = numpy.array([(50, 50), (100, 50), (350, 320), (-5, 10), (1000, 1000), (399.5, 349.5)])
+        self.assertEqual(tracker.locate(positions).tolist(), [0, -1, 1, -1, -1, 1])
+
+    def test_counts(self):
+        """ Visits, stays, coverage and exposure of a node walking in and out of a place """
+        tracker = ExposureTracker(PLACES)
+        keys = ["a", "b"]
+        covering = circle(50, 50, 30)
+        elsewhere = circle(700, 700, 30)
+        # Node a stays 3 steps in place 0 covered by its habitat, leaves and comes back uncovered for 2 steps.
+        # Node b covers place 1 from outside of it.
+        steps = [((50, 50), covering), ((60, 50), covering), ((70, 50), covering), ((200, 50), covering),
+                 ((50, 50), elsewhere), ((50, 60), elsewhere)]
+        for position, region in steps:
+            tracker.update(keys, numpy.array([position, (500, 500)], dtype=float), [region, circle(350, 325, 10)],
+                           0.5)
+        rows = dict((row[0], row) for row in tracker.report())
+        self.assertEqual(rows["a"], ("a", 2, 2.5, 1.5, 2.0, 1.5, 0.6, 0))
+        self.assertEqual(rows["b"], ("b", 0, 0.0, 0.0, 3.0, 0.0, 0.0, 1))
+
+    def test_state_and_report(self):
+        """ Counts survive a get_state/set_state round trip and nodes that change """
+        tracker = ExposureTracker(PLACES)
+        keys = ["a", "b"]
+        tracker.update(keys, numpy.array([(50, 50), (320, 320)], dtype=float), [circle(50, 50, 30), None], 1.0)
+        restored = ExposureTracker(PLACES)
+        restored.set_state(*tracker.get_state())
+        self.assertEqual(restored.report(), [(key, ) + row[1:-1] + (0, ) for key, row in zip(keys, tracker.report())])
+
+        restored.update(["b", "c"], numpy.array([(320, 320), (0, 0)], dtype=float), [None, None], 1.0)
+        rows = restored.report()
+        self.assertEqual([row[:3] for row in rows], [("b", 1, 2.0), ("c", 1, 1.0)])
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "exposure.csv")
+            restored.write_report(path)
+            with open(path) as report_file:
+                lines = report_file.read().splitlines()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(lines[0], ",".join(ExposureTracker.REPORT_FIELDS))
+        self.assertEqual(lines[1], "b,1,2.000,2.000,0.000,0.000,0.000,0")
+
+
+if __name__ == "__main__":
+    unittest.main()
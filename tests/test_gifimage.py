@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pygame
+from PIL import Image
+
+from lib.gifimage import FrameStore
+
+COLORS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255), (255, 0, 255)]
+
+
+class SequentialImage(object):
+
+    """ PIL image that, as old PIL does with GIF files, only seeks to the first frame or to the next one """
+
+    def __init__(self, image):
+        self.image = image
+
+    def seek(self, frame):
+        if frame not in (0, self.image.tell() + 1):
+            raise ValueError("cannot seek to frame {0}".format(frame))
+        self.image.seek(frame)
+
+    def __getattr__(self, name):
+        return getattr(self.image, name)
+
+
+class FrameStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        pygame.display.set_mode((8, 6), 0, 32)  # Palettes and alpha surfaces need a display
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "colors.gif")
+        palette = [value for color in COLORS for value in color]
+        frames = []
+        for index in xrange(len(COLORS)):
+            frame = Image.new("P", (8, 6), index)
+            frame.putpalette(palette)
+            frames.append(frame)
+        frames[0].save(self.path, save_all=True, append_images=frames[1:], duration=50, optimize=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_frames_in_any_order(self):
+        """ Frames dropped and read again in any order, with sequential seeks only, have the right pixels """
+        store = FrameStore(self.path, max_bytes=1)
+        store.image = SequentialImage(store.image)
+        self.assertEqual(len(store), len(COLORS))
+        for index in (5, 2, 0, 4, 4, 1, 3, 0, 5):
+            frame = store.get(index)
+            self.assertEqual(tuple(frame.get_at((4, 3)))[:3], COLORS[index])
+            self.assertEqual(list(store.frames), [index])
+
+
+if __name__ == "__main__":
+    unittest.main()
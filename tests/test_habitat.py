@@ -0,0 +1,96 @@
+import random
+import unittest
+
+import pygame
+
+from lib.privhab import Habitat
+
+NODE_SIZE = (20, 30)
+
+
+def stop_and_go(seed=1, samples=400):
+    """ Node positions of a trace that alternates walks (a new position each sample) and stops """
+    rng = random.Random(seed)
+    positions = []
+    position = (500, 400)
+    while len(positions) < samples:
+        for _ in xrange(rng.randint(1, 15)):
+            position = (position[0] + rng.randint(-40, 40), position[1] + rng.randint(-40, 40))
+            positions.append(position)
+        positions.extend([position] * rng.randint(1, 40))
+    return positions[:samples]
+
+
+def run(update_mode, positions, show_last_n_points=True):
+    """ Samples a habitat of update_mode at positions, yields it after each sample """
+    rect = pygame.Rect((0, 0), NODE_SIZE)
+    habitat = Habitat(rect, color="red", update_mode=update_mode, show_last_n_points=show_last_n_points)
+    for position in positions:
+        rect.topleft = position
+        habitat.sample()
+        yield habitat
+
+
+def exact_state(habitat):
+    """ State of a habitat including every deferred sample """
+    if habitat.pending_samples:
+        return habitat.get_deferred_state(habitat.pending_samples)
+    return habitat.state
+
+
+def state_values(state):
+    return state.circle_center + state.focus_1 + state.focus_2 + (state.circle_radius, state.ellipse_radius)
+
+
+class HabitatTest(unittest.TestCase):
+
+    def assertStatesEqual(self, state, expected, delta):
+        for value, expected_value in zip(state_values(state), state_values(expected)):
+            self.assertAlmostEqual(value, expected_value, delta=delta)
+
+    def test_stationary_closed_form(self):
+        """ k updates at the same location in closed form match k EWMA updates """
+        for k in (1, 2, 7, 50):
+            periodic = list(run("periodic", stop_and_go()[:20] + [(100, 100)] * k))[-1]
+            closed_form = list(run("periodic", stop_and_go()[:20]))[-1]
+            closed_form.node_rect.topleft = (100, 100)
+            closed_form.update_stationary(closed_form.get_center(), k)
+            self.assertStatesEqual(closed_form.state, periodic.state, 1e-9)
+            self.assertEqual(closed_form.state.last_n_points, periodic.state.last_n_points)
+
+    def test_event_mode_matches_periodic(self):
+        """ Over a stop-and-go trace, event mode gives the periodic states (published ones within tolerance) """
+        positions = stop_and_go()
+        for show_last_n_points in (False, True):
+            for event, periodic in zip(run("event", positions, show_last_n_points),
+                                       run("periodic", positions, show_last_n_points)):
+                self.assertStatesEqual(exact_state(event), periodic.state, 1e-9)
+                self.assertEqual(exact_state(event).last_n_points, periodic.state.last_n_points)
+                self.assertStatesEqual(event.published_state(), periodic.state, Habitat.PUBLISH_TOLERANCE)
+
+    def test_settled_habitat_keeps_its_state(self):
+        """ Once a stopped habitat settles, it keeps publishing the same state and region """
+        habitats = run("event", stop_and_go()[:30] + [(300, 300)] * 4000)
+        for _ in xrange(2500):
+            habitat = next(habitats)
+        state, region = habitat.published_state(), habitat.get_region()
+        for habitat in habitats:
+            self.assertIs(habitat.published_state(), state)
+            self.assertIs(habitat.get_region(), region)
+        self.assertEqual(habitat.pending_samples, 3999)
+
+    def test_last_n_points_keep_the_region(self):
+        """ While a node stopped a pixel away fills its last N points, the habitat keeps its settled Region """
+        previous_state = previous_region = None
+        kept = 0
+        for habitat in run("event", [(300, 300)] * 3000 + [(301, 300)] * 100):
+            state, region = habitat.published_state(), habitat.get_region()
+            if previous_state is not None and state is not previous_state and state[:6] == previous_state[:6]:
+                self.assertIs(region, previous_region)
+                kept += 1
+            previous_state, previous_region = state, region
+        self.assertGreater(kept, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+import numpy
+
+from lib.ingest import RECORD, HEADER, encode_frame, decode_frames, parse_address, IngestServer
+
+
+def records(*updates):
+    """ RECORD array of (device, time, x, y) updates """
+    return numpy.array(list(updates), dtype=RECORD)
+
+
+class IngestTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        frame = records((1, 10.0, 5.5, 6.5), (2, 11.0, 7.0, 8.0))
+        frames, consumed = decode_frames(encode_frame(frame))
+        self.assertEqual(consumed, HEADER.size + 2 * RECORD.itemsize)
+        self.assertEqual(len(frames), 1)
+        numpy.testing.assert_array_equal(frames[0], frame)
+
+    def test_truncated_frames(self):
+        """ Only complete frames are parsed, split streams give the same records once complete """
+        data = (encode_frame(records((1, 1.0, 1.0, 1.0))) +
+                encode_frame(records((2, 2.0, 2.0, 2.0), (3, 3.0, 3.0, 3.0))))
+        first_size = HEADER.size + RECORD.itemsize
+        for size in (0, 3, HEADER.size, first_size - 1):
+            self.assertEqual(decode_frames(data[:size]), ([], 0))
+        for size in (first_size, len(data) - 1):
+            frames, consumed = decode_frames(data[:size])
+            self.assertEqual((len(frames), consumed), (1, first_size))
+
+        # Fed in small chunks as a stream socket delivers them
+        pending, devices = "", []
+        for start in xrange(0, len(data), 7):
+            frames, consumed = decode_frames(pending + data[start:start + 7])
+            pending = (pending + data[start:start + 7])[consumed:]
+            devices.extend(device for frame in frames for device in frame["device"].tolist())
+        self.assertEqual((pending, devices), ("", [1, 2, 3]))
+
+    def test_invalid_frame(self):
+        with self.assertRaises(ValueError):
+            decode_frames("XXXX" + encode_frame(records((1, 1.0, 1.0, 1.0)))[4:])
+
+    def test_coalescing(self):
+        """ Only the newest update of each device is kept until drained """
+        server = IngestServer([])
+        server.add([records((1, 2.0, 20.0, 20.0), (2, 1.0, 5.0, 5.0), (1, 1.0, 10.0, 10.0)),
+                    records((1, 3.0, 30.0, 30.0))])
+        server.add([records((2, 0.5, 1.0, 1.0))])
+        self.assertEqual(server.drain(), {1: (3.0, 30.0, 30.0), 2: (1.0, 5.0, 5.0)})
+        self.assertEqual(server.received, 5)
+        self.assertEqual(server.drain(), {})
+
+    def test_non_finite_positions(self):
+        """ Updates with NaN or infinite positions are counted but dropped, they don't hide older valid ones """
+        server = IngestServer([])
+        server.add([records((1, 1.0, 10.0, 10.0), (1, 2.0, float("nan"), 5.0), (2, 1.0, 5.0, float("inf")),
+                            (3, 1.0, float("-inf"), float("nan")))])
+        self.assertEqual(server.drain(), {1: (1.0, 10.0, 10.0)})
+        server.add([records((2, 1.0, float("nan"), 1.0))])
+        self.assertEqual(server.drain(), {})
+        self.assertEqual(server.received, 5)
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("udp://:7070"), ("udp", ("127.0.0.1", 7070)))
+        self.assertEqual(parse_address("tcp://0.0.0.0:80"), ("tcp", ("0.0.0.0", 80)))
+        self.assertEqual(parse_address("unix:///tmp/ingest"), ("unix", "/tmp/ingest"))
+        with self.assertRaises(ValueError):
+            parse_address("http://localhost:80")
+
+
+if __name__ == "__main__":
+    unittest.main()
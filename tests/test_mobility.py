@@ -0,0 +1,82 @@
+import unittest
+
+import numpy
+import pygame
+
+from lib.mobility import MobilityEngine, HOME, WORKPLACE
+
+BOUNDS = (1024, 768)
+SIZE = (20, 30)
+KEYS = [0x1234, 0xFFFFFFFFFFFFFFFF, 7, 2 ** 63 + 5]
+
+
+class MobilityEngineTest(unittest.TestCase):
+
+    def add_agents(self, engine, count):
+        """ Adds count agents with home and workplace areas inside the bounds """
+        for index in xrange(count):
+            home = pygame.Rect(50 + 40 * index, 60, 250, 250)
+            workplace = pygame.Rect(600 - 20 * index, 450, 250, 250)
+            agent = engine.add_agent(home.center, SIZE, 100)
+            engine.set_area(agent, HOME, home)
+            engine.set_area(agent, WORKPLACE, workplace)
+
+    def test_agents_stay_in_bounds_and_areas(self):
+        """ Agents walk to targets inside their home or workplace area and keep their sprites inside bounds """
+        engine = MobilityEngine()
+        self.add_agents(engine, 10)
+        start = engine.position[:engine.count].copy()
+        for tick in xrange(3000):
+            engine.step(1.0 / 60, tick / 60.0, BOUNDS)
+            left_top = numpy.trunc(engine.position[:engine.count]) - numpy.array(SIZE) // 2
+            self.assertTrue(numpy.all(left_top >= 0))
+            self.assertTrue(numpy.all(left_top <= numpy.array(BOUNDS) - SIZE))
+            areas = engine.areas[numpy.arange(engine.count), engine.area[:engine.count]]
+            target = engine.target[:engine.count]
+            self.assertTrue(numpy.all((target >= areas[:, :2]) & (target <= areas[:, 2:4])))
+        self.assertFalse(numpy.array_equal(engine.position[:engine.count], start))
+
+    def test_inactive_agents_do_not_move(self):
+        engine = MobilityEngine()
+        self.add_agents(engine, 3)
+        engine.set_active(1, False)
+        start = engine.get_position(1).copy()
+        for tick in xrange(600):
+            engine.step(1.0 / 60, tick / 60.0, BOUNDS)
+        numpy.testing.assert_array_equal(engine.get_position(1), start)
+        self.assertFalse(engine.moved[1])
+
+
+    def run_engine(self, models, steps=600, dt=1.0 / 60):
+        engine = MobilityEngine()
+        for index, (key, model) in enumerate(zip(KEYS, models)):
+            engine.add_agent((100 + 200 * index, 300), (20, 30), 100, model=model, key=key)
+        trajectory = []
+        for tick in xrange(steps):
+            engine.step(dt, tick * dt, BOUNDS)
+            trajectory.append(engine.position[:engine.count].copy())
+        return numpy.array(trajectory)
+
+    def test_agent_paths_do_not_depend_on_other_agents(self):
+        """ Changing the model of some agents leaves the path of the others unchanged """
+        expected = self.run_engine(["random-waypoint", "levy-walk", "random-waypoint", "levy-walk"])
+        changed = self.run_engine(["random-waypoint", "random-waypoint", "random-waypoint", "group"])
+        numpy.testing.assert_array_equal(changed[:, 0], expected[:, 0])
+        numpy.testing.assert_array_equal(changed[:, 2], expected[:, 2])
+        self.assertFalse(numpy.array_equal(changed[:, 1], expected[:, 1]))
+
+    def test_restored_state_continues_exactly(self):
+        """ An engine restored from get_state draws the same values as the original one """
+        engine = MobilityEngine()
+        for index, key in enumerate(KEYS):
+            engine.add_agent((100 + 200 * index, 300), (20, 30), 100, model="levy-walk", key=key)
+        for tick in xrange(100):
+            engine.step(1.0 / 60, tick / 60.0, BOUNDS)
+        restored = MobilityEngine()
+        restored.set_state(engine.get_state())
+        indices = numpy.arange(len(KEYS))
+        numpy.testing.assert_array_equal(restored.random_sample(indices, 3), engine.random_sample(indices, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+import numpy
+
+from lib.navigation import NavigationGrid
+
+WORLD_SIZE = (1024, 768)
+OBSTACLES = [(300, 200, 400, 600), (600, 100, 700, 400), (100, 500, 500, 560)]
+
+
+class NavigationGridTest(unittest.TestCase):
+
+    def test_detour_around_obstacle(self):
+        """ An agent right of an obstacle heading to its left goes around it, not into it """
+        grid = NavigationGrid(WORLD_SIZE, OBSTACLES)
+        positions = numpy.array([[450.0, 400.0], [900.0, 700.0]])
+        targets = numpy.array([[200.0, 400.0], [50.0, 50.0]])
+        directions = grid.directions(positions, targets)
+        self.assertEqual(directions[0, 0], 0)
+        self.assertNotEqual(directions[0, 1], 0)
+
+    def test_paths_reach_the_target_area(self):
+        """ Following the moves cell by cell reaches the area of the target without entering obstacles """
+        grid = NavigationGrid(WORLD_SIZE, OBSTACLES)
+        rng = numpy.random.RandomState(1)
+        cell_size = grid.cell_size
+        for _ in xrange(20):
+            cell = numpy.array([rng.randint(grid.shape[0]), rng.randint(grid.shape[1])])
+            target = rng.random_sample(2) * WORLD_SIZE
+            if grid.blocked[tuple(cell)] or grid.blocked[tuple((target // cell_size).astype(int))]:
+                continue
+            target_area = (target // cell_size).astype(int) // grid.area_cells
+            for _ in xrange(grid.blocked.size):
+                position = (cell + 0.5) * cell_size
+                direction = grid.directions(position[None], target[None])[0]
+                if not direction.any():
+                    break
+                cell += numpy.sign(direction).astype(int)
+                self.assertFalse(grid.blocked[tuple(cell)])
+            numpy.testing.assert_array_equal(cell // grid.area_cells, target_area)
+
+    def test_small_cache_matches_fresh_grid(self):
+        """ Fields dropped and computed again while routing many areas at once give the same directions """
+        rng = numpy.random.RandomState(1)
+        for max_fields in (1, 2, 5):
+            grid = NavigationGrid(WORLD_SIZE, OBSTACLES, max_fields=max_fields)
+            for _ in xrange(10):
+                positions = rng.random_sample((50, 2)) * WORLD_SIZE
+                targets = rng.random_sample((50, 2)) * WORLD_SIZE
+                expected = NavigationGrid(WORLD_SIZE, OBSTACLES).directions(positions, targets)
+                numpy.testing.assert_array_equal(grid.directions(positions, targets), expected)
+                self.assertLessEqual(len(grid.slot_area), max_fields)
+
+
+if __name__ == "__main__":
+    unittest.main()
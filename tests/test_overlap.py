@@ -0,0 +1,73 @@
+import math
+import unittest
+
+from lib.overlap import OverlapMatrix, build_region
+
+
+def circle(x, y, radius):
+    return build_region((x, y), (1.0, 0.0), radius, radius, False)
+
+
+def box(x, y, half_size):
+    return build_region((x, y), (1.0, 0.0), half_size, half_size, True)
+
+
+def lens_area(radius, distance):
+    """ Intersection area of two circles of the same radius """
+    return 2 * radius ** 2 * math.acos(distance / (2.0 * radius)) - distance / 2.0 * math.sqrt(
+        4 * radius ** 2 - distance ** 2)
+
+
+class OverlapMatrixTest(unittest.TestCase):
+
+    def test_areas(self):
+        """ Sampled areas are close to the exact ones, symmetric and only stored for overlapping pairs """
+        matrix = OverlapMatrix()
+        matrix.update({"a": circle(100, 100, 50), "b": circle(160, 100, 50), "c": circle(400, 400, 30),
+                       "d": box(100, 100, 20), "e": None})
+        self.assertAlmostEqual(matrix.overlap("a", "b"), lens_area(50, 60), delta=0.07 * lens_area(50, 60))
+        self.assertEqual(matrix.overlap("a", "b"), matrix.overlap("b", "a"))
+        self.assertAlmostEqual(matrix.overlap("a", "d"), 1600, delta=0.07 * 1600)
+        self.assertAlmostEqual(matrix.iou("a", "d"), 1600 / (math.pi * 2500), delta=0.03)
+        self.assertEqual(matrix.overlap("a", "c"), 0.0)
+        self.assertEqual(matrix.overlap("a", "e"), 0.0)
+        self.assertEqual(sorted(matrix.row("a")), ["b", "d"])
+        self.assertEqual(len(matrix), 3)
+        self.assertEqual(sorted(tuple(sorted(pair[:2])) for pair in matrix.pairs()),
+                         [("a", "b"), ("a", "d"), ("b", "d")])
+
+    def test_updates(self):
+        """ Only changed regions are recomputed, removed ones drop their overlaps """
+        matrix = OverlapMatrix()
+        regions = {"a": circle(100, 100, 50), "b": circle(160, 100, 50), "c": circle(220, 100, 50)}
+        self.assertEqual(len(matrix.update(regions)), 3)
+        self.assertEqual(matrix.update(dict(regions)), [])
+
+        regions["b"] = circle(500, 500, 50)
+        self.assertEqual(matrix.update(regions), ["b"])
+        self.assertEqual(matrix.overlap("a", "b"), 0.0)
+        self.assertEqual(matrix.overlap("b", "c"), 0.0)
+
+        regions["b"] = circle(160, 100, 50)
+        del regions["c"]
+        matrix.update(regions)
+        self.assertEqual(sorted(matrix.regions), ["a", "b"])
+        self.assertEqual(matrix.row("b").keys(), ["a"])
+        self.assertEqual(len(matrix), 1)
+
+    def test_pair_budget(self):
+        """ Rows beyond the pair budget wait in the queue and give the same areas once recomputed """
+        regions = dict((index, circle(100 + 10 * index, 100, 40)) for index in xrange(20))
+        matrix = OverlapMatrix(pair_budget=30)
+        updates = 0
+        while not updates or matrix.pending():
+            matrix.update(regions)
+            updates += 1
+        self.assertGreater(updates, 1)
+        expected = OverlapMatrix(pair_budget=1000)
+        expected.update(regions)
+        self.assertEqual(sorted(matrix.pairs()), sorted(expected.pairs()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import numpy
+
+from lib.timeline import Timeline, state_size
+
+
+def state(tick, size=1000):
+    """ Simulation state of about size bytes """
+    return {"tick": tick}, {"values": numpy.zeros(size // 8)}
+
+
+class TimelineTest(unittest.TestCase):
+
+    def assertBytesCounted(self, timeline):
+        """ bytes is the size of the kept keyframes and inputs, and no input is older than the first keyframe """
+        inputs = sum(size for inputs in timeline.inputs.itervalues() for _, _, size in inputs)
+        self.assertEqual(timeline.bytes, inputs + sum(state_size(keyframe) for keyframe, _ in timeline.keyframes))
+        self.assertLessEqual(timeline.bytes, timeline.max_bytes)
+        self.assertTrue(all(tick >= timeline.get_start() for tick in timeline.inputs))
+
+    def test_keyframes_get_sparser(self):
+        """ Without inputs, keyframes are thinned and still cover the whole run """
+        timeline = Timeline(10, max_bytes=20000)
+        for tick in xrange(0, 2000):
+            if timeline.due(tick):
+                timeline.add_keyframe(tick, state(tick))
+            self.assertBytesCounted(timeline)
+        self.assertEqual(timeline.get_start(), 0)
+        self.assertGreater(timeline.interval, 10)
+        self.assertEqual(timeline.keyframe_before(1999)[0], timeline.ticks[-1])
+
+    def test_inputs_are_bounded(self):
+        """ Inputs count against max_bytes, once they take most of it the oldest keyframes and inputs go """
+        timeline = Timeline(10, max_bytes=20000)
+        positions = dict((device, (0.0, 1.0, 2.0)) for device in xrange(5))
+        for tick in xrange(0, 2000):
+            if timeline.due(tick):
+                timeline.add_keyframe(tick, state(tick))
+            timeline.record(tick, "positions", positions)
+            self.assertBytesCounted(timeline)
+        self.assertGreater(timeline.get_start(), 0)
+        keyframe_tick = timeline.keyframe_before(1999)[0]
+        for tick in xrange(keyframe_tick, 2000):
+            self.assertEqual(timeline.inputs_at(tick), [("positions", positions)])
+
+    def test_truncate(self):
+        timeline = Timeline(10)
+        for tick in xrange(0, 100):
+            if timeline.due(tick):
+                timeline.add_keyframe(tick, state(tick))
+            timeline.record(tick, "keys", (True, False, False, False))
+        timeline.truncate(45)
+        self.assertEqual(timeline.ticks, [0, 10, 20, 30, 40])
+        self.assertEqual(max(timeline.inputs), 44)
+        self.assertEqual(timeline.head, 45)
+        self.assertBytesCounted(timeline)
+
+
+if __name__ == "__main__":
+    unittest.main()